@@ -561,7 +561,7 @@ def save_as_rtable(
 ):
     from functools import partial
 
-    from birdnet_analyzer.audio import get_audio_info
+    from birdnet_analyzer.audio import get_audio_infos
     from birdnet_analyzer.utils import load_codes
 
     def read_high_freq(file_path, sig_fmax, bandpass_fmax, audio_speed, file_infos):
@@ -572,7 +572,7 @@ def save_as_rtable(
     df = df.copy()
     codes = load_codes()
     files = df["input"].unique()
-    file_infos = {file: get_audio_info(file) for file in files}
+    file_infos = get_audio_infos(files)
     n_rows = df.shape[0]
     df["Selection"] = list(range(1, n_rows + 1))
     df["View"] = ["Spectrogram 1"] * n_rows
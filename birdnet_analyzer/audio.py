@@ -1,15 +1,31 @@
 """Module containing audio helper functions."""
 
-from math import isclose
+from contextlib import suppress
+from functools import lru_cache
+from math import gcd, isclose
 
 import librosa
 import numpy as np
 import soundfile as sf
-from scipy.signal import find_peaks, lfilter
+from scipy.signal import butter, find_peaks, sosfilt
 
 import birdnet_analyzer.config as cfg
 
 RANDOM = np.random.RandomState(cfg.RANDOM_SEED)
+# Seconds of audio decoded per read when streaming a file.
+STREAM_BLOCK_S = 10.0
+# Seconds of audio per chunk handed to the consumers of a streamed file.
+STREAM_CHUNK_S = 60.0
+# soxr quality presets by resampler name, from best to fastest.
+SOXR_QUALITIES = {
+    "soxr_vhq": "VHQ",
+    "soxr_hq": "HQ",
+    "soxr_mq": "MQ",
+    "soxr_lq": "LQ",
+    "soxr_qq": "QQ",
+}
+RESAMPLERS = (*SOXR_QUALITIES, "polyphase")
+DEFAULT_RESAMPLER = "soxr_hq"
 
 
 def open_audio_file(
@@ -22,10 +38,13 @@ def open_audio_file(
     speed=1.0,
     sig_fmin=0,
     sig_fmax=15000,
+    resampler=DEFAULT_RESAMPLER,
 ):
     """Open an audio file.
 
-    Opens an audio file with librosa and the given settings.
+    Opens an audio file with librosa at its native sample rate and brings it to the
+    requested rate in a single resampling step. The speed factor is folded into that
+    step by pretending the file was recorded at ``native rate * speed``.
 
     Args:
         path: Path to the audio file.
@@ -37,61 +56,369 @@ def open_audio_file(
         sig_fmin: Minimum frequency of the original signal.
         sig_fmax: Maximum frequency of the original signal.
         speed: Speed factor for audio playback.
+        resampler: One of RESAMPLERS, see :func:`resample`.
 
     Returns:
         Returns the audio time series and the sampling rate.
     """
     # Open file with librosa (uses ffmpeg or libav)
-    if speed == 1.0:
-        sig, rate = librosa.load(
-            path,
-            sr=sample_rate,
-            offset=offset,
-            duration=duration,
-            mono=True,
-            res_type="kaiser_fast",
+    sig, rate = librosa.load(path, sr=None, offset=offset, duration=duration, mono=True)
+
+    # Resample with "fake" sample rate
+    in_rate = int(rate * speed) if speed != 1.0 else rate
+    rate = sample_rate or in_rate
+    sig = resample(sig, in_rate, rate, resampler)
+
+    # Bandpass filter
+    if fmin is not None and fmax is not None:
+        sig = bandpass(sig, rate, fmin, fmax, sig_fmin=sig_fmin, sig_fmax=sig_fmax)
+        # sig = bandpassKaiserFIR(sig, rate, fmin, fmax)
+
+    return sig, rate
+
+
+def resample(sig, orig_sr: int, target_sr: int, resampler=DEFAULT_RESAMPLER):
+    """Resamples a signal.
+
+    The soxr resamplers trade quality for speed from "soxr_vhq" down to "soxr_qq".
+    "polyphase" uses scipy's polyphase filter with a Kaiser windowed low-pass whose
+    design is cached per ratio, so repeated conversions such as 44.1 kHz to 48 kHz
+    only pay for the filtering.
+
+    Args:
+        sig: The signal.
+        orig_sr: The sample rate of the signal.
+        target_sr: The sample rate to convert to.
+        resampler: One of RESAMPLERS.
+
+    Returns:
+        The resampled float32 signal.
+    """
+    if resampler not in RESAMPLERS:
+        raise ValueError(
+            f"Unknown resampler '{resampler}', choose one of {', '.join(RESAMPLERS)}"
         )
 
-    else:
-        # Load audio with original sample rate
+    sig = np.asarray(sig, dtype="float32")
+
+    if orig_sr == target_sr:
+        return sig
+
+    if resampler == "polyphase":
+        from scipy.signal import resample_poly
+
+        g = gcd(int(orig_sr), int(target_sr))
+        up, down = int(target_sr) // g, int(orig_sr) // g
+
+        return resample_poly(sig, up, down, window=_polyphase_filter(up, down))
+
+    import soxr
+
+    return soxr.resample(sig, orig_sr, target_sr, quality=SOXR_QUALITIES[resampler])
+
+
+@lru_cache(maxsize=16)
+def _polyphase_filter(up: int, down: int):
+    """Designs the anti-aliasing filter resample_poly would use for up / down.
+
+    resample_poly copies the taps before scaling them, so the cached array is safe to
+    share.
+    """
+    from scipy.signal import firwin
+
+    half_len = 10 * max(up, down)
+    h = firwin(2 * half_len + 1, 1.0 / max(up, down), window=("kaiser", 5.0))
+    h = h.astype("float32")
+    h.flags.writeable = False
+
+    return h
+
+
+def _decode_blocks(path: str, offset=0.0, duration=None, block_s=STREAM_BLOCK_S):
+    """Opens an audio file for decoding it block by block.
+
+    Formats libsndfile cannot read (e.g. m4a) are decoded as a whole by librosa and
+    then handed out in blocks, so they work, but without bounded memory.
+
+    Args:
+        path: Path to the audio file.
+        offset: The starting offset in seconds.
+        duration: Maximum duration of the decoded content in seconds.
+        block_s: The duration of a block in seconds.
+
+    Returns:
+        A tuple ``(rate, blocks)`` of the native sample rate and an iterator of mono
+        float32 blocks.
+    """
+    try:
+        f = sf.SoundFile(path)
+    except sf.SoundFileRuntimeError:
         sig, rate = librosa.load(
             path, sr=None, offset=offset, duration=duration, mono=True
         )
+        blocksize = max(1, int(block_s * rate))
 
-        # Resample with "fake" sample rate
-        sig = librosa.resample(
-            sig,
-            orig_sr=int(rate * speed),
-            target_sr=sample_rate,
-            res_type="kaiser_fast",
+        return rate, (sig[i : i + blocksize] for i in range(0, len(sig), blocksize))
+
+    rate = f.samplerate
+
+    def blocks():
+        with f:
+            start = min(int(offset * rate), f.frames)
+            frames = int(duration * rate) if duration is not None else -1
+            f.seek(start)
+
+            for block in f.blocks(
+                blocksize=max(1, int(block_s * rate)),
+                frames=frames,
+                dtype="float32",
+                always_2d=True,
+            ):
+                yield block.mean(axis=1)
+
+    return rate, blocks()
+
+
+def stream_audio_file(
+    path: str,
+    sample_rate=48000,
+    offset=0.0,
+    duration=None,
+    fmin=None,
+    fmax=None,
+    speed=1.0,
+    sig_fmin=0,
+    sig_fmax=15000,
+    resampler=DEFAULT_RESAMPLER,
+):
+    """Decodes, resamples and bandpasses an audio file incrementally.
+
+    The streaming counterpart of :func:`open_audio_file`. The resampler and the filter
+    carry their state from block to block, so the concatenated blocks form one
+    continuous signal: bandpassed exactly like the whole signal would be, and resampled
+    with soxr.
+
+    Args:
+        path: Path to the audio file.
+        sample_rate: The sample rate at which the file should be processed. None keeps
+            the native sample rate.
+        offset: The starting offset.
+        duration: Maximum duration of the loaded content.
+        fmin: Minimum frequency for bandpass filter.
+        fmax: Maximum frequency for bandpass filter.
+        speed: Speed factor for audio playback.
+        sig_fmin: Minimum frequency of the original signal.
+        sig_fmax: Maximum frequency of the original signal.
+        resampler: One of RESAMPLERS. Streams are always resampled with soxr, so
+            "polyphase" uses the "soxr_hq" quality here.
+
+    Returns:
+        A tuple ``(rate, blocks)`` of the output sample rate and an iterator of float32
+        blocks of varying length.
+    """
+    if resampler not in RESAMPLERS:
+        raise ValueError(
+            f"Unknown resampler '{resampler}', choose one of {', '.join(RESAMPLERS)}"
         )
-        rate = sample_rate
 
-    # Bandpass filter
-    if fmin is not None and fmax is not None:
-        sig = bandpass(sig, rate, fmin, fmax, sig_fmin=sig_fmin, sig_fmax=sig_fmax)
-        # sig = bandpassKaiserFIR(sig, rate, fmin, fmax)
+    native_rate, blocks = _decode_blocks(path, offset, duration)
+    in_rate = int(native_rate * speed) if speed != 1.0 else native_rate
+    rate = sample_rate or in_rate
 
-    return sig, rate
+    sos = (
+        _bandpass_sos(rate, fmin, fmax, sig_fmin=sig_fmin, sig_fmax=sig_fmax)
+        if fmin is not None and fmax is not None
+        else None
+    )
+
+    def processed():
+        stream = None
+        zi = np.zeros((sos.shape[0], 2)) if sos is not None else None
+
+        if in_rate != rate:
+            import soxr
+
+            quality = SOXR_QUALITIES.get(resampler, SOXR_QUALITIES[DEFAULT_RESAMPLER])
+            stream = soxr.ResampleStream(
+                in_rate, rate, 1, dtype="float32", quality=quality
+            )
+
+        def process(block, last=False):
+            nonlocal zi
+
+            if stream is not None:
+                block = stream.resample_chunk(block, last=last)
+
+            if sos is not None and block.size:
+                block, zi = sosfilt(sos, block, zi=zi)
+
+            return block.astype("float32", copy=False)
+
+        for block in blocks:
+            yield process(np.ascontiguousarray(block, dtype="float32"))
+
+        if stream is not None:
+            yield process(np.zeros(0, dtype="float32"), last=True)
+
+    return rate, processed()
+
+
+def iter_chunks(
+    path: str,
+    chunk_s=STREAM_CHUNK_S,
+    overlap_s=0.0,
+    sample_rate=48000,
+    offset=0.0,
+    duration=None,
+    fmin=None,
+    fmax=None,
+    speed=1.0,
+    sig_fmin=0,
+    sig_fmax=15000,
+    resampler=DEFAULT_RESAMPLER,
+):
+    """Reads an audio file in fixed-size chunks with bounded memory.
+
+    Chunk ``i`` starts ``i * (chunk_s - overlap_s)`` seconds into the processed signal.
+    All chunks are ``chunk_s`` long, except for the last one, which holds the rest of
+    the signal. See :func:`stream_audio_file` for the processing.
+
+    Args:
+        path: Path to the audio file.
+        chunk_s: The duration of a chunk in seconds.
+        overlap_s: The seconds a chunk repeats from the end of the previous one.
+        sample_rate: The sample rate at which the file should be processed. None keeps
+            the native sample rate.
+        offset: The starting offset.
+        duration: Maximum duration of the loaded content.
+        fmin: Minimum frequency for bandpass filter.
+        fmax: Maximum frequency for bandpass filter.
+        speed: Speed factor for audio playback.
+        sig_fmin: Minimum frequency of the original signal.
+        sig_fmax: Maximum frequency of the original signal.
+        resampler: One of RESAMPLERS.
+
+    Yields:
+        Float32 chunks of the processed signal.
+    """
+    if chunk_s is None or chunk_s <= 0:
+        raise ValueError("Invalid chunk duration")
+    if overlap_s is None or overlap_s < 0 or overlap_s >= chunk_s:
+        raise ValueError("Overlap must be smaller than chunk duration")
+
+    rate, blocks = stream_audio_file(
+        path,
+        sample_rate=sample_rate,
+        offset=offset,
+        duration=duration,
+        fmin=fmin,
+        fmax=fmax,
+        speed=speed,
+        sig_fmin=sig_fmin,
+        sig_fmax=sig_fmax,
+        resampler=resampler,
+    )
+    chunksize = max(1, int(chunk_s * rate))
+    keep = min(int(overlap_s * rate), chunksize - 1)
+
+    yield from _rechunk(blocks, chunksize, keep)
+
+
+def _rechunk(blocks, chunksize, keep):
+    """Regroups blocks of varying length into chunks overlapping by ``keep`` samples."""
+    buffer = np.zeros(0, dtype="float32")
+    # Samples at the start of the buffer that were already part of a yielded chunk
+    seen = 0
+
+    for block in blocks:
+        buffer = np.concatenate((buffer, block)) if buffer.size else block
+
+        while buffer.size >= chunksize:
+            yield buffer[:chunksize]
+            buffer = buffer[chunksize - keep :]
+            seen = keep
+
+    if buffer.size > seen:
+        yield buffer
+
+
+def read_windows(path: str, windows: list[tuple[float, float]], speed=1.0):
+    """Reads several windows of an audio file, opening it only once.
+
+    Each window is read with a seek, like :func:`open_audio_file` with
+    ``sample_rate=None`` would read it, instead of decoding the file for each.
+    Formats libsndfile cannot read (e.g. m4a) are decoded as a whole once.
+
+    Args:
+        path: Path to the audio file.
+        windows: The ``(offset, duration)`` of each window in seconds.
+        speed: Speed factor for audio playback, see :func:`open_audio_file`.
+
+    Returns:
+        A tuple ``(signals, rate)`` of the mono float32 signal of each window and
+        the sample rate to play them at.
+    """
+    try:
+        f = sf.SoundFile(path)
+    except sf.SoundFileRuntimeError:
+        sig, rate = librosa.load(path, sr=None, mono=True)
+        signals = []
+
+        for offset, duration in windows:
+            start = int(offset * rate)
+            signals.append(sig[start : start + int(duration * rate)])
+    else:
+        with f:
+            rate = f.samplerate
+            signals = [np.zeros(0, dtype="float32")] * len(windows)
+
+            # Reading in file order only ever seeks forward.
+            for i in sorted(range(len(windows)), key=lambda i: windows[i][0]):
+                offset, duration = windows[i]
+                f.seek(min(int(offset * rate), f.frames))
+                signals[i] = f.read(
+                    int(duration * rate), dtype="float32", always_2d=True
+                ).mean(axis=1)
+
+    return signals, int(rate * speed) if speed != 1.0 else rate
 
 
 def get_audio_info(path):
     """
     Get basic information about an audio file.
 
+    The header is only read once; later calls are answered from the metadata index
+    in the user data dir until the file changes.
+
     Args:
         path (str): The file path to the audio file.
 
     Returns:
-        dict: A dictionary containing audio file information such as sample rate and
-        duration.
+        dict: A dictionary containing audio file information such as sample rate,
+        number of channels, duration and codec.
+    """
+    from birdnet_analyzer.audio_index import get_index
+
+    return get_index().get(path)
+
+
+def get_audio_infos(paths, ignore_errors: bool = False):
     """
-    info = sf.info(path)
+    Get basic information about many audio files.
 
-    return {
-        "samplerate": info.samplerate,
-        "duration": info.duration,
-    }
+    Files missing from the metadata index are probed in parallel.
+
+    Args:
+        paths (Iterable[str]): The file paths to the audio files.
+        ignore_errors (bool): Leave files that cannot be read out of the result
+            instead of raising.
+
+    Returns:
+        dict: Maps each path to the information returned by get_audio_info.
+    """
+    from birdnet_analyzer.audio_index import get_index
+
+    return get_index().get_many(paths, ignore_errors=ignore_errors)
 
 
 def get_audio_file_length(path):
@@ -104,9 +431,7 @@ def get_audio_file_length(path):
     Returns:
         float: The duration of the audio file in seconds.
     """
-    # Open file with librosa (uses ffmpeg or libav)
-
-    return librosa.get_duration(path=path, sr=None)  # ty:ignore[invalid-argument-type]
+    return get_audio_info(path)["duration"]
 
 
 def get_sample_rate(path: str):
@@ -119,7 +444,7 @@ def get_sample_rate(path: str):
     Returns:
         int: The sample rate of the audio file.
     """
-    return librosa.get_samplerate(path)
+    return get_audio_info(path)["samplerate"]
 
 
 def save_signal(sig, fname: str, rate=48000):
@@ -184,6 +509,10 @@ def split_signal(
 ):
     """Split signal with overlap.
 
+    The splits are a strided view, so no split is copied. Only when the last split
+    runs past the end of the signal is the signal copied once into a buffer that is
+    padded at the tail with noise or zeros.
+
     Args:
         sig: The original signal to be split.
         rate: The sampling rate.
@@ -192,9 +521,73 @@ def split_signal(
         minlen: Minimum length of a split.
         use_noise_for_padding: Whether to use noise for padding.
     Returns:
-        A list of splits.
+        A read-only array of shape (n_splits, seconds * rate), one split per row.
     """
+    data, n_splits, chunksize, stepsize = _pad_for_split(
+        sig, rate, seconds, overlap, minlen, amount, use_noise_for_padding
+    )
+
+    if n_splits == 0:
+        return np.empty((0, chunksize), dtype=data.dtype)
+
+    return _windows(data, n_splits, chunksize, stepsize)
+
+
+def _pad_for_split(
+    sig, rate, seconds, overlap, minlen, amount=None, use_noise_for_padding=False
+):
+    """Lays out the signal for split_signal.
+
+    Returns:
+        A tuple ``(data, n_splits, chunksize, stepsize)``. Split ``i`` is
+        ``data[i * stepsize : i * stepsize + chunksize]``; ``data`` is the signal
+        itself unless it had to be padded.
+    """
+    sig = np.asarray(sig)
+    chunksize, stepsize, n_splits = _split_sizes(
+        sig.size, rate, seconds, overlap, minlen
+    )
+
+    if n_splits == 0:
+        return sig[:0], 0, chunksize, stepsize
+
+    lastchunkpos = (n_splits - 1) * stepsize
+    padsize = lastchunkpos + chunksize - sig.size
+
+    # Pad the tail with noise or an empty signal, so all splits have desired length
+    if padsize > 0:
+        data = np.empty(sig.size + padsize, dtype=sig.dtype)
+        data[: sig.size] = sig
+        data[sig.size :] = 0
+
+        if use_noise_for_padding:
+            # Random noise intensity
+            if amount is None:
+                amount = RANDOM.uniform(0.1, 0.5)
+            # Create Gaussian noise, keep zeros for empty or all negative signals
+            with suppress(ValueError):
+                data[sig.size :] = RANDOM.normal(
+                    loc=sig.min() * amount, scale=sig.max() * amount, size=padsize
+                )
+    else:
+        data = sig
+
+    return data, n_splits, chunksize, stepsize
+
 
+def _split_sizes(size, rate, seconds, overlap, minlen):
+    """Validates the split settings and computes the split layout of a signal.
+
+    Args:
+        size: The number of samples of the signal.
+        rate: The sampling rate.
+        seconds: The duration of a segment.
+        overlap: The overlapping seconds of segments.
+        minlen: Minimum length of a split.
+
+    Returns:
+        A tuple ``(chunksize, stepsize, n_splits)`` in samples.
+    """
     if rate is None or rate <= 0:
         raise ValueError("Invalid sample rate")
     if seconds is None or seconds <= 0:
@@ -216,38 +609,25 @@ def split_signal(
     minsize = int(rate * minlen)
 
     # Start of last chunk
-    lastchunkpos = int((sig.size - chunksize + stepsize - 1) / stepsize) * stepsize
+    lastchunkpos = int((size - chunksize + stepsize - 1) / stepsize) * stepsize
     # Make sure at least one chunk is returned
     if lastchunkpos < 0:
         lastchunkpos = 0
     # Omit last chunk if minimum signal duration is underrun
-    elif sig.size - lastchunkpos < minsize:
+    elif size - lastchunkpos < minsize:
         lastchunkpos = lastchunkpos - stepsize
 
-    # Append noise or empty signal of chunk duration, so all splits have desired length
-    if use_noise_for_padding:
-        # Random noise intensity
-        if amount is None:
-            amount = RANDOM.uniform(0.1, 0.5)
-        # Create Gaussian noise
-        try:
-            noise = RANDOM.normal(
-                loc=min(sig) * amount, scale=max(sig) * amount, size=chunksize
-            ).astype(sig.dtype)
-        except:
-            noise = np.zeros(shape=chunksize, dtype=sig.dtype)
-    else:
-        noise = np.zeros(shape=chunksize, dtype=sig.dtype)
+    if lastchunkpos < 0:
+        return chunksize, stepsize, 0
 
-    data = np.concatenate((sig, noise))
+    return chunksize, stepsize, lastchunkpos // stepsize + 1
 
-    # Split signal with overlap
-    sig_splits = []
-    sig_splits.extend(
-        data[i : i + chunksize] for i in range(0, lastchunkpos + 1, stepsize)
-    )
 
-    return sig_splits
+def _windows(data, n_splits, chunksize, stepsize):
+    """Returns a strided view of the splits laid out in a buffer by _pad_for_split."""
+    windows = np.lib.stride_tricks.sliding_window_view(data, chunksize)
+
+    return windows[::stepsize][:n_splits]
 
 
 def crop_center(sig, rate, seconds):
@@ -271,7 +651,57 @@ def crop_center(sig, rate, seconds):
     return sig
 
 
-def smart_crop_signal(sig, rate, sig_length, sig_overlap, sig_minlen):
+def _window_rms_and_peak(data, n_splits, chunksize, stepsize):
+    """Computes the RMS energy and the peak amplitude of every split.
+
+    Overlapping splits share samples, so the signal is cut into blocks of the greatest
+    common divisor of split and step size, each block is reduced once and the splits
+    are aggregated from their blocks. Every sample is read once, no matter the overlap.
+    If the blocks would get too small, the splits are reduced directly instead.
+
+    Args:
+        data: The buffer laid out by _pad_for_split.
+        n_splits: The number of splits.
+        chunksize: The number of samples per split.
+        stepsize: The number of samples between the starts of two splits.
+
+    Returns:
+        A tuple ``(rms, peak)`` of float arrays with one value per split.
+    """
+    blocksize = gcd(chunksize, stepsize)
+
+    if chunksize // blocksize > 64:
+        splits = _windows(data, n_splits, chunksize, stepsize)
+        power = np.einsum("ij,ij->i", splits, splits).astype(np.float64)
+        peak = np.maximum(splits.max(axis=1), -splits.min(axis=1))
+
+        return np.sqrt(power / chunksize), peak
+
+    blocks_per_split = chunksize // blocksize
+    blocks_per_step = stepsize // blocksize
+    blocks = data[: (n_splits - 1) * stepsize + chunksize].reshape(-1, blocksize)
+
+    block_power = np.einsum("ij,ij->i", blocks, blocks).astype(np.float64)
+    block_peak = np.maximum(blocks.max(axis=1), -blocks.min(axis=1))
+
+    cumulative_power = np.concatenate(([0.0], np.cumsum(block_power)))
+    starts = np.arange(n_splits) * blocks_per_step
+    power = cumulative_power[starts + blocks_per_split] - cumulative_power[starts]
+    peak = _windows(block_peak, n_splits, blocks_per_split, blocks_per_step).max(axis=1)
+
+    return np.sqrt(power / chunksize), peak
+
+
+def smart_crop_signal(
+    sig,
+    rate,
+    sig_length,
+    sig_overlap,
+    sig_minlen,
+    rms_weight=0.7,
+    peak_weight=0.3,
+    smoothing_size=3,
+):
     """Smart crop audio signal based on peak detection.
 
     This function analyzes the audio signal to find peaks in energy/amplitude,
@@ -284,6 +714,10 @@ def smart_crop_signal(sig, rate, sig_length, sig_overlap, sig_minlen):
         sig_length: The desired length of each snippet in seconds.
         sig_overlap: The overlap between snippets in seconds.
         sig_minlen: The minimum length of a snippet in seconds.
+        rms_weight: Weight of the RMS energy of a snippet in its score.
+        peak_weight: Weight of the peak amplitude of a snippet in its score.
+        smoothing_size: Number of snippets the scores are averaged over before
+            searching for peaks.
 
     Returns:
         A list of audio snippets with the highest energy/peaks.
@@ -294,26 +728,37 @@ def smart_crop_signal(sig, rate, sig_length, sig_overlap, sig_minlen):
         return [sig]
 
     # Split the signal into overlapping windows
-    splits = split_signal(sig, rate, sig_length, sig_overlap, sig_minlen)
+    layout = _pad_for_split(sig, rate, sig_length, sig_overlap, sig_minlen)
+    splits = _windows(*layout)
 
     if len(splits) <= 1:
-        return splits
+        return list(splits)
+
+    # Calculate RMS energy and peak values of all windows in one pass
+    rms, peak = _window_rms_and_peak(*layout)
+    # Combine both metrics
+    energies = rms * rms_weight + peak * peak_weight
+
+    # Return the audio segments with the highest energy peaks
+    return list(splits[_select_smart_windows(energies, smoothing_size)])
 
-    # Calculate energy for each window
-    energies = []
-    for split in splits:
-        # Calculate RMS energy
-        energy = np.sqrt(np.mean(split**2))
-        # Also consider peak values
-        peak = np.max(np.abs(split))
-        # Combine both metrics
-        # TODO: Hardcoded weights, could be optimized or made configurable
-        energies.append(energy * 0.7 + peak * 0.3)  # Weighted combination
 
+def _select_smart_windows(energies, smoothing_size=3):
+    """Selects the windows smart cropping keeps, by their energy scores.
+
+    Args:
+        energies: The weighted energy score of every window.
+        smoothing_size: Number of windows the scores are averaged over before
+            searching for peaks.
+
+    Returns:
+        The indices of the selected windows, in the order they should be returned.
+    """
     # Find peaks in the energy curve
     # Smooth energies first to avoid small fluctuations
-    # TODO: kernel size is hardcoded, make it configurable?
-    smoothed_energies = np.convolve(energies, np.ones(3) / 3, mode="same")
+    smoothed_energies = np.convolve(
+        energies, np.ones(smoothing_size) / smoothing_size, mode="same"
+    )
     peaks, _ = find_peaks(
         smoothed_energies, height=np.mean(smoothed_energies), distance=2
     )
@@ -322,20 +767,184 @@ def smart_crop_signal(sig, rate, sig_length, sig_overlap, sig_minlen):
     if len(peaks) < 2:
         # Sort segments by energy and take top segments (up to 3 or 1/3 of total,
         # whichever is more)
-        num_segments = max(3, len(splits) // 3)
-        indices = np.argsort(energies)[-num_segments:]
-        return [splits[i] for i in sorted(indices)]
-
-    # Return the audio segments corresponding to the peaks
-    peak_splits = [splits[i] for i in peaks]
+        num_segments = max(3, len(energies) // 3)
+        return np.sort(np.argsort(energies)[-num_segments:])
 
     # If we have too many peaks, select the strongest ones
-    if len(peak_splits) > 5:
-        peak_energies = [energies[i] for i in peaks]
-        sorted_indices = np.argsort(peak_energies)[::-1]  # Sort in descending order
-        peak_splits = [peak_splits[i] for i in sorted_indices[:5]]  # Take top 5
+    if len(peaks) > 5:
+        sorted_indices = np.argsort(energies[peaks])[::-1]  # Sort in descending order
+        peaks = peaks[sorted_indices[:5]]  # Take top 5
+
+    return peaks
+
+
+def smart_crop_file(
+    path: str,
+    sample_rate,
+    sig_length,
+    sig_overlap,
+    sig_minlen,
+    fmin=None,
+    fmax=None,
+    speed=1.0,
+    rms_weight=0.7,
+    peak_weight=0.3,
+    smoothing_size=3,
+    max_buffer_s=STREAM_CHUNK_S * 10,
+    resampler=DEFAULT_RESAMPLER,
+):
+    """Smart crop an audio file with bounded memory.
+
+    Files up to ``max_buffer_s`` are read into memory and cropped with
+    :func:`smart_crop_signal`. Longer files are streamed twice: once to score every
+    window, once to extract the selected ones. See :func:`stream_audio_file` for the
+    decoding and :func:`smart_crop_signal` for the arguments.
+
+    Returns:
+        A tuple ``(snippets, rate)`` of the audio snippets with the highest
+        energy/peaks and their sample rate.
+    """
+    from collections import deque
+
+    def stream():
+        return stream_audio_file(
+            path,
+            sample_rate=sample_rate,
+            fmin=fmin,
+            fmax=fmax,
+            speed=speed,
+            resampler=resampler,
+        )
+
+    rate, blocks = stream()
+    chunksize, stepsize, _ = _split_sizes(0, rate, sig_length, sig_overlap, sig_minlen)
+    budget = max(int(max_buffer_s * rate), chunksize)
+    buffered = deque()
+    size = 0
+
+    for block in blocks:
+        buffered.append(block)
+        size += block.size
+
+        if size > budget:
+            break
+    else:
+        sig = np.concatenate(buffered) if buffered else np.zeros(0, dtype="float32")
+
+        return smart_crop_signal(
+            sig,
+            rate,
+            sig_length,
+            sig_overlap,
+            sig_minlen,
+            rms_weight,
+            peak_weight,
+            smoothing_size,
+        ), rate
+
+    def drain():
+        while buffered:
+            yield buffered.popleft()
+
+        yield from blocks
+
+    def windows_by_chunk(blocks):
+        """Yields the windows of the signal, as (first index, layout) per chunk."""
+        # Chunks of many whole windows, so a window never spans two chunks
+        per_chunk = max(1, int(STREAM_CHUNK_S * rate) // stepsize)
+        bigsize = (per_chunk - 1) * stepsize + chunksize
+        keep = chunksize - stepsize
+        first = 0
+        size = 0
+        tail = np.zeros(0, dtype="float32")
+
+        for chunk in _rechunk(blocks, bigsize, keep):
+            size += chunk.size if first == 0 else chunk.size - keep
+
+            if chunk.size < bigsize:
+                tail = chunk
+                break
+
+            yield first, (chunk, per_chunk, chunksize, stepsize)
+            first += per_chunk
+            tail = chunk[bigsize - keep :]
+
+        n_splits = _split_sizes(size, rate, sig_length, sig_overlap, sig_minlen)[2]
+
+        if n_splits > first:
+            rest = n_splits - first
+            padded = np.zeros((rest - 1) * stepsize + chunksize, dtype="float32")
+            padded[: tail.size] = tail[: padded.size]
+
+            yield first, (padded, rest, chunksize, stepsize)
+
+    energies = []
+
+    for _, layout in windows_by_chunk(drain()):
+        rms, peak = _window_rms_and_peak(*layout)
+        energies.append(rms * rms_weight + peak * peak_weight)
+
+    energies = np.concatenate(energies)
+    indices = _select_smart_windows(energies, smoothing_size)
+    selected = {}
+
+    for first, layout in windows_by_chunk(stream()[1]):
+        splits = _windows(*layout)
 
-    return peak_splits
+        for i in indices[(indices >= first) & (indices < first + len(splits))]:
+            selected[i] = splits[i - first].copy()
+
+    return [selected[i] for i in indices], rate
+
+
+@lru_cache(maxsize=64)
+def _butter_sos(rate, fmin, fmax, order, btype):
+    """Designs a Butterworth filter in second-order-section form.
+
+    The design only depends on its arguments, so it is memoized: analyses, training and
+    search filter thousands of files or crops with the same few settings.
+
+    Args:
+        rate: The sampling rate.
+        fmin: The lower cutoff frequency, ignored for lowpass filters.
+        fmax: The upper cutoff frequency, ignored for highpass filters.
+        order: The order of the filter.
+        btype: One of "high", "low" or "band".
+
+    Returns:
+        The second-order sections with shape (n_sections, 6). Shared between calls,
+        so they must not be modified.
+    """
+    nyquist = 0.5 * rate
+
+    if btype == "high":
+        wn = fmin / nyquist
+    elif btype == "low":
+        wn = fmax / nyquist
+    else:
+        wn = [fmin / nyquist, fmax / nyquist]
+
+    return butter(order, wn, btype=btype, output="sos")
+
+
+def _bandpass_sos(rate, fmin, fmax, order=5, sig_fmin=0, sig_fmax=15000):
+    """Returns the cached filter for the given band, or None if no filter applies."""
+    if (fmin == sig_fmin and fmax == sig_fmax) or fmin > fmax:
+        return None
+
+    # Highpass?
+    if fmin > sig_fmin and fmax == sig_fmax:
+        return _butter_sos(rate, fmin, fmax, order, "high")
+
+    # Lowpass?
+    if fmin == sig_fmin and fmax < sig_fmax:
+        return _butter_sos(rate, fmin, fmax, order, "low")
+
+    # Bandpass?
+    if fmin > sig_fmin and fmax < sig_fmax:
+        return _butter_sos(rate, fmin, fmax, order, "band")
+
+    return None
 
 
 def bandpass(sig, rate, fmin, fmax, order=5, sig_fmin=0, sig_fmax=15000):
@@ -360,27 +969,9 @@ def bandpass(sig, rate, fmin, fmax, order=5, sig_fmin=0, sig_fmax=15000):
     if (fmin == sig_fmin and fmax == sig_fmax) or fmin > fmax:
         return sig
 
-    from scipy.signal import butter
+    sos = _bandpass_sos(rate, fmin, fmax, order, sig_fmin, sig_fmax)
 
-    nyquist = 0.5 * rate
-
-    # Highpass?
-    if fmin > sig_fmin and fmax == sig_fmax:
-        low = fmin / nyquist
-        b, a = butter(order, low, btype="high")
-        sig = lfilter(b, a, sig)
-
-    # Lowpass?
-    elif fmin == sig_fmin and fmax < sig_fmax:
-        high = fmax / nyquist
-        b, a = butter(order, high, btype="low")
-        sig = lfilter(b, a, sig)
-
-    # Bandpass?
-    elif fmin > sig_fmin and fmax < sig_fmax:
-        low = fmin / nyquist
-        high = fmax / nyquist
-        b, a = butter(order, [low, high], btype="band")
-        sig = lfilter(b, a, sig)
+    if sos is None:
+        return sig.astype("float32")
 
-    return sig.astype("float32")
+    return sosfilt(sos, sig).astype("float32")
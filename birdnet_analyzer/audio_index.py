@@ -0,0 +1,287 @@
+"""Persistent index of audio file metadata.
+
+Reading the duration or sample rate of a file means opening it, and for
+compressed formats the fallback decoders may have to walk the whole stream to
+measure its length. The Raven writer, the GUI file lists and anything that
+estimates work ahead of a run ask the same questions about the same files over
+and over, so the answers are kept in a small SQLite database in the user data
+dir.
+
+Entries are keyed by the absolute path and validated against the file's size and
+mtime: a file edited or replaced in place is probed again. Headers of files that
+are missing from the index are probed in parallel, and the new entries are
+written in a single transaction.
+
+If the database cannot be opened (read-only home directory, locked by another
+process for too long, ...) the index keeps working without persistence.
+"""
+
+from __future__ import annotations
+
+import functools
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 2
+DEFAULT_PROBE_THREADS = 8
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audio_info (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    samplerate INTEGER NOT NULL,
+    channels INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    codec TEXT NOT NULL
+)
+"""
+
+
+def probe_audio_info(path: str) -> dict:
+    """Reads the metadata of an audio file from its header.
+
+    Formats libsndfile can open are read with soundfile, everything else is opened
+    with audioread (ffmpeg or the platform decoder), which reports the duration
+    from the container instead of decoding the samples.
+
+    Args:
+        path (str): The file path to the audio file.
+
+    Returns:
+        dict: The sample rate, number of channels, duration in seconds and codec.
+        The codec is the format and encoding reported by libsndfile, e.g.
+        ``"WAV/PCM_16"``, and the upper case file extension for files opened
+        with audioread, e.g. ``"M4A"``.
+    """
+    import soundfile as sf
+
+    try:
+        info = sf.info(path)
+
+        return {
+            "samplerate": info.samplerate,
+            "channels": info.channels,
+            "duration": info.duration,
+            "codec": f"{info.format}/{info.subtype}",
+        }
+    except sf.SoundFileRuntimeError:
+        import audioread
+
+        with audioread.audio_open(path) as f:
+            return {
+                "samplerate": f.samplerate,
+                "channels": f.channels,
+                "duration": f.duration,
+                "codec": os.path.splitext(path)[1].lstrip(".").upper(),
+            }
+
+
+class AudioIndex:
+    """A SQLite backed cache of :func:`probe_audio_info` results.
+
+    The index can be shared between threads.
+
+    Args:
+        db_path (str | None): Location of the database file. ``None`` keeps the
+            index in memory only.
+        threads (int): Number of threads used to probe uncached files.
+    """
+
+    def __init__(self, db_path: str | None, threads: int = DEFAULT_PROBE_THREADS):
+        self.db_path = db_path
+        self.threads = threads
+        self._lock = threading.Lock()
+        self._conn = self._connect(db_path)
+
+    @staticmethod
+    def _connect(db_path: str | None) -> sqlite3.Connection:
+        if db_path is not None:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+                conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+                if version != SCHEMA_VERSION:
+                    conn.execute("DROP TABLE IF EXISTS audio_info")
+                    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+                conn.execute(_SCHEMA)
+                conn.commit()
+
+                return conn
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(
+                    "Audio metadata index %s is unavailable, not persisting: %s",
+                    db_path,
+                    e,
+                )
+
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        conn.execute(_SCHEMA)
+
+        return conn
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, path: str) -> dict:
+        """Returns the metadata of a single file.
+
+        Args:
+            path (str): The file path to the audio file.
+
+        Returns:
+            dict: The sample rate, number of channels, duration in seconds and
+            codec, see :func:`probe_audio_info`.
+
+        Raises:
+            Exception: Whatever the decoders raise if the file cannot be read.
+        """
+        return self.get_many([path], ignore_errors=False)[path]
+
+    def get_many(
+        self, paths: Iterable[str], *, ignore_errors: bool = False
+    ) -> dict[str, dict]:
+        """Returns the metadata of many files, probing the uncached ones in parallel.
+
+        Args:
+            paths: The file paths to the audio files.
+            ignore_errors (bool): Leave files that cannot be read out of the result
+                instead of raising.
+
+        Returns:
+            dict: Maps each given path to its metadata.
+        """
+        paths = list(dict.fromkeys(paths))
+        keys = {}
+        result = {}
+
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                if ignore_errors:
+                    continue
+                raise
+
+            keys[path] = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+        cached = self._lookup(keys.values())
+        missing = []
+
+        for path, key in keys.items():
+            if key in cached:
+                result[path] = cached[key]
+            else:
+                missing.append(path)
+
+        if missing:
+            probed = self._probe(missing, ignore_errors)
+            self._store([(*keys[path], info) for path, info in probed.items()])
+            result.update(probed)
+
+        return {path: result[path] for path in paths if path in result}
+
+    def _lookup(self, keys: Iterable[tuple[str, int, int]]) -> dict:
+        keys = list(keys)
+        found = {}
+
+        with self._lock:
+            # Stay below SQLite's host parameter limit
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                rows = self._conn.execute(
+                    "SELECT path, size, mtime_ns, samplerate, channels, duration, "
+                    "codec "
+                    f"FROM audio_info WHERE path IN ({','.join('?' * len(batch))})",
+                    [key[0] for key in batch],
+                ).fetchall()
+
+                for path, size, mtime_ns, samplerate, channels, duration, codec in rows:
+                    found[(path, size, mtime_ns)] = {
+                        "samplerate": samplerate,
+                        "channels": channels,
+                        "duration": duration,
+                        "codec": codec,
+                    }
+
+        return found
+
+    def _probe(self, paths: list[str], ignore_errors: bool) -> dict[str, dict]:
+        def probe(path):
+            try:
+                return probe_audio_info(path)
+            except Exception as e:
+                if not ignore_errors:
+                    raise
+                logger.debug("Could not read audio header of %s: %s", path, e)
+                return None
+
+        if len(paths) == 1 or self.threads <= 1:
+            infos = [probe(path) for path in paths]
+        else:
+            with ThreadPoolExecutor(min(self.threads, len(paths))) as executor:
+                infos = list(executor.map(probe, paths))
+
+        return {
+            path: info
+            for path, info in zip(paths, infos, strict=True)
+            if info is not None
+        }
+
+    def _store(self, entries: list[tuple[str, int, int, dict]]):
+        if not entries:
+            return
+
+        rows = [
+            (
+                path,
+                size,
+                mtime_ns,
+                info["samplerate"],
+                info["channels"],
+                info["duration"],
+                info["codec"],
+            )
+            for path, size, mtime_ns, info in entries
+        ]
+
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO audio_info "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+            except sqlite3.Error as e:
+                # Another process may hold the write lock; the entries are simply
+                # probed again next time.
+                logger.debug("Could not update audio metadata index: %s", e)
+
+
+_INDEX_LOCK = threading.Lock()
+
+
+def get_index() -> AudioIndex:
+    """Returns the process wide index stored in the user data dir."""
+    with _INDEX_LOCK:
+        return _open_index()
+
+
+@functools.cache
+def _open_index() -> AudioIndex:
+    from birdnet_analyzer import settings
+
+    return AudioIndex(settings.AUDIO_INDEX_PATH)
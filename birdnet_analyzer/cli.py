@@ -1,5 +1,6 @@
 # ruff: noqa: E501
 import argparse
+import datetime
 import logging
 import os
 from typing import cast, get_args
@@ -324,6 +325,22 @@ def audio_speed_args():
     return p
 
 
+def resampler_args():
+    """Argument parser for the resampling backend (--resampler)."""
+    from birdnet_analyzer.audio import DEFAULT_RESAMPLER, RESAMPLERS
+
+    p = argparse.ArgumentParser(add_help=False)
+
+    p.add_argument(
+        "--resampler",
+        default=DEFAULT_RESAMPLER,
+        choices=RESAMPLERS,
+        help="Resampler used to bring audio to the model's sample rate. The soxr presets go from best ('soxr_vhq') to fastest ('soxr_qq'), 'polyphase' uses scipy's polyphase filter.",
+    )
+
+    return p
+
+
 def threads_args():
     """Argument parser for --threads (default: half the CPU cores, capped at 8)."""
     import multiprocessing
@@ -412,14 +429,21 @@ def computing_resources_args():
     return p
 
 
-def db_args():
-    """Argument parser for the database path (-db/--database)."""
+def db_args(multiple: bool = False):
+    """Argument parser for the database path (-db/--database).
+
+    Args:
+        multiple: Accept several database paths.
+    """
     p = argparse.ArgumentParser(add_help=False)
 
     p.add_argument(
         "-db",
         "--database",
-        help="Path to the database folder.",
+        nargs="+" if multiple else None,
+        help="Paths to the database folders, searched together."
+        if multiple
+        else "Path to the database folder.",
         required=True,
     )
 
@@ -542,7 +566,76 @@ def embeddings_parser():
 
     parser.add_argument(
         "--file_output",
-        help="Saves all embeddings contained in the database in a csv file.",
+        help="Saves all embeddings contained in the database to this file. "
+        "A .csv or .parquet file, or a directory for .npy shards.",
+    )
+
+    parser.add_argument(
+        "--birdnet",
+        dest="version",
+        default="2.4",
+        choices=get_args(ACOUSTIC_MODEL_VERSIONS),
+        help="The BirdNET version that encodes the audio. "
+        "3.0 runs on ONNX and needs no TensorFlow. "
+        "Must match the version of an existing database.",
+    )
+
+    parser.add_argument(
+        "--file_output_format",
+        choices=["csv", "parquet", "npy"],
+        help="Format of the file output. "
+        "Inferred from the extension of --file_output if not set.",
+    )
+
+    parser.add_argument(
+        "--compression",
+        choices=["float16", "int8"],
+        help="Keep a compressed copy of the embeddings to speed up searching. "
+        "Results are re-ranked with the full embeddings.",
+    )
+
+    parser.add_argument(
+        "--pca_dim",
+        type=int,
+        help="Reduce the compressed copy to this many principal components.",
+    )
+
+    parser.add_argument(
+        "--ann_indexes",
+        nargs="+",
+        choices=["cosine", "euclidean"],
+        help="Build approximate nearest neighbour indexes that speed up searching "
+        "with these score functions. Existing indexes are always updated.",
+    )
+
+    return parser
+
+
+def cluster_parser():
+    """Build the argument parser for clustering near-duplicate embeddings."""
+    parser = argparse.ArgumentParser(
+        prog="birdnet-embeddings cluster",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        parents=[db_args(), verbosity_args()],
+    )
+
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.95,
+        help="Cosine similarity from which embeddings are near-duplicates. "
+        "Changing it clusters all embeddings again.",
+    )
+    parser.add_argument(
+        "--file_output",
+        help="Saves the embeddings of the representatives of all clusters to this "
+        "file. A .csv or .parquet file, or a directory for .npy shards.",
+    )
+    parser.add_argument(
+        "--file_output_format",
+        choices=["csv", "parquet", "npy"],
+        help="Format of the file output. "
+        "Inferred from the extension of --file_output if not set.",
     )
 
     return parser
@@ -551,12 +644,23 @@ def embeddings_parser():
 def search_parser():
     """Build the argument parser for searching BirdNET embeddings."""
 
-    parents = [overlap_args(), db_args(), verbosity_args()]
+    parents = [
+        overlap_args(),
+        resampler_args(),
+        db_args(multiple=True),
+        verbosity_args(),
+    ]
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter, parents=parents
     )
 
-    parser.add_argument("-q", "--queryfile", help="Path to the query file.")
+    parser.add_argument(
+        "-q",
+        "--queryfile",
+        nargs="+",
+        help="Path to the query file. Several files or a folder are searched at once, "
+        "with the results of each query in its own folder.",
+    )
     parser.add_argument("-o", "--output", help="Path to the output folder.")
     parser.add_argument(
         "--n_results", default=10, type=int, help="Number of results to return."
@@ -575,6 +679,42 @@ def search_parser():
         choices=["center", "first", "segments"],
         help="Crop mode for the query sample. Can be 'center', 'first' or 'segments'.",
     )
+    parser.add_argument(
+        "--exact",
+        action="store_true",
+        help="Score every embedding instead of using an ANN index or a compressed copy.",
+    )
+    parser.add_argument(
+        "--collapse_duplicates",
+        action="store_true",
+        help="Return only the best result of each cluster of near-duplicate "
+        "embeddings. The clusters are computed by 'birdnet-embeddings cluster'.",
+    )
+    parser.add_argument(
+        "--memory_budget",
+        type=float,
+        help="Memory in MiB the embeddings scored at once by an exhaustive search may "
+        "take. Limits the memory used to search databases larger than it.",
+    )
+    parser.add_argument(
+        "--file_glob",
+        help="Only search the recordings whose path relative to the audio root "
+        "matches this glob, e.g. 'site_x/*'.",
+    )
+    parser.add_argument(
+        "--deployment", help="Only search the recordings of this deployment."
+    )
+    parser.add_argument(
+        "--time_from",
+        type=datetime.datetime.fromisoformat,
+        help="Only search recordings starting at or after this ISO time, e.g. "
+        "2023-05-01. The start of a recording is parsed from its file name.",
+    )
+    parser.add_argument(
+        "--time_to",
+        type=datetime.datetime.fromisoformat,
+        help="Only search recordings starting before this ISO time.",
+    )
 
     parser.add_argument(
         "--audio_root",
@@ -671,6 +811,7 @@ def train_parser():
         parents=[
             bandpass_args(),
             audio_speed_args(),
+            resampler_args(),
             threads_args(),
             bs_args(32),
             overlap_args(
@@ -38,6 +38,8 @@ ALL_MODEL_LANGUAGES: list[str] = sorted(
 GEO_MODEL_LANGUAGES: list[str] = list(VALID_MODEL_LANGUAGES_V3_0)
 
 SCORE_FUNCTIONS = Literal["cosine", "euclidean", "dot"]
+COMPRESSION_MODES = Literal["float16", "int8"]
+ANN_SCORE_FUNCTIONS = Literal["cosine", "euclidean"]
 CROP_MODES = Literal["center", "first", "segments"]
 CODES_FILE: str = os.path.join(SCRIPT_DIR, "eBird_taxonomy_codes_2024E.json")
 ALLOWED_FILETYPES: list[str] = [
@@ -1,3 +1,5 @@
+from birdnet_analyzer.embeddings.clusters import cluster
 from birdnet_analyzer.embeddings.core import create_csv_output, embeddings
+from birdnet_analyzer.embeddings.export import export_embeddings
 
-__all__ = ["create_csv_output", "embeddings"]
+__all__ = ["cluster", "create_csv_output", "embeddings", "export_embeddings"]
@@ -0,0 +1,259 @@
+"""Approximate nearest neighbour indexes for cosine and euclidean search.
+
+The usearch index of a database scores by inner product, so only "dot" searches
+can use it. This module keeps one more usearch index per score function next to
+the database in ``<database>/ann/``:
+
+- ``cosine``: the L2-normalized vectors under the inner product metric, whose
+  nearest vectors are those of the highest cosine similarity.
+- ``euclidean``: the vectors under the squared L2 metric.
+
+An index only proposes candidates, the search ranks them with the exact vectors
+from the database. :meth:`AnnIndex.update` adds the windows added to the database
+since and removes the removed ones; :meth:`AnnIndex.is_current` tells whether an
+index is stale.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import TYPE_CHECKING, get_args
+
+import numpy as np
+
+from birdnet_analyzer.config import ANN_SCORE_FUNCTIONS
+
+if TYPE_CHECKING:
+    from perch_hoplite.db.sqlite_usearch_impl import SQLiteUSearchDB
+    from usearch.index import Index
+
+ANN_DIRNAME = "ann"
+FORMAT_VERSION = 1
+# Windows added to an index at once.
+ADD_BATCH_SIZE = 16_384
+# Candidates taken from an index per requested result and ranked exactly.
+CANDIDATES_FACTOR = 4
+MIN_CANDIDATES = 64
+# Size of the dynamic candidate list of a search, usearch does not save it with an
+# index. Larger is slower but misses fewer neighbours of queries far from the data.
+EXPANSION_SEARCH = 512
+_METRICS = {"cosine": "ip", "euclidean": "l2sq"}
+
+
+class AnnIndex:
+    """An approximate nearest neighbour index of the embeddings of a database.
+
+    Args:
+        index: The usearch index, keyed by window id.
+        score_function: One of ANN_SCORE_FUNCTIONS.
+        max_window_id: The largest window id of the database when last updated.
+    """
+
+    def __init__(self, index: Index, score_function: str, max_window_id: int):
+        self.index = index
+        self.score_function = score_function
+        self.max_window_id = max_window_id
+
+    def __len__(self):
+        return len(self.index)
+
+    @classmethod
+    def build(
+        cls, db: SQLiteUSearchDB, score_function: ANN_SCORE_FUNCTIONS
+    ) -> AnnIndex:
+        """Indexes all embeddings of the database and saves the index next to it.
+
+        Args:
+            db: The database.
+            score_function: One of ANN_SCORE_FUNCTIONS.
+
+        Returns:
+            The index.
+        """
+        from usearch.index import Index
+
+        if score_function not in get_args(ANN_SCORE_FUNCTIONS):
+            raise ValueError(
+                f"No ANN index for score function '{score_function}', "
+                f"use one of {', '.join(get_args(ANN_SCORE_FUNCTIONS))}."
+            )
+
+        usearch_cfg = db.get_metadata("usearch_config")
+        # The candidates are ranked with the exact vectors, half precision suffices.
+        index = Index(
+            ndim=db.get_embedding_dim(),
+            metric=_METRICS[score_function],
+            dtype="f16",
+            expansion_add=usearch_cfg.expansion_add,
+            expansion_search=usearch_cfg.expansion_search,
+        )
+        ann_index = cls(index, score_function, max_window_id=0)
+        ann_index.update(db)
+        ann_index.save(db)
+
+        return ann_index
+
+    @classmethod
+    def load(
+        cls,
+        db: SQLiteUSearchDB,
+        score_function: ANN_SCORE_FUNCTIONS,
+        view: bool = True,
+    ) -> AnnIndex | None:
+        """Opens an index of the database, None if there is none.
+
+        Args:
+            db: The database.
+            score_function: One of ANN_SCORE_FUNCTIONS.
+            view: Memory-map the index read-only instead of loading it.
+
+        Returns:
+            The index or None.
+        """
+        from usearch.index import Index
+
+        index_path, meta_path = _paths(db, score_function)
+
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+
+            if meta.get("version") != FORMAT_VERSION:
+                return None
+
+            index = Index.restore(index_path, view=view)
+        except (OSError, ValueError, RuntimeError):
+            return None
+
+        if index is None or len(index) != meta["n"]:
+            return None
+
+        return cls(index, score_function, meta["max_window_id"])
+
+    def is_current(self, db: SQLiteUSearchDB) -> bool:
+        """Whether the index holds exactly the windows of the database."""
+        n, max_window_id = db.db.execute(
+            "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM windows"
+        ).fetchone()
+
+        return n == len(self) and max_window_id == self.max_window_id
+
+    def update(self, db: SQLiteUSearchDB):
+        """Adds the windows missing from the index and removes the deleted ones.
+
+        The index must not be a view, see :meth:`load`.
+        """
+        window_ids = np.array(db.match_window_ids(), dtype=np.int64)
+        keys = np.asarray(self.index.keys, dtype=np.int64)
+
+        removed = np.setdiff1d(keys, window_ids, assume_unique=True)
+
+        if len(removed):
+            self.index.remove(removed)
+
+        added = np.setdiff1d(window_ids, keys, assume_unique=True)
+
+        for start in range(0, len(added), ADD_BATCH_SIZE):
+            ids = added[start : start + ADD_BATCH_SIZE]
+            self.index.add(
+                ids,
+                self._prepare(
+                    np.asarray(db.get_embeddings_batch(ids), dtype=np.float32)
+                ),
+            )
+
+        self.max_window_id = int(window_ids.max()) if len(window_ids) else 0
+
+    def save(self, db: SQLiteUSearchDB):
+        """Writes the index next to the database."""
+        index_path, meta_path = _paths(db, self.score_function)
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+
+        # The meta file marks a complete index, so it is removed until the new one is.
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        self.index.save(index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": FORMAT_VERSION,
+                    "n": len(self),
+                    "max_window_id": self.max_window_id,
+                },
+                f,
+            )
+
+    def candidates(self, queries: np.ndarray, count: int) -> np.ndarray:
+        """The window ids of the approximate nearest embeddings of each query.
+
+        Args:
+            queries: The (n_queries, dim) query embeddings.
+            count: The number of candidates per query.
+
+        Returns:
+            The (n_queries, count) window ids, padded with -1.
+        """
+        self.index.expansion_search = max(EXPANSION_SEARCH, count)
+
+        return usearch_candidates(
+            self.index, self._prepare(np.asarray(queries, dtype=np.float32)), count
+        )
+
+    def _prepare(self, vectors: np.ndarray) -> np.ndarray:
+        if self.score_function != "cosine":
+            return vectors
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.nan_to_num(
+                vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+            )
+
+
+def ann_dir(db: SQLiteUSearchDB) -> str:
+    """The directory holding the ANN indexes of the database."""
+    return os.path.join(str(db.db_path), ANN_DIRNAME)
+
+
+def _paths(db: SQLiteUSearchDB, score_function: str) -> tuple[str, str]:
+    directory = ann_dir(db)
+
+    return (
+        os.path.join(directory, f"{score_function}.usearch"),
+        os.path.join(directory, f"{score_function}.json"),
+    )
+
+
+def usearch_candidates(index: Index, queries: np.ndarray, count: int) -> np.ndarray:
+    """Searches a usearch index for all queries at once.
+
+    Args:
+        index: The usearch index.
+        queries: The (n_queries, dim) query vectors.
+        count: The number of neighbours per query.
+
+    Returns:
+        The (n_queries, count) keys of the neighbours, padded with -1.
+    """
+    queries = np.atleast_2d(queries)
+    candidates = np.full((len(queries), count), -1, dtype=np.int64)
+
+    if not len(index):
+        return candidates
+
+    matches = index.search(queries, count)
+    keys = np.atleast_2d(matches.keys).astype(np.int64)
+    counts = np.atleast_1d(getattr(matches, "counts", len(matches.keys)))
+
+    for row, n in enumerate(counts):
+        candidates[row, :n] = keys[row, :n]
+
+    return candidates
+
+
+def candidate_count(n_results: int) -> int:
+    """The number of candidates to take from an index for ``n_results``."""
+    return max(n_results * CANDIDATES_FACTOR, MIN_CANDIDATES)
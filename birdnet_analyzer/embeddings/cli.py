@@ -4,7 +4,16 @@ from birdnet_analyzer.utils import runtime_error_handler
 
 @runtime_error_handler
 def main():
+    import sys
+
     from birdnet_analyzer import cli
+    from birdnet_analyzer.embeddings.clusters import cluster
+
+    # "birdnet-embeddings cluster ..." clusters the embeddings of a database.
+    if sys.argv[1:2] == ["cluster"]:
+        args = cli.cluster_parser().parse_args(sys.argv[2:])
+        cluster(**vars(args))
+        return
 
     parser = cli.embeddings_parser()
     args = parser.parse_args()
@@ -0,0 +1,434 @@
+"""Clusters of near-duplicate embeddings of a database.
+
+Windows of stationary noise or of a repeated call have nearly the same
+embedding and crowd the results of a search. They are grouped by leader
+clustering: the windows are visited in id order, and each joins the cluster of
+the most cosine-similar representative if that is at least as similar as the
+threshold, or else represents a new cluster.
+
+The clusters are kept in the table CLUSTERS_TABLE of the database, with the
+columns ``window_id``, ``cluster_id``, the window id of the representative, and
+``similarity``, the cosine similarity to it. Updating them only clusters the
+windows not in the table yet, so it is cheap to run after adding embeddings.
+The representatives of the windows of a block are those of their clustered
+neighbours in the cosine ANN index of :mod:`birdnet_analyzer.embeddings.ann`
+if it is up to date, or else found by comparing the block with all of them.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from birdnet_analyzer.embeddings import ann
+
+if TYPE_CHECKING:
+    from perch_hoplite.db.search_results import SearchResult
+    from perch_hoplite.db.sqlite_usearch_impl import SQLiteUSearchDB
+
+logger = logging.getLogger(__name__)
+
+CLUSTERS_TABLE = "birdnet_clusters"
+CLUSTERS_KEY = "birdnet_clusters"
+DEFAULT_THRESHOLD = 0.95
+# Windows clustered at once; the unmatched ones are compared with each other.
+CLUSTER_BLOCK_SIZE = 2048
+# Representatives compared with a block at once without an ANN index.
+REPRESENTATIVES_BLOCK_SIZE = 16_384
+# Neighbours taken from the ANN index, whose representatives are compared.
+ANN_NEIGHBOURS = 32
+# Bound parameters of a query, below SQLite's limit.
+_SQL_BATCH_SIZE = 900
+
+
+def cluster(
+    database: str,
+    *,
+    threshold: float = DEFAULT_THRESHOLD,
+    file_output: str | None = None,
+    file_output_format: str | None = None,
+):
+    """Clusters the near-duplicate embeddings of a database.
+
+    Args:
+        database: Path to the database.
+        threshold: The cosine similarity from which windows are near-duplicates.
+        file_output: If given, the embeddings of the representatives of all
+            clusters are exported to this file, see export_embeddings.
+        file_output_format: The format of the export.
+    """
+    from birdnet_analyzer.embeddings.core import get_or_create_database
+    from birdnet_analyzer.embeddings.export import export_embeddings
+
+    db = get_or_create_database(database)
+
+    try:
+        n_clustered = update_clusters(db, threshold)
+        n_windows, n_clusters = db.db.execute(
+            f"SELECT COUNT(*), COUNT(DISTINCT cluster_id) FROM {CLUSTERS_TABLE}"
+        ).fetchone()
+    finally:
+        db.db.close()
+
+    logger.info(
+        "Clustered %d new windows, %d windows form %d clusters.",
+        n_clustered,
+        n_windows,
+        n_clusters,
+    )
+
+    if file_output:
+        export_embeddings(
+            database, file_output, file_output_format, representatives_only=True
+        )
+
+
+def update_clusters(
+    db: SQLiteUSearchDB,
+    threshold: float = DEFAULT_THRESHOLD,
+    block_size: int = CLUSTER_BLOCK_SIZE,
+) -> int:
+    """Adds the windows of the database that are in no cluster yet to one.
+
+    Windows removed from the database leave their clusters; the members of
+    removed representatives are clustered again. All windows are clustered
+    again if the threshold changed.
+
+    Args:
+        db: The database.
+        threshold: The cosine similarity from which windows are near-duplicates.
+        block_size: The number of windows clustered at once.
+
+    Returns:
+        The number of windows clustered.
+    """
+    from ml_collections import ConfigDict
+
+    _create_table(db)
+
+    try:
+        stored_threshold = db.get_metadata(CLUSTERS_KEY)["threshold"]
+    except KeyError:
+        stored_threshold = None
+
+    if stored_threshold != threshold:
+        db.db.execute(f"DELETE FROM {CLUSTERS_TABLE}")
+        db.insert_metadata(CLUSTERS_KEY, ConfigDict({"threshold": threshold}))
+
+    db.db.execute(
+        f"DELETE FROM {CLUSTERS_TABLE} WHERE window_id NOT IN (SELECT id FROM windows)"
+    )
+    db.db.execute(
+        f"DELETE FROM {CLUSTERS_TABLE} "
+        f"WHERE cluster_id NOT IN (SELECT window_id FROM {CLUSTERS_TABLE})"
+    )
+    db.commit()
+
+    pending = np.fromiter(
+        (
+            row[0]
+            for row in db.db.execute(
+                f"SELECT id FROM windows WHERE id NOT IN "
+                f"(SELECT window_id FROM {CLUSTERS_TABLE}) ORDER BY id"
+            )
+        ),
+        dtype=np.int64,
+    )
+    representatives = _open_representatives(db, threshold)
+
+    for start in range(0, len(pending), block_size):
+        window_ids = pending[start : start + block_size]
+        vectors = _normalized(db.get_embeddings_batch(window_ids))
+        cluster_ids, similarities = representatives.nearest(vectors)
+        matched = similarities >= threshold
+        unmatched = np.flatnonzero(~matched)
+        owners, owner_similarities = _leader_clusters(vectors[unmatched], threshold)
+        cluster_ids[unmatched] = window_ids[unmatched][owners]
+        similarities[unmatched] = owner_similarities
+        leads = unmatched[owners == np.arange(len(unmatched))]
+        members = np.flatnonzero(matched)
+        closer, lead_ids, lead_similarities = _closer_leads(
+            vectors, members, leads, similarities[members]
+        )
+        cluster_ids[members[closer]] = window_ids[lead_ids]
+        similarities[members[closer]] = lead_similarities
+        representatives.add(window_ids[leads], vectors[leads])
+
+        db.db.executemany(
+            f"INSERT INTO {CLUSTERS_TABLE} (window_id, cluster_id, similarity) "
+            "VALUES (?, ?, ?)",
+            zip(
+                window_ids.tolist(),
+                cluster_ids.tolist(),
+                similarities.tolist(),
+                strict=True,
+            ),
+        )
+        db.commit()
+
+    return len(pending)
+
+
+def cluster_ids(db: SQLiteUSearchDB, window_ids) -> np.ndarray:
+    """The clusters of the windows, their own id for windows in none."""
+    window_ids = np.asarray(window_ids, dtype=np.int64)
+    clusters = _stored_clusters(db, window_ids) if _has_table(db) else {}
+
+    return np.array(
+        [clusters.get(window_id, window_id) for window_id in window_ids.tolist()],
+        dtype=np.int64,
+    )
+
+
+def collapse_results(
+    db: SQLiteUSearchDB, results: list[SearchResult], n_results: int
+) -> list[SearchResult]:
+    """Keeps the first of the results of each cluster.
+
+    Args:
+        db: The database.
+        results: The results, best first.
+        n_results: The number of results to keep.
+
+    Returns:
+        The best result of each cluster, best first.
+    """
+    seen = set()
+    kept = []
+
+    for result, cluster_id in zip(
+        results, cluster_ids(db, [r.window_id for r in results]), strict=True
+    ):
+        if cluster_id in seen:
+            continue
+
+        seen.add(cluster_id)
+        kept.append(result)
+
+        if len(kept) == n_results:
+            break
+
+    return kept
+
+
+def _open_representatives(
+    db: SQLiteUSearchDB, threshold: float
+) -> _ScannedRepresentatives | _IndexedRepresentatives:
+    """Finds the most similar representative of windows, see nearest."""
+    index = ann.AnnIndex.load(db, "cosine")
+
+    if index is not None and index.is_current(db):
+        return _IndexedRepresentatives(db, index, threshold)
+
+    return _ScannedRepresentatives(db)
+
+
+class _ScannedRepresentatives:
+    """Compares windows with all representatives, held in memory."""
+
+    def __init__(self, db: SQLiteUSearchDB):
+        window_ids = np.fromiter(
+            (
+                row[0]
+                for row in db.db.execute(
+                    f"SELECT window_id FROM {CLUSTERS_TABLE} "
+                    "WHERE cluster_id = window_id ORDER BY window_id"
+                )
+            ),
+            dtype=np.int64,
+        )
+        spans = _spans(len(window_ids), REPRESENTATIVES_BLOCK_SIZE)
+        self._ids = [window_ids[start:end] for start, end in spans]
+        self._blocks = [_normalized(db.get_embeddings_batch(ids)) for ids in self._ids]
+
+    def nearest(self, vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """The most similar representative of each of the unit vectors.
+
+        Returns:
+            The window ids of the representatives and the cosine similarities,
+            -1 and -inf where there is none.
+        """
+        best_ids = np.full(len(vectors), -1, dtype=np.int64)
+        best = np.full(len(vectors), -np.inf, dtype=np.float32)
+
+        for ids, block in zip(self._ids, self._blocks, strict=True):
+            scores = vectors @ block.T
+            top = np.argmax(scores, axis=1)
+            top_scores = scores[np.arange(len(vectors)), top]
+            better = top_scores > best
+            best_ids[better] = ids[top[better]]
+            best[better] = top_scores[better]
+
+        return best_ids, best
+
+    def add(self, window_ids: np.ndarray, vectors: np.ndarray):
+        """Adds representatives with their unit vectors."""
+        if len(window_ids):
+            self._ids.append(window_ids)
+            self._blocks.append(vectors)
+
+
+class _IndexedRepresentatives:
+    """Compares windows with the representatives of their neighbours first.
+
+    The neighbours in the ANN index of a window of a large cluster are mostly
+    members of it, so the representatives of the clustered neighbours are
+    looked up in CLUSTERS_TABLE and compared with the window. Windows none of
+    which is similar enough to, e.g. as their neighbours are not clustered yet,
+    are compared with all representatives.
+    """
+
+    def __init__(self, db: SQLiteUSearchDB, index: ann.AnnIndex, threshold: float):
+        self._db = db
+        self._index = index
+        self._threshold = threshold
+        self._scanned = _ScannedRepresentatives(db)
+
+    def nearest(self, vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """See _ScannedRepresentatives.nearest."""
+        candidates = self._index.candidates(vectors, ANN_NEIGHBOURS)
+        clusters = _stored_clusters(self._db, np.unique(candidates[candidates >= 0]))
+        representatives = np.array(
+            [clusters.get(c, -1) for c in candidates.ravel().tolist()],
+            dtype=np.int64,
+        ).reshape(candidates.shape)
+        scores = np.full(representatives.shape, -np.inf, dtype=np.float32)
+        valid = representatives >= 0
+        unique_ids = np.unique(representatives[valid])
+
+        if len(unique_ids):
+            found = _normalized(self._db.get_embeddings_batch(unique_ids))
+            positions = np.searchsorted(unique_ids, representatives[valid])
+            scores[valid] = np.einsum(
+                "ij,ij->i",
+                np.repeat(vectors, valid.sum(axis=1), axis=0),
+                found[positions],
+            )
+
+        top = np.argmax(scores, axis=1)
+        rows = np.arange(len(vectors))
+        best_ids = np.where(valid[rows, top], representatives[rows, top], -1)
+        best = scores[rows, top]
+        unmatched = np.flatnonzero(best < self._threshold)
+
+        if len(unmatched):
+            best_ids[unmatched], best[unmatched] = self._scanned.nearest(
+                vectors[unmatched]
+            )
+
+        return best_ids, best
+
+    def add(self, window_ids: np.ndarray, vectors: np.ndarray):
+        """See _ScannedRepresentatives.add."""
+        self._scanned.add(window_ids, vectors)
+
+
+def _leader_clusters(
+    vectors: np.ndarray, threshold: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Leader clustering of unit vectors.
+
+    Returns:
+        For each vector the index of its representative, itself for the
+        representatives, and the cosine similarity to it.
+    """
+    owners = np.full(len(vectors), -1, dtype=np.int64)
+    best = np.full(len(vectors), -np.inf, dtype=np.float32)
+    scores = vectors @ vectors.T
+
+    for i in range(len(vectors)):
+        if owners[i] >= 0:
+            continue
+
+        owners[i] = i
+        best[i] = 1.0
+        later = scores[i, i + 1 :]
+        better = (later >= threshold) & (later > best[i + 1 :])
+        owners[i + 1 :][better] = i
+        best[i + 1 :][better] = later[better]
+
+    return owners, best
+
+
+def _closer_leads(
+    vectors: np.ndarray,
+    members: np.ndarray,
+    leads: np.ndarray,
+    similarities: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Finds members of a block closer to a new representative before them.
+
+    Args:
+        vectors: The unit vectors of the block.
+        members: The positions of windows joining an earlier cluster.
+        leads: The positions of the windows representing new clusters.
+        similarities: The similarities of the members to their representative.
+
+    Returns:
+        A mask of the members that are closer to a new representative, and the
+        positions of those and the similarities to them.
+    """
+    if not len(leads) or not len(members):
+        return np.zeros(len(members), dtype=bool), leads[:0], similarities[:0]
+
+    scores = vectors[members] @ vectors[leads].T
+    scores[leads[None, :] > members[:, None]] = -np.inf
+    top = np.argmax(scores, axis=1)
+    top_scores = scores[np.arange(len(members)), top]
+    closer = top_scores > similarities
+
+    return closer, leads[top[closer]], top_scores[closer]
+
+
+def _normalized(embeddings) -> np.ndarray:
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def _spans(n: int, size: int):
+    return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+
+def _stored_clusters(db: SQLiteUSearchDB, window_ids: np.ndarray) -> dict[int, int]:
+    """The clusters of the windows in CLUSTERS_TABLE, by window id."""
+    unique_ids = np.unique(window_ids).tolist()
+    clusters = {}
+
+    for start in range(0, len(unique_ids), _SQL_BATCH_SIZE):
+        batch = unique_ids[start : start + _SQL_BATCH_SIZE]
+        clusters.update(
+            db.db.execute(
+                f"SELECT window_id, cluster_id FROM {CLUSTERS_TABLE} "
+                f"WHERE window_id IN ({','.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+        )
+
+    return clusters
+
+
+def _has_table(db: SQLiteUSearchDB) -> bool:
+    return (
+        db.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (CLUSTERS_TABLE,),
+        ).fetchone()
+        is not None
+    )
+
+
+def _create_table(db: SQLiteUSearchDB):
+    db.db.execute(
+        f"CREATE TABLE IF NOT EXISTS {CLUSTERS_TABLE} ("
+        "window_id INTEGER PRIMARY KEY, "
+        "cluster_id INTEGER NOT NULL, "
+        "similarity REAL NOT NULL)"
+    )
+    db.db.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_{CLUSTERS_TABLE}_cluster_id "
+        f"ON {CLUSTERS_TABLE}(cluster_id)"
+    )
@@ -0,0 +1,380 @@
+"""Compressed copy of the embeddings of a database for fast brute-force search.
+
+A brute-force search streams every stored vector through the CPU and is bound by
+memory bandwidth. This module keeps a second, smaller copy of the embeddings next
+to the database in ``<database>/compressed/``:
+
+- ``float16``: the vectors as half precision floats.
+- ``int8``: one byte per dimension. Every dimension is mapped linearly onto
+  [-128, 127] using the scale and offset fitted on a sample of the vectors.
+
+Either mode can be combined with a PCA projection onto the ``pca_dim`` strongest
+components of the same sample, which shrinks the copy further.
+
+Scores computed on the copy are approximations. :func:`search` therefore uses
+them to select candidates only, and ranks the candidates with the exact vectors
+from the database.
+
+The copy is memory-mapped when loaded and is rebuilt from the database by
+:meth:`CompressedEmbeddings.build`. It is stale as soon as windows are added or
+removed; :meth:`CompressedEmbeddings.is_current` tells.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import TYPE_CHECKING, get_args
+
+import numpy as np
+
+from birdnet_analyzer.config import COMPRESSION_MODES
+
+if TYPE_CHECKING:
+    from perch_hoplite.db.search_results import SearchResult
+    from perch_hoplite.db.sqlite_usearch_impl import SQLiteUSearchDB
+
+    from birdnet_analyzer.config import SCORE_FUNCTIONS
+
+COMPRESSED_DIRNAME = "compressed"
+FORMAT_VERSION = 1
+# Vectors the quantizer and the PCA projection are fitted on.
+FIT_SAMPLE_SIZE = 100_000
+# Rows scored at once, bounds the float32 temporaries of a scan.
+SCAN_CHUNK_ROWS = 65_536
+# Candidates re-ranked with the exact vectors, per requested result.
+RERANK_FACTOR = 10
+MIN_RERANK_CANDIDATES = 100
+
+
+class CompressedEmbeddings:
+    """The compressed embeddings of a database.
+
+    Args:
+        codes: The (n, d) float16 or int8 codes, d being pca_dim with a projection.
+        window_ids: The window id of each row.
+        norms: The norm of each decoded vector, in the space of the original vectors.
+        scale: Per code dimension scale of the decoding, ``codes * scale + offset``.
+        offset: Per code dimension offset of the decoding.
+        mean: The mean subtracted before the projection, None without PCA.
+        components: The (d, dim) orthonormal projection, None without PCA.
+        mode: One of COMPRESSION_MODES.
+        max_window_id: The largest window id of the database at build time.
+    """
+
+    def __init__(
+        self,
+        codes: np.ndarray,
+        window_ids: np.ndarray,
+        norms: np.ndarray,
+        scale: np.ndarray,
+        offset: np.ndarray,
+        mean: np.ndarray | None,
+        components: np.ndarray | None,
+        mode: str,
+        max_window_id: int,
+    ):
+        self.codes = codes
+        self.window_ids = window_ids
+        self.norms = norms
+        self.scale = scale
+        self.offset = offset
+        self.mean = mean
+        self.components = components
+        self.mode = mode
+        self.max_window_id = max_window_id
+
+    def __len__(self):
+        return len(self.window_ids)
+
+    @property
+    def pca_dim(self) -> int | None:
+        return None if self.components is None else len(self.components)
+
+    @classmethod
+    def build(
+        cls,
+        db: SQLiteUSearchDB,
+        mode: COMPRESSION_MODES = "int8",
+        pca_dim: int | None = None,
+        sample_size: int = FIT_SAMPLE_SIZE,
+    ) -> CompressedEmbeddings:
+        """Compresses all embeddings of the database and saves them next to it.
+
+        Args:
+            db: The database.
+            mode: One of COMPRESSION_MODES.
+            pca_dim: Project the vectors onto this many principal components first.
+            sample_size: The number of vectors the quantizer and PCA are fitted on.
+
+        Returns:
+            The compressed embeddings, memory-mapped from disk.
+        """
+        from birdnet_analyzer.embeddings.export import iter_window_batches
+
+        if mode not in get_args(COMPRESSION_MODES):
+            raise ValueError(
+                f"Unknown compression mode '{mode}', "
+                f"use one of {', '.join(get_args(COMPRESSION_MODES))}."
+            )
+
+        dim = db.get_embedding_dim()
+
+        if pca_dim is not None and not 0 < pca_dim <= dim:
+            raise ValueError(f"pca_dim must be between 1 and {dim}.")
+
+        directory = compressed_dir(db)
+        meta_path = os.path.join(directory, "meta.json")
+        os.makedirs(directory, exist_ok=True)
+
+        # The meta file marks a complete copy, so it is removed until the new one is.
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        n, max_window_id = db.db.execute(
+            "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM windows"
+        ).fetchone()
+        sample_ids = [
+            row[0]
+            for row in db.db.execute(
+                "SELECT id FROM windows ORDER BY RANDOM() LIMIT ?", (sample_size,)
+            )
+        ]
+        sample = (
+            np.asarray(db.get_embeddings_batch(sample_ids), dtype=np.float32)
+            if sample_ids
+            else np.zeros((0, dim), dtype=np.float32)
+        )
+        mean, components = _fit_pca(sample, pca_dim) if pca_dim else (None, None)
+        scale, offset = _fit_quantizer(
+            _project(sample, mean, components), mode, pca_dim or dim
+        )
+
+        code_dtype = np.float16 if mode == "float16" else np.int8
+        code_dim = pca_dim or dim
+        codes = np.lib.format.open_memmap(
+            os.path.join(directory, "codes.npy.tmp"),
+            mode="w+",
+            dtype=code_dtype,
+            shape=(n, code_dim),
+        )
+        window_ids = np.empty(n, dtype=np.int64)
+        norms = np.empty(n, dtype=np.float32)
+        row = 0
+
+        for ids, _, _, embeddings in iter_window_batches(db):
+            batch_codes = _encode(
+                _project(embeddings, mean, components), scale, offset, code_dtype
+            )
+            codes[row : row + len(ids)] = batch_codes
+            window_ids[row : row + len(ids)] = ids
+            norms[row : row + len(ids)] = np.linalg.norm(
+                _decode(batch_codes, scale, offset, mean, components), axis=1
+            )
+            row += len(ids)
+
+        codes.flush()
+        del codes
+        os.replace(
+            os.path.join(directory, "codes.npy.tmp"),
+            os.path.join(directory, "codes.npy"),
+        )
+        np.savez(
+            os.path.join(directory, "quantizer.npz"),
+            window_ids=window_ids,
+            norms=norms,
+            scale=scale,
+            offset=offset,
+            **({"mean": mean, "components": components} if pca_dim else {}),
+        )
+
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": FORMAT_VERSION,
+                    "mode": mode,
+                    "pca_dim": pca_dim,
+                    "n": n,
+                    "max_window_id": max_window_id,
+                },
+                f,
+            )
+
+        return cls.load(db)
+
+    @classmethod
+    def load(cls, db: SQLiteUSearchDB) -> CompressedEmbeddings | None:
+        """Opens the compressed embeddings of the database, None if there are none."""
+        directory = compressed_dir(db)
+
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+
+            if meta.get("version") != FORMAT_VERSION:
+                return None
+
+            codes = np.load(os.path.join(directory, "codes.npy"), mmap_mode="r")
+
+            if len(codes) != meta["n"]:
+                return None
+
+            with np.load(os.path.join(directory, "quantizer.npz")) as quantizer:
+                arrays = dict(quantizer)
+        except (OSError, ValueError):
+            return None
+
+        return cls(
+            codes=codes,
+            window_ids=arrays["window_ids"],
+            norms=arrays["norms"],
+            scale=arrays["scale"],
+            offset=arrays["offset"],
+            mean=arrays.get("mean"),
+            components=arrays.get("components"),
+            mode=meta["mode"],
+            max_window_id=meta["max_window_id"],
+        )
+
+    def is_current(self, db: SQLiteUSearchDB) -> bool:
+        """Whether the copy holds exactly the windows of the database."""
+        n, max_window_id = db.db.execute(
+            "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM windows"
+        ).fetchone()
+
+        return n == len(self) and max_window_id == self.max_window_id
+
+    def scores(
+        self, query: np.ndarray, score_function: SCORE_FUNCTIONS = "cosine"
+    ) -> np.ndarray:
+        """Approximate scores of all rows, higher is more similar.
+
+        Euclidean distances are returned negated.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        # x ~ mean + (codes * scale + offset) @ components, so x . q is
+        # mean . q + codes . (scale * w) + offset . w with w = components @ q.
+        w = query if self.components is None else self.components @ query
+        weights = (self.scale * w).astype(np.float32)
+        bias = float(self.offset @ w)
+
+        if self.mean is not None:
+            bias += float(self.mean @ query)
+
+        dots = np.empty(len(self), dtype=np.float32)
+
+        for start in range(0, len(self), SCAN_CHUNK_ROWS):
+            chunk = self.codes[start : start + SCAN_CHUNK_ROWS]
+            dots[start : start + len(chunk)] = chunk.astype(np.float32) @ weights
+
+        dots += bias
+
+        if score_function == "dot":
+            return dots
+
+        query_norm = float(np.linalg.norm(query))
+
+        if score_function == "cosine":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return dots / (self.norms * query_norm)
+
+        squared = self.norms**2 - 2 * dots + query_norm**2
+
+        return -np.sqrt(np.maximum(squared, 0))
+
+
+def compressed_dir(db: SQLiteUSearchDB) -> str:
+    """The directory holding the compressed embeddings of the database."""
+    return os.path.join(str(db.db_path), COMPRESSED_DIRNAME)
+
+
+def search(
+    db: SQLiteUSearchDB,
+    compressed: CompressedEmbeddings,
+    query: np.ndarray,
+    n_results: int,
+    score_function: SCORE_FUNCTIONS,
+    score_fn,
+) -> list[SearchResult]:
+    """Searches the compressed embeddings and re-ranks the best with exact scores.
+
+    Args:
+        db: The database holding the exact vectors.
+        compressed: Its compressed embeddings.
+        query: The query embedding.
+        n_results: The number of results.
+        score_function: One of SCORE_FUNCTIONS.
+        score_fn: The exact scoring function, higher is more similar.
+
+    Returns:
+        The results, best first, with the exact scores of ``score_fn``.
+    """
+    from perch_hoplite.db.search_results import SearchResult
+
+    scores = compressed.scores(query, score_function)
+    n_candidates = min(
+        len(scores), max(n_results * RERANK_FACTOR, MIN_RERANK_CANDIDATES)
+    )
+
+    if n_candidates < len(scores):
+        candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+    else:
+        candidates = np.arange(len(scores))
+
+    window_ids = compressed.window_ids[candidates]
+    exact = score_fn(
+        np.asarray(db.get_embeddings_batch(window_ids), dtype=np.float32), query
+    )
+    best = np.argsort(-exact, kind="stable")[:n_results]
+
+    return [
+        SearchResult(window_id=int(window_ids[i]), sort_score=float(exact[i]))
+        for i in best
+    ]
+
+
+def _fit_pca(sample: np.ndarray, pca_dim: int) -> tuple[np.ndarray, np.ndarray]:
+    mean = sample.mean(axis=0) if len(sample) else np.zeros(sample.shape[1])
+    # The right singular vectors are the principal axes, strongest first.
+    _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+    components = np.zeros((pca_dim, sample.shape[1]), dtype=np.float32)
+    components[: min(pca_dim, len(vt))] = vt[:pca_dim]
+
+    return mean.astype(np.float32), components
+
+
+def _project(x: np.ndarray, mean, components) -> np.ndarray:
+    if components is None:
+        return x
+
+    return (x - mean) @ components.T
+
+
+def _fit_quantizer(
+    sample: np.ndarray, mode: str, dim: int
+) -> tuple[np.ndarray, np.ndarray]:
+    if mode == "float16" or not len(sample):
+        return np.ones(dim, dtype=np.float32), np.zeros(dim, dtype=np.float32)
+
+    lo, hi = sample.min(axis=0), sample.max(axis=0)
+    scale = np.maximum(hi - lo, 1e-12) / 255
+    offset = lo + 128 * scale
+
+    return scale.astype(np.float32), offset.astype(np.float32)
+
+
+def _encode(x: np.ndarray, scale: np.ndarray, offset: np.ndarray, dtype) -> np.ndarray:
+    if dtype == np.float16:
+        return x.astype(np.float16)
+
+    # Values outside the range of the fit sample are clipped.
+    return np.clip(np.rint((x - offset) / scale), -128, 127).astype(np.int8)
+
+
+def _decode(codes, scale, offset, mean, components) -> np.ndarray:
+    x = codes.astype(np.float32) * scale + offset
+
+    if components is None:
+        return x
+
+    return x @ components + mean
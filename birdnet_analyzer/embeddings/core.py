@@ -1,7 +1,12 @@
 from __future__ import annotations
 
+import logging
 import os
 import pathlib
+import queue
+import threading
+import time
+from dataclasses import dataclass
 from typing import TYPE_CHECKING
 
 import numpy as np
@@ -10,12 +15,29 @@ from tqdm import tqdm
 if TYPE_CHECKING:
     from collections.abc import Callable
 
+    from birdnet.acoustic.inference.core.encoding.encoding_result import (
+        AcousticFileEncodingResult,
+    )
     from birdnet.acoustic.inference.core.perf_tracker import AcousticProgressStats
+    from birdnet.globals import ACOUSTIC_MODEL_VERSIONS
     from perch_hoplite.db import sqlite_usearch_impl
 
+    from birdnet_analyzer.config import ANN_SCORE_FUNCTIONS, COMPRESSION_MODES
+
+logger = logging.getLogger(__name__)
+
 DATASET_NAME: str = "birdnet_analyzer_dataset"
-COMMIT_BS_SIZE = 512
+# Windows inserted before the database is committed, at the latest after
+# COMMIT_INTERVAL_S seconds.
+COMMIT_BS_SIZE = 50_000
+COMMIT_INTERVAL_S = 60.0
+# Finished files buffered between the encoder and the database writer.
+WRITER_QUEUE_SIZE = 64
+# Windows the writer inserts at once at most.
+WRITE_BATCH_SIZE = 8192
 SETTINGS_KEY = "birdnet_analyzer_settings"
+# Extra columns of the recordings table, set once all windows of a file are written.
+RECORDING_STATE_COLUMNS = {"file_size": int, "file_mtime_ns": int, "overlap_s": float}
 
 
 def embeddings(
@@ -26,8 +48,13 @@ def embeddings(
     audio_speed: float = 1.0,
     fmin: int = 0,
     fmax: int = 15000,
+    version: ACOUSTIC_MODEL_VERSIONS = "2.4",
     batch_size: int = 1,
     file_output: str | None = None,
+    file_output_format: str | None = None,
+    compression: COMPRESSION_MODES | None = None,
+    pca_dim: int | None = None,
+    ann_indexes: list[ANN_SCORE_FUNCTIONS] | None = None,
     n_workers: int | None = None,
     n_producers: int = 1,
     on_update: Callable[[AcousticProgressStats], None] | None = None,
@@ -37,6 +64,9 @@ def embeddings(
     This function processes audio files to extract embeddings, which are
     representations of audio features. The embeddings can be used for
     further analysis or comparison.
+    Files whose embeddings are already in the database are skipped, so running it
+    again after adding files to a directory, or after an interruption, only encodes
+    the new, changed and unfinished files.
     Args:
         audio_input (str): Path to the input audio file or directory containing audio
             files.
@@ -49,11 +79,28 @@ def embeddings(
             Defaults to 0.
         fmax (int, optional): Maximum frequency (in Hz) for audio analysis.
             Defaults to 15000.
+        version (ACOUSTIC_MODEL_VERSIONS, optional): The BirdNET model that encodes
+            the audio. 3.0 runs on ONNX and has 1280-d embeddings, 2.4 runs on
+            TensorFlow and has 1024-d embeddings. A database holds the embeddings of
+            one model, which search uses to encode its queries. Defaults to "2.4".
         threads (int, optional): Number of threads to use for processing. Defaults to 8.
         batch_size (int, optional): Number of audio segments to process in a single
             batch. Defaults to 1.
         file_output (str | None, optional): Path to save the output embeddings. If None,
             embeddings are not saved to a file. Defaults to None.
+        file_output_format (str | None, optional): "csv", "parquet" or "npy", see
+            :mod:`birdnet_analyzer.embeddings.export`. Inferred from the extension of
+            file_output if None. Defaults to None.
+        compression (COMPRESSION_MODES | None, optional): Keep a "float16" or "int8"
+            copy of the embeddings that speeds up brute-force search, see
+            :mod:`birdnet_analyzer.embeddings.compression`. A copy that exists is
+            kept up to date with its previous settings if None. Defaults to None.
+        pca_dim (int | None, optional): Project the compressed copy onto this many
+            principal components. Defaults to None.
+        ann_indexes (list[ANN_SCORE_FUNCTIONS] | None, optional): Build approximate
+            nearest neighbour indexes for "cosine" and/or "euclidean" search, see
+            :mod:`birdnet_analyzer.embeddings.ann`. Existing indexes are always
+            kept up to date. Defaults to None.
         n_workers (int | None, optional): Number of worker threads to use for
             processing. Defaults to None.
         n_producers (int, optional): Number of producer threads to use for processing.
@@ -75,121 +122,436 @@ def embeddings(
             batch_size=2,
         )
     """
-    from birdnet_analyzer.model_utils import get_embeddings
-
-    result = get_embeddings(
-        audio_input,
-        version="2.4",
-        batch_size=batch_size,
-        overlap_duration_s=overlap,
-        bandpass_fmin=fmin,
-        bandpass_fmax=fmax,
-        speed=audio_speed,
-        n_workers=n_workers,
-        n_producers=n_producers,
-        callback=on_update,
-    )
+    from birdnet_analyzer import model_utils
 
+    files = model_utils.list_audio_inputs(audio_input)
     audio_root = str(pathlib.Path(audio_input).parent)
 
-    batchsize = COMMIT_BS_SIZE
-    pending_since_commit = 0
-    db = get_or_create_database(database)
+    db = get_or_create_database(
+        database,
+        embedding_dim=model_utils.acoustic_model_class(version).get_embeddings_dim(),
+    )
     _check_database_settings(
-        db, fmin=fmin, fmax=fmax, audio_speed=audio_speed, audio_root=audio_root
+        db,
+        fmin=fmin,
+        fmax=fmax,
+        audio_speed=audio_speed,
+        audio_root=audio_root,
+        version=version,
     )
     deployment_id = _ensure_deployment(db)
+    abs_root = pathlib.Path(os.path.abspath(audio_root))
+    fpaths = {
+        f: str(pathlib.Path(os.path.abspath(f)).relative_to(abs_root)) for f in files
+    }
+    states = {f: _file_state(f, overlap) for f in files}
+    index = _RecordingIndex(db, deployment_id)
+
+    # Files whose embeddings were committed for their current content and overlap are
+    # skipped, which also resumes an interrupted run. The windows of files that
+    # changed since or were encoded with another overlap are stale and removed first,
+    # so a recording never mixes the windows of two runs.
+    index.remove([fp for f, fp in fpaths.items() if index.is_stale(fp, states[f])])
+    db.commit()
+    pending = [f for f in files if index.state(fpaths[f]) != states[f]]
+    # Only recordings of earlier runs can hold windows already.
+    resumed = [fpaths[f] in index for f in pending]
+    recording_ids = index.ensure([fpaths[f] for f in pending])
+    writer = _EmbeddingsWriter(
+        db,
+        {
+            f: (recording_id, states[f])
+            for f, recording_id in zip(pending, recording_ids, strict=True)
+        },
+        resumed={
+            recording_id
+            for recording_id, was_there in zip(recording_ids, resumed, strict=True)
+            if was_there
+        },
+    )
 
-    seg_dur = result.segment_duration_s
-    seg_overlap = result.overlap_duration_s
-    step = seg_dur - seg_overlap
+    try:
+        try:
+            model_utils.encode_files(
+                pending,
+                writer.put,
+                version=version,
+                batch_size=batch_size,
+                overlap_duration_s=overlap,
+                bandpass_fmin=fmin,
+                bandpass_fmax=fmax,
+                speed=audio_speed,
+                n_workers=n_workers,
+                n_producers=n_producers,
+                callback=on_update,
+            )
+        finally:
+            stats = writer.close()
+
+        logger.info(
+            "Embedded %d files: encoding %.0f windows/s, writing %.0f windows/s, "
+            "encoder waited %.1f s for the database.",
+            stats.n_files,
+            stats.encode_rate,
+            stats.write_rate,
+            stats.blocked_s,
+        )
+        _update_compressed_embeddings(db, compression, pca_dim)
+        _update_ann_indexes(db, ann_indexes or [])
+    finally:
+        db.db.close()
+
+    if file_output:
+        from birdnet_analyzer.embeddings.export import export_embeddings
+
+        export_embeddings(database, file_output, file_output_format)
 
-    n_inputs = result.n_inputs
-    n_segments = result.max_n_segments
-    emb_masked = result.embeddings_masked
-    input_durations = result.input_durations
 
-    for i in tqdm(
-        range(n_inputs), desc="Saving embeddings to database", total=n_inputs
+def _update_compressed_embeddings(
+    db: sqlite_usearch_impl.SQLiteUSearchDB,
+    mode: COMPRESSION_MODES | None,
+    pca_dim: int | None,
+):
+    """Builds or refreshes the compressed copy of the embeddings, if one is wanted."""
+    from birdnet_analyzer.embeddings.compression import CompressedEmbeddings
+
+    existing = CompressedEmbeddings.load(db)
+
+    if mode is None:
+        if existing is None:
+            return
+
+        mode, pca_dim = existing.mode, existing.pca_dim
+
+    if (
+        existing is not None
+        and (existing.mode, existing.pca_dim) == (mode, pca_dim)
+        and existing.is_current(db)
     ):
-        fpath = str(pathlib.Path(result.inputs[i]).relative_to(audio_root))
-        file_dur = float(input_durations[i])
-        recording_id = _ensure_recording(db, fpath, deployment_id)
-        windows_batch = []
-        embeddings_batch = []
-
-        for j in range(n_segments):
-            # Skip masked (invalid/padded) segments
-            if emb_masked[i, j, 0]:
-                continue
+        return
+
+    CompressedEmbeddings.build(db, mode, pca_dim)
+
+
+def _update_ann_indexes(
+    db: sqlite_usearch_impl.SQLiteUSearchDB, score_functions: list[str]
+):
+    """Builds the wanted ANN indexes and brings the existing ones up to date."""
+    from typing import get_args
+
+    from birdnet_analyzer.config import ANN_SCORE_FUNCTIONS
+    from birdnet_analyzer.embeddings.ann import AnnIndex
+
+    for score_function in get_args(ANN_SCORE_FUNCTIONS):
+        index = AnnIndex.load(db, score_function, view=False)
 
-            s_start = j * step
-            s_end = s_start + seg_dur
+        if index is None:
+            if score_function in score_functions:
+                AnnIndex.build(db, score_function)
+        elif not index.is_current(db):
+            index.update(db)
+            index.save(db)
 
-            # Skip segments whose start is beyond the actual file duration
-            if s_start >= file_dur:
+
+@dataclass
+class WriterStats:
+    """Throughput of the encoder and the database writer of an embeddings run."""
+
+    n_files: int = 0
+    n_windows: int = 0
+    # Wall time since the writer started.
+    elapsed_s: float = 0.0
+    # Time the encoder waited for the writer to catch up.
+    blocked_s: float = 0.0
+    # Time the writer spent inserting and committing.
+    write_s: float = 0.0
+
+    @property
+    def encode_rate(self) -> float:
+        """Windows per second the encoder produced while it was not blocked."""
+        return self.n_windows / max(self.elapsed_s - self.blocked_s, 1e-9)
+
+    @property
+    def write_rate(self) -> float:
+        """Windows per second the writer stored while it was busy."""
+        return self.n_windows / max(self.write_s, 1e-9)
+
+
+class _EmbeddingsWriter:
+    """Writes the embeddings of finished files to the database on its own thread.
+
+    The encoder hands every file's result to :meth:`put`, which blocks while
+    ``max_pending`` results wait to be written. A slow disk thus throttles the encoder
+    instead of piling up embeddings in memory, and encoding and writing overlap.
+
+    The windows of consecutive files are inserted together, up to WRITE_BATCH_SIZE at
+    once or whatever is there when the queue runs empty.
+
+    Args:
+        db: The database. It must not be used by other threads until :meth:`close`.
+        recordings: Maps the absolute path of every input to its recording id and
+            the state recorded with its embeddings, see :func:`_file_state`.
+        resumed: The ids of the recordings that existed before this run. Only their
+            windows are looked up to skip those already stored.
+        max_pending: The number of results buffered between encoder and writer.
+    """
+
+    def __init__(
+        self,
+        db: sqlite_usearch_impl.SQLiteUSearchDB,
+        recordings: dict[str, tuple[int, tuple]],
+        resumed: set[int] | None = None,
+        max_pending: int = WRITER_QUEUE_SIZE,
+    ):
+        self._db = db
+        self._recordings = recordings
+        self._resumed = resumed or set()
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._error: BaseException | None = None
+        self._windows: list[dict] = []
+        self._embeddings: list[np.ndarray] = []
+        self._states: list[tuple] = []
+        self._pending_since_commit = 0
+        self._started = self._last_commit = time.monotonic()
+        self.stats = WriterStats()
+        self._thread = threading.Thread(
+            target=self._run, name="embeddings-writer", daemon=True
+        )
+        self._thread.start()
+
+    def put(self, result: AcousticFileEncodingResult):
+        """Queues the single-file result of the encoder for writing.
+
+        Raises:
+            RuntimeError: If the writer failed, which cancels the encoding run.
+        """
+        t0 = time.monotonic()
+
+        try:
+            while True:
+                if self._error is not None:
+                    raise RuntimeError("Writing embeddings failed.") from self._error
+
+                try:
+                    self._queue.put(result, timeout=1.0)
+                    return
+                except queue.Full:
+                    continue
+        finally:
+            self.stats.blocked_s += time.monotonic() - t0
+
+    def close(self) -> WriterStats:
+        """Writes the queued results, commits and stops the thread.
+
+        Returns:
+            The throughput of the run.
+
+        Raises:
+            Exception: The error the writer failed with, if any.
+        """
+        while self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=1.0)
+                break
+            except queue.Full:
                 continue
 
-            # Clamp end to actual file duration
-            s_end = min(s_end, file_dur)
+        self._thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+        return self.stats
+
+    def _run(self):
+        try:
+            with tqdm(
+                total=len(self._recordings), desc="Saving embeddings to database"
+            ) as progress:
+                while (result := self._queue.get()) is not None:
+                    self._add(result)
+
+                    if len(self._windows) >= WRITE_BATCH_SIZE or self._queue.empty():
+                        n_files = len(self._states)
+                        self._timed(self._flush)
+                        progress.update(n_files)
+                        progress.set_postfix(
+                            encode=f"{self.stats.encode_rate:.0f} win/s",
+                            write=f"{self.stats.write_rate:.0f} win/s",
+                        )
+
+                self._timed(self._flush)
+                self._timed(self._db.commit)
+        except BaseException as e:
+            self._error = e
+
+    def _timed(self, fn):
+        t0 = time.monotonic()
+        fn()
+        self.stats.write_s += time.monotonic() - t0
+        self.stats.elapsed_s = time.monotonic() - self._started
+
+    def _add(self, result: AcousticFileEncodingResult):
+        recording_id, state = self._recordings[str(result.inputs[0])]
+        valid, starts, ends = _segment_windows(result)
+        windows, embeddings = _new_windows(
+            self._db,
+            recording_id,
+            starts,
+            ends[0],
+            valid[0],
+            result.embeddings[0],
+            check_existing=recording_id in self._resumed,
+        )
+        self._windows.extend(windows)
+        self._embeddings.append(embeddings)
+        self._states.append((*state, recording_id))
+        self.stats.n_files += 1
+        self.stats.n_windows += len(windows)
+
+    def _flush(self):
+        _insert_new_windows(self._db, self._windows, self._embeddings)
+
+        # Same transaction as the windows: once committed, the files count as done.
+        self._db.db.executemany(
+            "UPDATE recordings SET file_size = ?, file_mtime_ns = ?, overlap_s = ? "
+            "WHERE id = ?",
+            self._states,
+        )
+        self._pending_since_commit += len(self._windows)
+        self._windows, self._embeddings, self._states = [], [], []
+
+        # Every commit also saves the usearch index, so commit by volume and time
+        # instead of after every batch.
+        if self._pending_since_commit >= COMMIT_BS_SIZE or (
+            self._pending_since_commit
+            and time.monotonic() - self._last_commit >= COMMIT_INTERVAL_S
+        ):
+            self._db.commit()
+            self._pending_since_commit = 0
+            self._last_commit = time.monotonic()
 
-            windows_batch.append(
-                {
-                    "recording_id": recording_id,
-                    "offsets": [float(s_start), float(s_end)],
-                }
-            )
-            embeddings_batch.append(result.embeddings[i, j, :])
 
-        if windows_batch:
-            db.insert_windows_batch(
-                windows_batch=windows_batch,
-                embeddings_batch=np.asarray(embeddings_batch),
-                handle_duplicates="skip",
-            )
-            pending_since_commit += len(windows_batch)
+def _segment_windows(result):
+    """Computes the windows of all segments of an encoding result at once.
 
-            if pending_since_commit >= batchsize:
-                db.commit()
-                pending_since_commit = 0
+    Args:
+        result: The encoding result.
 
-    db.commit()
-    db.db.close()
+    Returns:
+        A tuple ``(valid, starts, ends)``. ``valid`` is a boolean (input, segment)
+        mask of the segments that hold an embedding and start within their file,
+        ``starts`` the start time of each segment index and ``ends`` the (input,
+        segment) end times, clamped to the duration of the file.
+    """
+    seg_dur = result.segment_duration_s
+    step = seg_dur - result.overlap_duration_s
+    durations = np.asarray(result.input_durations, dtype=np.float64)[:, None]
+    starts = np.arange(result.max_n_segments) * step
+    ends = np.minimum(starts + seg_dur, durations)
+    valid = ~np.asarray(result.embeddings_masked)[:, :, 0] & (starts < durations)
 
-    if file_output:
-        create_csv_output(file_output, database)
+    return valid, starts, ends
 
 
-def create_csv_output(output_path: str, database: str):
-    """Creates a CSV output for the database.
+def _new_windows(
+    db: sqlite_usearch_impl.SQLiteUSearchDB,
+    recording_id: int,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    valid: np.ndarray,
+    embeddings: np.ndarray,
+    check_existing: bool = True,
+) -> tuple[list[dict], np.ndarray]:
+    """Selects the valid windows of one file that are not in the database yet.
 
     Args:
-        output_path: Path to the output file.
-        database: Path to the database.
+        db: The database.
+        recording_id: The recording the windows belong to.
+        starts: The start time of each segment.
+        ends: The end time of each segment.
+        valid: Mask of the segments to insert.
+        embeddings: The (segment, dim) embeddings of the file.
+        check_existing: Whether the recording can hold windows already. Those of
+            recordings inserted by this run are not looked up.
+
+    Returns:
+        The windows and their embeddings, as taken by insert_windows_batch.
     """
+    n_valid = int(np.count_nonzero(valid))
+
+    if not n_valid:
+        return [], embeddings[:0]
+
+    if valid[:n_valid].all():
+        # The usual case: only trailing segments are invalid, so the windows are
+        # a contiguous slice and the embeddings need not be copied.
+        keep = slice(0, n_valid)
+    else:
+        keep = np.flatnonzero(valid)
+
+    offsets = np.stack((starts[keep], ends[keep]), axis=1)
+    embeddings = embeddings[keep]
+
+    # Windows within a file never collide, so duplicates can only come from an
+    # earlier run. Matching them here with one query per resumed file avoids the
+    # per-window lookups and the pairwise in-batch check of
+    # handle_duplicates="skip". Plain SQL, Window objects are not needed.
+    existing = (
+        db.db.execute(
+            "SELECT offsets FROM windows WHERE recording_id = ?", (recording_id,)
+        ).fetchall()
+        if check_existing
+        else []
+    )
 
-    db = get_or_create_database(database)
-    parent_dir = os.path.dirname(output_path)
+    if existing:
+        existing = np.array([row[0] for row in existing], dtype=np.float64)
+        duplicate = (
+            (np.abs(offsets[:, None, :] - existing[None, :, :]) <= 1e-6)
+            .all(axis=2)
+            .any(axis=1)
+        )
+        offsets = offsets[~duplicate]
+        embeddings = embeddings[~duplicate]
 
-    if parent_dir and not os.path.exists(parent_dir):
-        os.makedirs(parent_dir)
+    windows = [
+        {"recording_id": recording_id, "offsets": window} for window in offsets.tolist()
+    ]
 
-    window_ids = db.match_window_ids()
+    return windows, embeddings
 
-    with open(output_path, "w") as f:
-        f.write("file_path,start,end,embedding\n")
 
-        for window_id in window_ids:
-            embedding = db.get_embedding(window_id)
-            window = db.get_window(window_id)
-            recording = db.get_recording(window.recording_id)
-            start, end = window.offsets
+def _insert_new_windows(
+    db: sqlite_usearch_impl.SQLiteUSearchDB,
+    windows: list[dict],
+    embeddings: list[np.ndarray],
+):
+    """Inserts the windows of several files at once, as selected by _new_windows.
 
-            f.write(
-                f"{recording.filename},{start},{end},"
-                f'"{",".join(map(str, embedding.tolist()))}"\n'
-            )
-    db.db.close()
+    Args:
+        db: The database.
+        windows: The windows of all files.
+        embeddings: The embeddings of the windows of each file.
+    """
+    if windows:
+        db.insert_windows_batch(
+            windows_batch=windows,
+            embeddings_batch=np.concatenate(embeddings),
+            handle_duplicates="allow",
+        )
+
+
+def create_csv_output(output_path: str, database: str):
+    """Creates a CSV output for the database.
+
+    Args:
+        output_path: Path to the output file.
+        database: Path to the database.
+    """
+    from birdnet_analyzer.embeddings.export import export_embeddings
+
+    export_embeddings(database, output_path, "csv")
 
 
 def _ensure_deployment(
@@ -206,18 +568,107 @@ def _ensure_deployment(
     return db.insert_deployment(name="birdnet_default", project=dataset_name)
 
 
-def _ensure_recording(
-    db: sqlite_usearch_impl.SQLiteUSearchDB, fpath: str, deployment_id: int
-) -> int:
-    """Ensure the recording exists and return its id."""
-    from ml_collections import config_dict
+def _file_state(path: str, overlap: float) -> tuple[int, int, float]:
+    """The size, mtime and overlap stored with the embeddings of a file.
 
-    recordings = db.get_all_recordings(
-        config_dict.create(eq={"filename": fpath, "deployment_id": deployment_id})
-    )
-    if recordings:
-        return recordings[0].id
-    return db.insert_recording(filename=fpath, deployment_id=deployment_id)
+    A file whose state differs from the stored one has to be encoded (again).
+    """
+    stat = os.stat(path)
+
+    return stat.st_size, stat.st_mtime_ns, float(overlap)
+
+
+class _RecordingIndex:
+    """Maps the file names of a deployment to their recording ids.
+
+    The map is loaded with a single query and kept up to date in memory, so
+    looking up a file costs no query, and missing recordings are inserted in bulk.
+    It also holds the :func:`_file_state` of each recording whose embeddings are
+    complete.
+
+    Args:
+        db: The database.
+        deployment_id: The deployment the recordings belong to.
+    """
+
+    def __init__(self, db: sqlite_usearch_impl.SQLiteUSearchDB, deployment_id: int):
+        self._db = db
+        self._deployment_id = deployment_id
+        columns = db.get_extra_table_columns()["recordings"]
+
+        for column, column_type in RECORDING_STATE_COLUMNS.items():
+            if column not in columns:
+                db.add_extra_table_column("recordings", column, column_type)
+
+        # Plain SQL, the Recording objects of get_all_recordings are too costly to
+        # build for databases with millions of recordings.
+        rows = db.db.execute(
+            "SELECT filename, id, file_size, file_mtime_ns, overlap_s "
+            "FROM recordings WHERE deployment_id = ?",
+            (deployment_id,),
+        ).fetchall()
+        self._ids: dict[str, int] = {row[0]: row[1] for row in rows}
+        self._states: dict[str, tuple] = {
+            row[0]: tuple(row[2:]) for row in rows if row[2] is not None
+        }
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, fpath: str):
+        return fpath in self._ids
+
+    def state(self, fpath: str) -> tuple | None:
+        """The state stored with the complete embeddings of a file, if any."""
+        return self._states.get(fpath)
+
+    def is_stale(self, fpath: str, state: tuple) -> bool:
+        """Whether the stored embeddings are not those of the file in this state."""
+        stored = self._states.get(fpath)
+
+        return stored is not None and stored != state
+
+    def remove(self, fpaths: list[str]):
+        """Removes the recordings of the files together with their windows."""
+        for fpath in fpaths:
+            recording_id = self._ids.pop(fpath)
+            self._states.pop(fpath, None)
+            self._db.remove_recording(recording_id)
+            # hoplite enables foreign keys only on the connection that created the
+            # database, so the windows are not always deleted by the cascade.
+            self._db.db.execute(
+                "DELETE FROM windows WHERE recording_id = ?", (recording_id,)
+            )
+
+    def ensure(self, fpaths: list[str]) -> list[int]:
+        """Returns the recording ids of the files, inserting the missing ones.
+
+        Args:
+            fpaths: The file names, relative to the audio root.
+
+        Returns:
+            The recording id of each file.
+        """
+        missing = [fpath for fpath in dict.fromkeys(fpaths) if fpath not in self._ids]
+
+        if missing:
+            cursor = self._db.db.cursor()
+            last_id = cursor.execute("SELECT MAX(id) FROM recordings").fetchone()[0]
+            cursor.executemany(
+                "INSERT INTO recordings (filename, deployment_id) VALUES (?, ?)",
+                [(fpath, self._deployment_id) for fpath in missing],
+            )
+            # Ids are AUTOINCREMENT, so everything above the previous maximum is new.
+            self._ids.update(
+                cursor.execute(
+                    "SELECT filename, id FROM recordings "
+                    "WHERE deployment_id = ? AND id > ?",
+                    (self._deployment_id, last_id or 0),
+                ).fetchall()
+            )
+            cursor.close()
+
+        return [self._ids[fpath] for fpath in fpaths]
 
 
 def get_or_create_database(
@@ -260,11 +711,21 @@ def _check_database_settings(
     fmax: int = 15000,
     audio_speed: float = 1.0,
     audio_root: str | None = None,
+    version: ACOUSTIC_MODEL_VERSIONS = "2.4",
 ):
     from ml_collections import ConfigDict
 
+    from birdnet_analyzer import model_utils
     from birdnet_analyzer.embeddings.core import SETTINGS_KEY
 
+    embedding_dim = model_utils.acoustic_model_class(version).get_embeddings_dim()
+
+    if db.get_embedding_dim() != embedding_dim:
+        raise ValueError(
+            f"The database holds {db.get_embedding_dim()}-d embeddings, BirdNET "
+            f"{version} produces {embedding_dim}-d embeddings."
+        )
+
     try:
         settings = db.get_metadata(SETTINGS_KEY)
 
@@ -273,13 +734,22 @@ def _check_database_settings(
             or settings["BANDPASS_FMAX"] != fmax
             or settings["AUDIO_SPEED"] != audio_speed
             or settings.get("AUDIO_ROOT") != audio_root
+            or get_model_version(settings) != version
         ):
             raise ValueError(
                 "Database settings do not match current configuration. DB Settings are:"
                 f" fmin: {settings['BANDPASS_FMIN']}, fmax: {settings['BANDPASS_FMAX']}"
                 f", audio_speed: {settings['AUDIO_SPEED']}, "
-                f"audio_root: {settings.get('AUDIO_ROOT')}"
+                f"audio_root: {settings.get('AUDIO_ROOT')}, "
+                f"version: {get_model_version(settings)}"
             )
+
+        # Databases of earlier versions were always encoded with 2.4.
+        if "MODEL_VERSION" not in settings:
+            settings["MODEL_VERSION"] = version
+            settings["EMBEDDING_DIM"] = embedding_dim
+            db.insert_metadata(SETTINGS_KEY, settings)
+            db.commit()
     except KeyError:
         settings = ConfigDict(
             {
@@ -287,8 +757,22 @@ def _check_database_settings(
                 "BANDPASS_FMAX": fmax,
                 "AUDIO_SPEED": audio_speed,
                 "AUDIO_ROOT": audio_root,
+                "MODEL_VERSION": version,
+                "EMBEDDING_DIM": embedding_dim,
             }
         )
 
         db.insert_metadata(SETTINGS_KEY, settings)
         db.commit()
+
+
+def get_model_version(settings) -> ACOUSTIC_MODEL_VERSIONS:
+    """The BirdNET version that encoded the embeddings of a database.
+
+    Args:
+        settings: The SETTINGS_KEY metadata of the database.
+
+    Returns:
+        The stored version, "2.4" for databases of earlier versions.
+    """
+    return settings.get("MODEL_VERSION", "2.4")
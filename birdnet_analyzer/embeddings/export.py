@@ -0,0 +1,341 @@
+"""Bulk export of the embeddings stored in a database.
+
+Windows are read joined with their recordings in large SQL batches, and the
+embeddings of a batch are fetched from the vector index with a single call. Each
+batch is then written in one go:
+
+- ``parquet``: one row group per batch with the columns ``window_id``,
+  ``file_path``, ``start``, ``end`` and ``embedding``, a fixed size list of
+  float32.
+- ``npy``: a directory of float32 ``embeddings-<n>.npy`` shards of at most
+  NPY_SHARD_ROWS rows that can be opened with ``np.load(..., mmap_mode="r")``,
+  and ``metadata.parquet`` holding ``window_id``, ``file_path``, ``start``,
+  ``end``, ``shard`` and ``row`` of every embedding in the same order.
+- ``csv``: the ``file_path,start,end,embedding`` table of earlier versions,
+  formatted a batch at a time.
+"""
+
+from __future__ import annotations
+
+import functools
+import os
+from typing import TYPE_CHECKING
+
+import numpy as np
+from tqdm import tqdm
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from perch_hoplite.db import sqlite_usearch_impl
+
+EXPORT_FORMATS = ("csv", "parquet", "npy")
+# Windows read from the database at once.
+EXPORT_BATCH_SIZE = 16_384
+# Rows of an .npy shard, 4 GB of 1024-d float32 embeddings.
+NPY_SHARD_ROWS = 1_048_576
+NPY_METADATA_FILENAME = "metadata.parquet"
+
+
+def infer_export_format(output_path: str) -> str:
+    """Picks the export format from the extension of the output path.
+
+    ``.csv`` and ``.parquet`` files get their format, any other path is taken as
+    the directory of an ``npy`` export.
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+
+    if ext == ".csv":
+        return "csv"
+
+    if ext in (".parquet", ".pq"):
+        return "parquet"
+
+    return "npy"
+
+
+def iter_window_batches(
+    db: sqlite_usearch_impl.SQLiteUSearchDB,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    representatives_only: bool = False,
+) -> Iterator[tuple[np.ndarray, list[str], np.ndarray, np.ndarray]]:
+    """Yields the windows of the database in batches, ordered by window id.
+
+    Args:
+        db: The database.
+        batch_size: The number of windows per batch.
+        representatives_only: Only yield the representatives of the clusters
+            of near-duplicates, see birdnet_analyzer.embeddings.clusters.
+
+    Yields:
+        The window ids, the file names, the (n, 2) offsets and the (n, dim)
+        float32 embeddings of a batch.
+    """
+    # The offsets are read as raw blobs, which skips the per-row list conversion
+    # hoplite registers for its FLOAT_LIST columns.
+    cursor = db.db.execute(
+        "SELECT windows.id, recordings.filename, CAST(windows.offsets AS BLOB) "
+        "FROM windows JOIN recordings ON recordings.id = windows.recording_id "
+        f"{_representatives_join(representatives_only)} ORDER BY windows.id"
+    )
+
+    try:
+        while rows := cursor.fetchmany(batch_size):
+            window_ids, filenames, offsets = zip(*rows, strict=True)
+            window_ids = np.array(window_ids, dtype=np.int64)
+
+            yield (
+                window_ids,
+                list(filenames),
+                np.frombuffer(b"".join(offsets), dtype="<f8").reshape(-1, 2),
+                np.asarray(db.get_embeddings_batch(window_ids), dtype=np.float32),
+            )
+    finally:
+        cursor.close()
+
+
+def iter_window_ids(
+    db: sqlite_usearch_impl.SQLiteUSearchDB, batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[np.ndarray]:
+    """Yields the window ids of the database in batches, in rowid order.
+
+    Unlike ``db.match_window_ids()`` the ids are never all held in memory.
+    """
+    cursor = db.db.execute("SELECT id FROM windows ORDER BY id")
+
+    try:
+        while rows := cursor.fetchmany(batch_size):
+            yield np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    finally:
+        cursor.close()
+
+
+def export_embeddings(
+    database: str,
+    output_path: str,
+    fmt: str | None = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    representatives_only: bool = False,
+) -> int:
+    """Exports all embeddings of a database.
+
+    Args:
+        database: Path to the database.
+        output_path: The output file, or directory for ``npy``.
+        fmt: One of EXPORT_FORMATS, inferred from ``output_path`` if None.
+        batch_size: The number of windows read and written at once.
+        representatives_only: Only export one embedding of each cluster of
+            near-duplicates, which have to be computed first.
+
+    Returns:
+        The number of exported embeddings.
+    """
+    from birdnet_analyzer.embeddings.core import get_or_create_database
+
+    fmt = fmt or infer_export_format(output_path)
+
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Unknown export format '{fmt}', use one of {', '.join(EXPORT_FORMATS)}."
+        )
+
+    writer = {"csv": _write_csv, "parquet": _write_parquet, "npy": _write_npy}[fmt]
+    target_dir = output_path if fmt == "npy" else os.path.dirname(output_path)
+
+    if target_dir:
+        os.makedirs(target_dir, exist_ok=True)
+
+    db = get_or_create_database(database)
+
+    try:
+        join = _representatives_join(representatives_only)
+        n_windows = db.db.execute(f"SELECT COUNT(*) FROM windows {join}").fetchone()[0]
+
+        with tqdm(total=n_windows, desc="Exporting embeddings") as progress:
+            batches = iter_window_batches(db, batch_size, representatives_only)
+            writer(output_path, batches, n_windows, db.get_embedding_dim(), progress)
+    finally:
+        db.db.close()
+
+    return n_windows
+
+
+def _representatives_join(representatives_only: bool) -> str:
+    from birdnet_analyzer.embeddings.clusters import CLUSTERS_TABLE
+
+    if not representatives_only:
+        return ""
+
+    return (
+        f"JOIN {CLUSTERS_TABLE} ON {CLUSTERS_TABLE}.window_id = windows.id "
+        f"AND {CLUSTERS_TABLE}.cluster_id = windows.id"
+    )
+
+
+@functools.cache
+def _float16_strings() -> np.ndarray:
+    """The CSV text of every float16 value, indexed by its bit pattern."""
+    values = np.arange(2**16, dtype=np.uint16).view(np.float16).astype(np.float32)
+
+    return np.array([f"{v:.9g}" for v in values.tolist()], dtype=object)
+
+
+def _format_embeddings(embeddings: np.ndarray) -> list[str]:
+    """Formats each row of embeddings as comma separated values."""
+    as_float16 = embeddings.astype(np.float16)
+
+    # The database stores float16 by default: look the text of the values up
+    # instead of formatting each one.
+    if np.array_equal(as_float16, embeddings, equal_nan=True):
+        strings = _float16_strings()[as_float16.view(np.uint16)]
+
+        return [",".join(row) for row in strings.tolist()]
+
+    # %.9g round trips float32.
+    row_format = ",".join(["%.9g"] * embeddings.shape[1])
+
+    return [row_format % tuple(row) for row in embeddings.tolist()]
+
+
+def _write_csv(output_path, batches, n_windows, dim, progress):
+    with open(output_path, "w") as f:
+        f.write("file_path,start,end,embedding\n")
+
+        for _, filenames, offsets, embeddings in batches:
+            f.write(
+                "".join(
+                    f'{filename},{start!r},{end!r},"{values}"\n'
+                    for filename, (start, end), values in zip(
+                        filenames,
+                        offsets.tolist(),
+                        _format_embeddings(embeddings),
+                        strict=True,
+                    )
+                )
+            )
+            progress.update(len(filenames))
+
+
+def _metadata_table(window_ids, filenames, offsets, **columns):
+    import pyarrow as pa
+
+    return pa.table(
+        {
+            "window_id": window_ids,
+            "file_path": pa.array(filenames, type=pa.string()),
+            "start": offsets[:, 0],
+            "end": offsets[:, 1],
+            **columns,
+        }
+    )
+
+
+def _write_parquet(output_path, batches, n_windows, dim, progress):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+
+    try:
+        for window_ids, filenames, offsets, embeddings in batches:
+            table = _metadata_table(
+                window_ids,
+                filenames,
+                offsets,
+                embedding=pa.FixedSizeListArray.from_arrays(embeddings.ravel(), dim),
+            )
+
+            if writer is None:
+                # Dictionary encoding only pays off for the repeated file paths.
+                writer = pq.ParquetWriter(
+                    output_path, table.schema, use_dictionary=["file_path"]
+                )
+
+            writer.write_table(table)
+            progress.update(len(filenames))
+
+        if writer is None:
+            empty = _metadata_table(
+                np.empty(0, dtype=np.int64),
+                [],
+                np.empty((0, 2)),
+                embedding=pa.FixedSizeListArray.from_arrays(
+                    np.empty(0, dtype=np.float32), dim
+                ),
+            )
+            pq.write_table(empty, output_path)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _write_npy(output_dir, batches, n_windows, dim, progress):
+    import pyarrow.parquet as pq
+
+    shard = None
+    shard_index = -1
+    row = 0
+    writer = None
+
+    try:
+        for window_ids, filenames, offsets, embeddings in batches:
+            shards = np.empty(len(window_ids), dtype=np.int32)
+            rows = np.empty(len(window_ids), dtype=np.int64)
+            done = 0
+
+            # A batch can straddle two shards.
+            while done < len(window_ids):
+                if shard is None or row == len(shard):
+                    if shard is not None:
+                        shard.flush()
+
+                    shard_index += 1
+                    row = 0
+                    shard = np.lib.format.open_memmap(
+                        os.path.join(output_dir, f"embeddings-{shard_index:05d}.npy"),
+                        mode="w+",
+                        dtype=np.float32,
+                        shape=(
+                            min(
+                                NPY_SHARD_ROWS, n_windows - shard_index * NPY_SHARD_ROWS
+                            ),
+                            dim,
+                        ),
+                    )
+
+                n = min(len(window_ids) - done, len(shard) - row)
+                shard[row : row + n] = embeddings[done : done + n]
+                shards[done : done + n] = shard_index
+                rows[done : done + n] = np.arange(row, row + n)
+                row += n
+                done += n
+
+            table = _metadata_table(
+                window_ids, filenames, offsets, shard=shards, row=rows
+            )
+
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    os.path.join(output_dir, NPY_METADATA_FILENAME), table.schema
+                )
+
+            writer.write_table(table)
+            progress.update(len(filenames))
+
+        if writer is None:
+            pq.write_table(
+                _metadata_table(
+                    np.empty(0, dtype=np.int64),
+                    [],
+                    np.empty((0, 2)),
+                    shard=np.empty(0, dtype=np.int32),
+                    row=np.empty(0, dtype=np.int64),
+                ),
+                os.path.join(output_dir, NPY_METADATA_FILENAME),
+            )
+    finally:
+        if shard is not None:
+            shard.flush()
+
+        if writer is not None:
+            writer.close()
@@ -0,0 +1,316 @@
+"""Memory-mapped copy of the embedding matrix of a database for exhaustive search.
+
+Reading the vectors back from the usearch index costs more than scoring them. A
+search that scores every embedding therefore reads them from a plain matrix kept
+next to the database in ``<database>/matrix/``:
+
+- ``embeddings.npy``: the (n, dim) half precision vectors as stored in the
+  database, opened with ``np.load(..., mmap_mode="r")``. Each block is
+  converted to float32 as it is scanned, so the copy takes no more space than
+  the index it is read from.
+- ``window_ids.npy``: the window id of each row, ascending (rowid order).
+- ``norms.npy``: the float32 L2 norm of each row.
+
+Half precision converts to float32 without loss, so all scores computed on it are
+exact. It is stale as soon as windows are added or removed or the settings of
+the database change; :meth:`EmbeddingMatrix.open` then builds it again.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import mmap
+import os
+import tempfile
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from birdnet_analyzer.embeddings.export import iter_window_ids
+
+if TYPE_CHECKING:
+    from perch_hoplite.db.sqlite_usearch_impl import SQLiteUSearchDB
+
+logger = logging.getLogger(__name__)
+
+MATRIX_DIRNAME = "matrix"
+FORMAT_VERSION = 2
+# Windows read from the database at once while building.
+BUILD_BATCH_SIZE = 16_384
+# Not available on every platform, the advice is then skipped.
+_MADV_WILLNEED = getattr(mmap, "MADV_WILLNEED", None)
+_MADV_DONTNEED = getattr(mmap, "MADV_DONTNEED", None)
+# Settings that do not change the stored vectors.
+_IGNORED_SETTINGS = ("AUDIO_ROOT",)
+
+
+class EmbeddingMatrix:
+    """The embedding matrix of a database.
+
+    Args:
+        embeddings: The (n, dim) float16 vectors, usually memory-mapped.
+        window_ids: The window id of each row.
+        norms: The L2 norm of each row.
+        fingerprint: The state of the database the matrix was built from.
+    """
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        window_ids: np.ndarray,
+        norms: np.ndarray,
+        fingerprint: dict,
+    ):
+        self.embeddings = embeddings
+        self.window_ids = window_ids
+        self.norms = norms
+        self.fingerprint = fingerprint
+
+    def __len__(self):
+        return len(self.window_ids)
+
+    @classmethod
+    def build(cls, db: SQLiteUSearchDB) -> EmbeddingMatrix:
+        """Copies all embeddings of the database next to it.
+
+        Args:
+            db: The database.
+
+        Returns:
+            The matrix, memory-mapped from disk.
+        """
+        directory = matrix_dir(db)
+        meta_path = os.path.join(directory, "meta.json")
+        os.makedirs(directory, exist_ok=True)
+
+        # The meta file marks a complete copy, so it is removed until the new one is.
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        fingerprint = _fingerprint(db)
+        n, dim = fingerprint["n"], fingerprint["dim"]
+        paths = {
+            name: os.path.join(directory, f"{name}.npy")
+            for name in ("embeddings", "window_ids", "norms")
+        }
+
+        # The files are written under names of their own, so that searches
+        # building the matrix at the same time do not write to the same files,
+        # and removed if building fails.
+        tmp_paths = []
+
+        try:
+            with contextlib.ExitStack() as stack:
+                embeddings, window_ids, norms = (
+                    stack.enter_context(
+                        tempfile.NamedTemporaryFile(
+                            dir=directory,
+                            prefix=f"{name}.",
+                            suffix=".tmp",
+                            delete=False,
+                        )
+                    )
+                    for name in paths
+                )
+                tmp_paths = [embeddings.name, window_ids.name, norms.name]
+                _write_npy_header(embeddings, np.float16, (n, dim))
+                _write_npy_header(window_ids, np.int64, (n,))
+                _write_npy_header(norms, np.float32, (n,))
+                written = 0
+
+                # The rows are streamed to disk, so building takes no more memory
+                # than one batch however large the database is.
+                for ids in iter_window_ids(db, BUILD_BATCH_SIZE):
+                    batch = np.asarray(db.get_embeddings_batch(ids), dtype=np.float16)
+                    batch.tofile(embeddings)
+                    ids.tofile(window_ids)
+                    batch = batch.astype(np.float32)
+                    np.sqrt(np.einsum("ij,ij->i", batch, batch)).tofile(norms)
+                    written += len(ids)
+
+            if written != n:
+                raise RuntimeError("The database changed while building its matrix.")
+
+            for tmp_path, path in zip(tmp_paths, paths.values(), strict=True):
+                os.replace(tmp_path, path)
+        except BaseException:
+            for tmp_path in tmp_paths:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(tmp_path)
+            raise
+
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"version": FORMAT_VERSION, "fingerprint": fingerprint}, f)
+
+        return cls.load(db)
+
+    @classmethod
+    def load(cls, db: SQLiteUSearchDB) -> EmbeddingMatrix | None:
+        """Opens the matrix of the database, None if there is none."""
+        directory = matrix_dir(db)
+
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+
+            if meta.get("version") != FORMAT_VERSION:
+                return None
+
+            embeddings = np.load(
+                os.path.join(directory, "embeddings.npy"), mmap_mode="r"
+            )
+            window_ids = np.load(
+                os.path.join(directory, "window_ids.npy"), mmap_mode="r"
+            )
+            norms = np.load(os.path.join(directory, "norms.npy"), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+
+        if not len(embeddings) == len(window_ids) == len(norms):
+            return None
+
+        return cls(embeddings, window_ids, norms, meta["fingerprint"])
+
+    @classmethod
+    def open(cls, db: SQLiteUSearchDB) -> EmbeddingMatrix | None:
+        """Opens the matrix of the database, building it if missing or stale.
+
+        Returns:
+            The matrix, None if it cannot be written next to the database or
+            the database changes while it is built.
+        """
+        matrix = cls.load(db)
+
+        if matrix is not None and matrix.is_current(db):
+            return matrix
+
+        try:
+            return cls.build(db)
+        except (OSError, RuntimeError) as e:
+            logger.warning(
+                "Cannot cache the embedding matrix of %s, searching without it: %s",
+                db.db_path,
+                e,
+            )
+            return None
+
+    def is_current(self, db: SQLiteUSearchDB) -> bool:
+        """Whether the matrix holds the windows of the database in its settings."""
+        return self.fingerprint == _fingerprint(db)
+
+    def blocks(self, block_size: int):
+        """Yields the window ids, float32 vectors and norms of consecutive rows.
+
+        The ids and norms of a memory-mapped matrix are views valid until the
+        next block is requested. The kernel is asked to page in the next block while the
+        current one is used and to unmap the pages of the rows used after, so a
+        scan keeps about one block resident however large the matrix is.
+        """
+        arrays = (self.window_ids, self.embeddings, self.norms)
+
+        if not all(isinstance(array, np.memmap) for array in arrays):
+            for start in range(0, len(self), block_size):
+                yield _upcast(
+                    tuple(array[start : start + block_size] for array in arrays)
+                )
+            return
+
+        mapped = [_MappedArray(array) for array in arrays]
+
+        for start in range(0, len(self), block_size):
+            end = start + block_size
+
+            for array in mapped:
+                array.advise(end, end + block_size, _MADV_WILLNEED)
+
+            yield _upcast(tuple(array.rows[start:end] for array in mapped))
+
+            for array in mapped:
+                array.advise(start, end, _MADV_DONTNEED)
+
+    def subset_blocks(self, window_ids: np.ndarray, block_size: int):
+        """Yields the window ids, float32 vectors and norms of some windows.
+
+        Args:
+            window_ids: The ascending ids of windows in the matrix.
+            block_size: The number of rows per block.
+        """
+        positions = np.searchsorted(self.window_ids, window_ids)
+
+        for start in range(0, len(positions), block_size):
+            rows = positions[start : start + block_size]
+            yield (
+                window_ids[start : start + block_size],
+                self.embeddings[rows].astype(np.float32),
+                np.asarray(self.norms[rows]),
+            )
+
+
+class _MappedArray:
+    """A new read-only mapping of the file of a memory-mapped array."""
+
+    def __init__(self, array: np.memmap):
+        with open(array.filename, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._offset = array.offset
+        self._row_bytes = array.strides[0] if array.ndim else 0
+        self.rows = np.ndarray(
+            array.shape, array.dtype, buffer=self._map, offset=array.offset
+        )
+
+    def advise(self, start: int, end: int, advice: int | None):
+        """Advises the kernel on the whole pages holding rows start:end."""
+        first = self._offset + start * self._row_bytes
+        first -= first % mmap.PAGESIZE
+        last = min(self._offset + end * self._row_bytes, len(self._map))
+
+        if advice is not None and last > first:
+            self._map.madvise(advice, first, last - first)
+
+
+def _upcast(block: tuple) -> tuple:
+    window_ids, embeddings, norms = block
+    return window_ids, embeddings.astype(np.float32), norms
+
+
+def matrix_dir(db: SQLiteUSearchDB) -> str:
+    """The directory holding the embedding matrix of the database."""
+    return os.path.join(str(db.db_path), MATRIX_DIRNAME)
+
+
+def _write_npy_header(f, dtype, shape: tuple[int, ...]):
+    np.lib.format.write_array_header_1_0(
+        f,
+        {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            "fortran_order": False,
+            "shape": shape,
+        },
+    )
+
+
+def _fingerprint(db: SQLiteUSearchDB) -> dict:
+    from birdnet_analyzer.embeddings.core import SETTINGS_KEY
+
+    n, max_window_id = db.db.execute(
+        "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM windows"
+    ).fetchone()
+
+    try:
+        settings = db.get_metadata(SETTINGS_KEY).to_dict()
+    except KeyError:
+        settings = {}
+
+    for key in _IGNORED_SETTINGS:
+        settings.pop(key, None)
+
+    return {
+        "n": n,
+        "max_window_id": max_window_id,
+        "dim": db.get_embedding_dim(),
+        # Round trip through JSON, as stored in the meta file.
+        "settings": json.loads(json.dumps(settings, sort_keys=True, default=str)),
+    }
@@ -23,6 +23,7 @@ def run_embeddings_with_tqdm_tracking(
     audio_speed,
     fmin,
     fmax,
+    model_choice,
     enable_file_output,
     file_output,
     progress=gr.Progress(track_tqdm=True),
@@ -37,6 +38,7 @@ def run_embeddings_with_tqdm_tracking(
         audio_speed,
         fmin,
         fmax,
+        gu.birdnet_version(model_choice),
         file_output if enable_file_output else None,
         progress,
     )
@@ -53,16 +55,25 @@ def run_embeddings(
     audio_speed,
     fmin,
     fmax,
+    version,
     file_output,
     progress,
 ):
-    from birdnet_analyzer.embeddings.core import SETTINGS_KEY, embeddings
+    from birdnet_analyzer import model_utils
+    from birdnet_analyzer.embeddings.core import (
+        SETTINGS_KEY,
+        embeddings,
+        get_model_version,
+    )
 
     gu.validate(input_path, loc.localize("embeddings-input-dir-validation-message"))
     gu.validate(db_directory, loc.localize("embeddings-db-dir-validation-message"))
     gu.validate(db_directory, loc.localize("embeddings-db-name-validation-message"))
 
-    db = get_embeddings_database(db_directory)
+    db = get_embeddings_database(
+        db_directory,
+        embedding_dim=model_utils.acoustic_model_class(version).get_embeddings_dim(),
+    )
 
     try:
         settings = db.get_metadata(SETTINGS_KEY)
@@ -78,6 +89,7 @@ def run_embeddings(
             audio_speed=settings["AUDIO_SPEED"],
             fmin=settings["BANDPASS_FMIN"],
             fmax=settings["BANDPASS_FMAX"],
+            version=get_model_version(settings),
             file_output=file_output,
         )
     except Exception as e:
@@ -97,6 +109,7 @@ def run_embeddings(
             audio_speed=audio_speed,
             fmin=fmin,
             fmax=fmax,
+            version=version,
             batch_size=batch_size,
             file_output=file_output,
         )
@@ -108,11 +121,12 @@ def run_embeddings(
         gr.Slider(interactive=False),
         gr.Number(interactive=False),
         gr.Number(interactive=False),
+        gr.Radio(interactive=False),
     )
 
 
 def build_embeddings_tab() -> gu.TAB_BUILDER_RESULT:
-    from birdnet_analyzer.embeddings.core import SETTINGS_KEY
+    from birdnet_analyzer.embeddings.core import SETTINGS_KEY, get_model_version
 
     state = TabState("embeddings")
 
@@ -249,6 +263,14 @@ def build_embeddings_tab() -> gu.TAB_BUILDER_RESULT:
 
             fmin_number, fmax_number = gu.bandpass_settings(state)
 
+            model_radio = state.persist(
+                "model_radio",
+                gr.Radio,
+                choices=gu.birdnet_model_choices(),
+                value=gu.birdnet_model_choice("2.4"),
+                label=loc.localize("model-selection-radio-label"),
+            )
+
         def select_directory_and_update_tb(current_state):
             dir_name: str = gu.select_directory(
                 state_key="embeddings-db-dir", collect_files=False
@@ -278,6 +300,12 @@ def build_embeddings_tab() -> gu.TAB_BUILDER_RESULT:
                                     value=settings["BANDPASS_FMAX"],
                                     interactive=False,
                                 ),
+                                gr.update(
+                                    value=gu.birdnet_model_choice(
+                                        get_model_version(settings)
+                                    ),
+                                    interactive=False,
+                                ),
                                 gr.update(visible=True),
                             )
                         except KeyError:
@@ -291,6 +319,7 @@ def build_embeddings_tab() -> gu.TAB_BUILDER_RESULT:
                     gr.update(interactive=True),
                     gr.update(interactive=True),
                     gr.update(interactive=True),
+                    gr.update(interactive=True),
                     gr.update(visible=True),
                 )
 
@@ -301,6 +330,7 @@ def build_embeddings_tab() -> gu.TAB_BUILDER_RESULT:
                 gr.update(),
                 gr.update(),
                 gr.update(),
+                gr.update(),
             )
 
         select_db_directory_btn.click(
@@ -312,6 +342,7 @@ def build_embeddings_tab() -> gu.TAB_BUILDER_RESULT:
                 audio_speed_slider,
                 fmin_number,
                 fmax_number,
+                model_radio,
                 file_output_row,
             ],
             show_progress="hidden",
@@ -350,10 +381,17 @@ def build_embeddings_tab() -> gu.TAB_BUILDER_RESULT:
                 audio_speed_slider,
                 fmin_number,
                 fmax_number,
+                model_radio,
                 file_output_cb,
                 file_output_tb,
             ],
-            outputs=[progress_plot, audio_speed_slider, fmin_number, fmax_number],
+            outputs=[
+                progress_plot,
+                audio_speed_slider,
+                fmin_number,
+                fmax_number,
+                model_radio,
+            ],
             show_progress_on=progress_plot,
         )
 
@@ -8,9 +8,12 @@ from birdnet_analyzer.embeddings.core import (
     get_or_create_database as get_embeddings_database,
 )
 from birdnet_analyzer.gui.state import TabState
+from birdnet_analyzer.search.cache import SearchResultsCache
 from birdnet_analyzer.search.core import get_database as get_search_database
 
 PAGE_SIZE = 6
+# Results of recent queries, so that running one again does not search again.
+SEARCH_CACHE = SearchResultsCache()
 
 
 def play_audio(audio_infos):
@@ -29,12 +32,14 @@ def play_audio(audio_infos):
 
 
 def run_export(export_state: dict):
-    from birdnet_analyzer import audio
+    from birdnet_analyzer.search.utils import export_windows
 
     if len(export_state.items()) > 0:
         export_folder = gu.select_folder(state_key="embeddings-search-export-folder")
 
         if export_folder:
+            windows = []
+
             for file in export_state.values():
                 filebasename = os.path.basename(file[0])
                 filebasename = os.path.splitext(filebasename)[0]
@@ -42,11 +47,10 @@ def run_export(export_state: dict):
                     export_folder,
                     f"{file[4]:.5f}_{filebasename}_{file[1]}_{file[1] + file[2]}.wav",
                 )
-                # TODO @mamau: Missing audio speed?
-                sig, rate = audio.open_audio_file(
-                    file[0], offset=file[1], duration=file[2], sample_rate=None
-                )
-                audio.save_signal(sig, dest, rate)
+                windows.append((file[0], file[1], file[2], dest))
+
+            # All results share the audio speed of the database, play_audio uses it too.
+            export_windows(windows, speed=next(iter(export_state.values()))[5])
 
         gr.Info(
             f"{loc.localize('embeddings-search-export-finish-info')} {export_folder}"
@@ -68,7 +72,7 @@ def update_export_state(audio_infos, checkbox_value, export_state: dict):
 def run_search(
     db_path, audio_root, query_path, max_samples, score_fn, crop_mode, crop_overlap
 ):
-    from birdnet_analyzer.embeddings.core import SETTINGS_KEY
+    from birdnet_analyzer.embeddings.core import SETTINGS_KEY, get_model_version
     from birdnet_analyzer.search.utils import get_search_results
 
     gu.validate(db_path, loc.localize("embeddings-search-db-validation-message"))
@@ -82,8 +86,11 @@ def run_search(
 
     db = get_search_database(db_path)
     settings = db.get_metadata(SETTINGS_KEY)
-    settings["AUDIO_ROOT"] = audio_root
-    db.insert_metadata(SETTINGS_KEY, settings)
+
+    # Writing the database would change its fingerprint and miss the cache.
+    if settings.get("AUDIO_ROOT") != audio_root:
+        settings["AUDIO_ROOT"] = audio_root
+        db.insert_metadata(SETTINGS_KEY, settings)
 
     results = get_search_results(
         query_path,
@@ -95,6 +102,8 @@ def run_search(
         score_fn,
         crop_mode,
         crop_overlap,
+        version=get_model_version(settings),
+        cache=SEARCH_CACHE,
     )
     db.db.close()  # Close the database connection to avoid having wal/shm files
 
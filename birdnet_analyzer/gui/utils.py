@@ -325,17 +325,19 @@ def get_audio_files_and_durations(folder, max_files=None):
         list: A list of lists, where each inner list contains the relative file path and
             its duration as a string.
     """
-    import librosa
+    from birdnet_analyzer.audio import get_audio_infos
 
-    files_and_durations = []
     files = utils.collect_audio_files(folder, max_files=max_files)
+    infos = get_audio_infos(files, ignore_errors=True)
+    files_and_durations = []
 
     for file_path in files:
-        try:
-            duration = format_seconds(librosa.get_duration(path=file_path))
-
-        except Exception as _:
-            duration = "0:00"  # Default value in case of an error
+        # Default value in case the file could not be read
+        duration = (
+            format_seconds(infos[file_path]["duration"])
+            if file_path in infos
+            else "0:00"
+        )
 
         files_and_durations.append([os.path.relpath(file_path, folder), duration])
     return files_and_durations
@@ -681,6 +683,20 @@ def model_choices():
     return values
 
 
+def birdnet_model_choices():
+    """The BirdNET acoustic models that can be selected, e.g. to create embeddings."""
+    return [choice for choice in model_choices() if is_birdnet_model(choice)]
+
+
+def birdnet_model_choice(version: str) -> str:
+    """The model choice of a BirdNET acoustic model version."""
+    return next(
+        choice
+        for choice, choice_version in _BIRDNET_MODEL_VERSIONS.items()
+        if choice_version == version
+    )
+
+
 def default_model():
     """The model selected by default: the newest available BirdNET acoustic model."""
     choices = model_choices()
@@ -34,6 +34,13 @@ if TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 GLOBAL_PREFETCH_RATIO = 2
+# Segments a single encoding run may hold. The library pads the embeddings of a run to
+# its longest file, so encode_files plans runs that keep n_files * max_segments below
+# this (256 MB of 1024-d float32 embeddings).
+ENCODE_BUFFER_SEGMENTS = 65_536
+# Crops a query session encodes at once, and the seconds it stays open without a query.
+QUERY_SESSION_BATCH_SIZE = 32
+QUERY_SESSION_IDLE_TIMEOUT_S = 300.0
 
 
 def match_species_to_model(
@@ -240,7 +247,8 @@ def cancel_active_analyses() -> int:
 
     Latches shutdown so any analysis started after this call (e.g. by a Gradio
     worker thread still finishing a queued request) is cancelled as soon as it
-    registers, instead of running headless.
+    registers, instead of running headless. The shared query session (see
+    :func:`get_query_embeddings_array`) is cancelled and closed as well.
 
     Returns:
         The number of sessions that were asked to cancel.
@@ -253,6 +261,8 @@ def cancel_active_analyses() -> int:
         with suppress(Exception):
             session.cancel()
 
+    _QUERY_SESSION.cancel()
+
     return len(sessions)
 
 
@@ -482,6 +492,22 @@ def _load_acoustic_for_embeddings(version: ACOUSTIC_MODEL_VERSIONS):
     return birdnet.load("acoustic", version, "tf")
 
 
+def acoustic_model_class(version: ACOUSTIC_MODEL_VERSIONS):
+    """The acoustic model class of ``version``, without loading the model.
+
+    Its classmethods report the sample rate, segment size and embedding dimension,
+    e.g. to create or check a database before the model is downloaded.
+    """
+    if version == "3.0":
+        from birdnet.acoustic.models.v3_0.model import AcousticModelV3_0
+
+        return AcousticModelV3_0
+
+    from birdnet.acoustic.models.v2_4.model import AcousticModelV2_4
+
+    return AcousticModelV2_4
+
+
 def get_embeddings(
     path: str,
     version: ACOUSTIC_MODEL_VERSIONS = "2.4",
@@ -510,6 +536,130 @@ def get_embeddings(
     )  # ty:ignore[invalid-return-type]
 
 
+def list_audio_inputs(path) -> list[str]:
+    """Lists the audio files the library would process for ``path``.
+
+    Args:
+        path: An audio file, a directory (searched recursively) or a list of them.
+
+    Returns:
+        The sorted absolute paths of the supported audio files.
+
+    Raises:
+        ValueError: If a path does not exist or no audio files were found.
+    """
+    from birdnet.acoustic.inference.configs import InferenceConfig
+
+    return [str(f) for f in InferenceConfig.validate_input_files(path)]
+
+
+def _plan_encoding_runs(
+    files: list[str], durations: dict[str, float], step_s: float, max_segments: int
+) -> list[list[str]]:
+    """Groups files into encoding runs of bounded padded size.
+
+    Files are sorted by duration, so each run holds files of similar length and little
+    memory is spent on padding. Files of unknown duration get a run of their own.
+
+    Args:
+        files: The files to encode.
+        durations: The duration of each file in seconds, after the speed factor.
+        step_s: The hop between two segments in seconds.
+        max_segments: The maximum n_files * max_segments of a run.
+
+    Returns:
+        The files of each run.
+    """
+    import math
+
+    runs = [[f] for f in files if f not in durations]
+    run: list[str] = []
+
+    for f in sorted((f for f in files if f in durations), key=durations.__getitem__):
+        n_segments = max(1, math.ceil(durations[f] / step_s))
+
+        # Sorted by duration, so the new file is the longest of the run.
+        if run and (len(run) + 1) * n_segments > max_segments:
+            runs.append(run)
+            run = []
+
+        run.append(f)
+
+    if run:
+        runs.append(run)
+
+    return runs
+
+
+def encode_files(
+    files: list[str],
+    on_file_complete: Callable[[AcousticFileEncodingResult], None],
+    version: ACOUSTIC_MODEL_VERSIONS = "2.4",
+    batch_size=1,
+    n_workers: int | None = None,
+    n_producers: int = 1,
+    prefetch_ratio=GLOBAL_PREFETCH_RATIO,
+    overlap_duration_s=0.0,
+    bandpass_fmin=0,
+    bandpass_fmax=15_000,
+    speed=1.0,
+    callback: Callable[[AcousticProgressStats], None] | None = None,
+    max_buffer_segments: int = ENCODE_BUFFER_SEGMENTS,
+) -> None:
+    """Encodes audio files and streams the embeddings of each file.
+
+    Unlike :func:`get_embeddings`, no result for the whole input is built. The files
+    are encoded in runs of bounded size through one session, and every file's
+    embeddings are handed to ``on_file_complete`` as soon as the file is done, the
+    same way :func:`run_inference` streams predictions.
+
+    Args:
+        files: The audio files, see :func:`list_audio_inputs`.
+        on_file_complete: Called with a single-file result for every file, from a
+            background thread. Blocking in it throttles the encoder; raising cancels
+            the run.
+        max_buffer_segments: Bounds the number of segments a run buffers, see
+            ENCODE_BUFFER_SEGMENTS.
+
+    See :func:`get_embeddings` for the other arguments.
+    """
+    from birdnet_analyzer.audio import get_audio_infos
+
+    if not files:
+        return
+
+    model = _load_acoustic_for_embeddings(version)
+    step_s = model.get_segment_size_s() - overlap_duration_s
+    infos = get_audio_infos(files, ignore_errors=True)
+    durations = {f: info["duration"] / speed for f, info in infos.items()}
+    runs = _plan_encoding_runs(files, durations, step_s, max_buffer_segments)
+
+    with model.encode_session(
+        batch_size=batch_size,
+        prefetch_ratio=prefetch_ratio,
+        overlap_duration_s=overlap_duration_s,
+        bandpass_fmin=bandpass_fmin,
+        bandpass_fmax=bandpass_fmax,
+        speed=speed,
+        progress_callback=callback,
+        n_workers=n_workers,
+        n_producers=n_producers,
+        max_n_files=max(len(run) for run in runs),
+        on_file_complete=on_file_complete,
+    ) as session:
+        _register_session(session)
+        try:
+            for run in runs:
+                if _SHUTDOWN.is_set():
+                    break
+
+                # The per-file results were already handed out, drop the padded
+                # result of the run right away.
+                session.run(run)
+        finally:
+            _unregister_session(session)
+
+
 def get_embeddings_array_with_session(
     session: AcousticEncodingSession,
     signals: list[tuple[np.ndarray, int]],
@@ -598,3 +748,145 @@ def get_embeddings_array(
     # embeddings is (n_inputs, n_segments, embed_dim); each input is one segment, so
     # squeeze the middle dim to get (n_inputs, embed_dim).
     return result.embeddings[:, 0, :]
+
+
+class _QuerySession:
+    """An encoding session kept open between queries.
+
+    Opening a session loads the model and starts its worker processes, which takes
+    far longer than encoding the few crops of a query. The session is opened on the
+    first query, serves queries one at a time and is closed after
+    QUERY_SESSION_IDLE_TIMEOUT_S without one, on exit, on shutdown (see
+    :func:`cancel_active_analyses`) or when a query needs another model version.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session: AcousticEncodingSession | None = None
+        self._version: str | None = None
+        self._sample_rate = 0
+        self._idle_timer: threading.Timer | None = None
+        self._atexit_registered = False
+
+    def run_arrays(
+        self, signals: list[np.ndarray], version: ACOUSTIC_MODEL_VERSIONS
+    ) -> np.ndarray:
+        with self._lock:
+            if _SHUTDOWN.is_set():
+                raise RuntimeError("Shutting down, no more queries are encoded.")
+
+            self._cancel_idle_timer()
+
+            if self._session is not None and self._version != version:
+                self._close()
+
+            if self._session is None:
+                self._open(version)
+
+            assert self._session is not None
+
+            try:
+                result = self._session.run_arrays(
+                    [(sig, self._sample_rate) for sig in signals]
+                )
+            except BaseException:
+                # A failed or cancelled session cannot run again.
+                self._close()
+                raise
+
+            timer = threading.Timer(
+                QUERY_SESSION_IDLE_TIMEOUT_S, lambda: self._close_if_idle(timer)
+            )
+            timer.daemon = True
+            timer.start()
+            self._idle_timer = timer
+
+        # embeddings is (n_inputs, n_segments, embed_dim); each input is one segment,
+        # so squeeze the middle dim to get (n_inputs, embed_dim).
+        return result.embeddings[:, 0, :]
+
+    def cancel(self) -> None:
+        """Cancels a running query and closes the session, from any thread."""
+        session = self._session
+
+        if session is not None:
+            with suppress(Exception):
+                session.cancel()
+
+        # A running query closes the session itself once it fails.
+        if self._lock.acquire(blocking=False):
+            try:
+                self._close()
+            finally:
+                self._lock.release()
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+    def _open(self, version: ACOUSTIC_MODEL_VERSIONS) -> None:
+        import atexit
+
+        model = _load_acoustic_for_embeddings(version)
+        # The query signals are already bandpass filtered and sped up, so the
+        # session keeps the no-op defaults for those.
+        self._session = model.encode_session(
+            batch_size=QUERY_SESSION_BATCH_SIZE,
+            prefetch_ratio=GLOBAL_PREFETCH_RATIO,
+            n_workers=1,
+            n_producers=1,
+        ).__enter__()
+        self._version = version
+        self._sample_rate = model.get_sample_rate()
+
+        if not self._atexit_registered:
+            atexit.register(self.close)
+            self._atexit_registered = True
+
+    def _close(self) -> None:
+        self._cancel_idle_timer()
+        session, self._session, self._version = self._session, None, None
+
+        if session is not None:
+            with suppress(Exception):
+                session.__exit__(None, None, None)
+
+    def _close_if_idle(self, timer: threading.Timer) -> None:
+        with self._lock:
+            # The timer may fire while a query holds the lock, which then starts a
+            # timer of its own; only the current timer closes the session.
+            if self._idle_timer is timer:
+                self._idle_timer = None
+                self._close()
+
+    def _cancel_idle_timer(self) -> None:
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+
+_QUERY_SESSION = _QuerySession()
+
+
+def get_query_embeddings_array(
+    signals: list[np.ndarray], version: ACOUSTIC_MODEL_VERSIONS = "2.4"
+) -> np.ndarray:
+    """Encodes single-segment signals through the shared query session.
+
+    Like :func:`get_embeddings_array` with its defaults, but the model and its
+    encoding session stay loaded between calls, so repeated searches do not pay for
+    loading them. Thread-safe, concurrent calls are encoded one after another.
+
+    Args:
+        signals: The signals at the sample rate of the model, one segment each.
+        version: The BirdNET version.
+
+    Returns:
+        The (n_inputs, embed_dim) embeddings.
+    """
+    return _QUERY_SESSION.run_arrays(signals, version)
+
+
+def close_query_session() -> None:
+    """Closes the shared query session, the next query opens a new one."""
+    _QUERY_SESSION.close()
@@ -173,6 +173,7 @@ def load_train_params(path: str) -> dict[str, Any]:
     parse("fmin", _to_int, "Bandpass filter minimum")
     parse("fmax", _to_int, "Bandpass filter maximum")
     parse("audio_speed", float, "Audio speed")
+    parse("resampler", str, "Resampler")
     parse("crop_mode", str, "Crop mode")
     parse("overlap", float, "Crop overlap")
     parse("autotune", _to_bool, "Autotune")
@@ -0,0 +1,135 @@
+"""An LRU cache of the results of searches for query files.
+
+Searching for the same query file again, e.g. to show more or fewer results in
+the GUI, would encode the query and score the database again. The cache keeps
+the scored results of recent queries under a key of
+
+- the SHA-256 of the bytes of the query file, so that a renamed file is still
+  found and a rewritten one is not,
+- the arguments the results depend on, e.g. the crop mode and score function,
+- the fingerprint of the database, its path, number of embeddings and the last
+  modification time of its files, so that results of a changed database are
+  never returned.
+
+At least ``min_results`` results are searched for and kept per query, so that
+any number of results up to that is served from the same entry. They are the
+first results of that deeper search; for queries of several crops these can
+differ from a search for fewer results, as the mean score of a window counts
+the crops it is among the results of.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Hashable
+
+    from perch_hoplite.db.search_results import SearchResult
+    from perch_hoplite.db.sqlite_usearch_impl import SQLiteUSearchDB
+
+# Queries whose results are kept.
+SEARCH_CACHE_SIZE = 32
+# Results searched for and kept per query, at least.
+SEARCH_CACHE_MIN_RESULTS = 100
+_READ_SIZE = 1 << 20
+
+
+class SearchResultsCache:
+    """An LRU cache of the results of query files, safe to share between threads.
+
+    Args:
+        maxsize: The number of queries whose results are kept.
+        min_results: The number of results searched for and kept per query, at
+            least.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = SEARCH_CACHE_SIZE,
+        min_results: int = SEARCH_CACHE_MIN_RESULTS,
+    ):
+        self.maxsize = maxsize
+        self.min_results = min_results
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[int, list[SearchResult]]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(
+        self, queryfile_path: str, db: SQLiteUSearchDB, *args: Hashable
+    ) -> tuple[Hashable, ...]:
+        """The key of the results of a query file in a database.
+
+        Args:
+            queryfile_path: The query file.
+            db: The database searched.
+            *args: The arguments the results depend on.
+        """
+        return (query_digest(queryfile_path), database_fingerprint(db), *args)
+
+    def get(self, key: Hashable, n_results: int) -> list[SearchResult] | None:
+        """The first ``n_results`` results kept under the key, if there are enough."""
+        with self._lock:
+            entry = self._entries.get(key)
+
+            # Fewer results than searched for are all there are.
+            if entry is None or (n_results > entry[0] and len(entry[1]) == entry[0]):
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1][:n_results]
+
+    def put(self, key: Hashable, n_searched: int, results: list[SearchResult]):
+        """Keeps the results of searching for ``n_searched`` results under the key."""
+        with self._lock:
+            self._entries[key] = (n_searched, list(results))
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+def query_digest(path: str) -> str:
+    """The SHA-256 of the bytes of a file."""
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        while chunk := f.read(_READ_SIZE):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def database_fingerprint(db: SQLiteUSearchDB) -> tuple:
+    """The path, number of embeddings and last modification of a database.
+
+    The modification time is the latest of the files of the database directory,
+    the SQLite database with its journal and the embeddings.
+    """
+    path = os.path.realpath(os.fspath(db.db_path))
+
+    with os.scandir(path) as entries:
+        mtime = max(
+            (entry.stat().st_mtime_ns for entry in entries if entry.is_file()),
+            default=0,
+        )
+
+    return path, db.count_embeddings(), mtime
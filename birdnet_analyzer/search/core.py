@@ -3,94 +3,349 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
+    from datetime import datetime
+
     from birdnet_analyzer.config import CROP_MODES, SCORE_FUNCTIONS
 
+RESULTS_TABLE_FILENAME = "search_results.csv"
+RESULTS_TABLE_HEADER = (
+    "Query",
+    "Rank",
+    "Score",
+    "File",
+    "Start (s)",
+    "End (s)",
+    "Result",
+    "Database",
+)
+
 
 def search(
     output: str,
-    database: str,
+    database: str | list[str],
     audio_root: str,
-    queryfile: str,
+    queryfile: str | list[str],
     *,
     n_results: int = 10,
     score_function: SCORE_FUNCTIONS = "cosine",
     crop_mode: CROP_MODES = "center",
     overlap: float = 0.0,
+    resampler: str | None = None,
+    exact: bool = False,
+    memory_budget: float | None = None,
+    file_glob: str | None = None,
+    deployment: str | None = None,
+    time_from: datetime | None = None,
+    time_to: datetime | None = None,
+    collapse_duplicates: bool = False,
 ):
     """
     Executes a search query on a given database and saves the results as audio files.
     Args:
         output (str): Path to the output directory where the results will be saved.
-        database (str): Path to the database file to search in.
-        queryfile (str): Path to the query file containing the search input.
+        database (str | list[str]): Path to the database to search in. Several
+            databases of embeddings computed with the same settings are
+            searched together, see Notes.
+        audio_root (str): Path to the root directory of the audio files. Defaults
+            to the one stored in each database if empty.
+        queryfile (str | list[str]): Path to the query file containing the search
+            input. A directory or a list of files and directories searches all
+            query files in them at once, see Notes.
         n_results (int, optional): Number of top results to return. Defaults to 10.
         score_function (SCORE_FUNCTIONS, optional):
             Scoring function to use for similarity calculation. Defaults to "cosine".
         crop_mode (CROP_MODES, optional):
             Mode for cropping audio segments. Defaults to "center".
         overlap (float, optional): Overlap ratio for audio segments. Defaults to 0.0.
+        resampler (str, optional): Resampler used for the query file, one of
+            audio.RESAMPLERS. Defaults to audio.DEFAULT_RESAMPLER.
+        exact (bool, optional): Score every embedding even if the database has an
+            ANN index or a compressed copy for the score function. Defaults to False.
+        memory_budget (float, optional): Memory in MiB the embeddings read at once
+            by the exhaustive search may take, so that databases larger than the
+            memory can be searched. Defaults to None, blocks of a fixed size.
+        file_glob (str, optional): Only search the recordings whose file name
+            relative to the audio root matches this glob, e.g. "site_x/*".
+        deployment (str, optional): Only search the recordings of this deployment.
+        time_from (datetime, optional): Only search recordings starting at or after
+            this time, parsed from their file names.
+        time_to (datetime, optional): Only search recordings starting before this
+            time, parsed from their file names.
+        collapse_duplicates (bool, optional): Keep only the best result of each
+            cluster of near-duplicates, see birdnet_analyzer.embeddings.clusters.
+            Defaults to False.
     Raises:
-        ValueError: If the database does not contain the required settings metadata.
+        ValueError: If the database does not contain the required settings metadata,
+            several databases have different settings or no query file is found.
     Notes:
         - The function creates the output directory if it does not exist.
         - It retrieves metadata from the database to configure the search, including
-          bandpass filter settings and audio speed.
+          bandpass filter settings, audio speed and the BirdNET version that
+          encodes the query.
         - The results are saved as audio files in the specified output directory, with
           filenames containing the score, source file name, and time offsets.
+        - Several query files are encoded together and searched in one pass over
+          the database. The results of each are saved in a folder named after it,
+          and all results are listed in RESULTS_TABLE_FILENAME in the output
+          directory.
+        - The filters are resolved to the windows they keep before the search,
+          see birdnet_analyzer.search.filters, so only those are scored.
+        - Several databases are searched on parallel threads with the query
+          encoded once, and their best results are merged. The files of the
+          results are prefixed with the name of their database, and the results
+          are listed in RESULTS_TABLE_FILENAME with it.
     Returns:
         None
     """
     import os
 
     from birdnet_analyzer import audio
-    from birdnet_analyzer.embeddings.core import SETTINGS_KEY
-    from birdnet_analyzer.search.utils import get_search_results
+    from birdnet_analyzer.embeddings.core import get_model_version
+    from birdnet_analyzer.search.filters import SearchFilter
+    from birdnet_analyzer.search.utils import (
+        export_windows,
+        get_batch_search_results,
+        get_federated_search_results,
+        get_search_results,
+    )
+
+    if not isinstance(queryfile, str) and len(queryfile) == 1:
+        queryfile = queryfile[0]
+
+    databases = [database] if isinstance(database, str) else list(database)
+    queryfiles = _collect_query_files(queryfile)
+
+    if not queryfiles:
+        raise ValueError(f"No query files found in {queryfile}.")
 
     if not os.path.exists(output):
         os.makedirs(output)
 
-    db = get_database(database)
+    dbs = [get_database(path) for path in databases]
 
     try:
-        settings = db.get_metadata(SETTINGS_KEY)
-    except KeyError as e:
-        raise ValueError("No settings present in database.") from e
-
-    fmin: int = settings["BANDPASS_FMIN"]
-    fmax: int = settings["BANDPASS_FMAX"]
-    audio_speed: float = settings["AUDIO_SPEED"]
-    sig_length: float = settings.get("SIG_LENGTH", 3.0)
-    duration = sig_length * audio_speed
-    results = get_search_results(
-        queryfile,
-        db,
-        n_results,
-        audio_speed,
-        fmin,
-        fmax,
-        score_function,
-        crop_mode,
-        overlap,
-        sig_length,
+        all_settings = _database_settings(dbs, databases)
+        settings = all_settings[0]
+        fmin: int = settings["BANDPASS_FMIN"]
+        fmax: int = settings["BANDPASS_FMAX"]
+        audio_speed: float = settings["AUDIO_SPEED"]
+        sig_length: float = settings.get("SIG_LENGTH", 3.0)
+        duration = sig_length * audio_speed
+        search_args = (
+            n_results,
+            audio_speed,
+            fmin,
+            fmax,
+            score_function,
+            crop_mode,
+            overlap,
+            sig_length,
+        )
+        search_kwargs = {
+            "resampler": resampler or audio.DEFAULT_RESAMPLER,
+            "version": get_model_version(settings),
+            "exact": exact,
+            "memory_budget_mb": memory_budget,
+            "search_filter": SearchFilter(file_glob, deployment, time_from, time_to),
+            "collapse_duplicates": collapse_duplicates,
+        }
+        single_query = isinstance(queryfile, str) and not os.path.isdir(queryfile)
+
+        if len(dbs) > 1:
+            results = get_federated_search_results(
+                queryfiles, dbs, *search_args, **search_kwargs
+            )
+        elif single_query:
+            results = [
+                [
+                    (0, result)
+                    for result in get_search_results(
+                        queryfile, dbs[0], *search_args, **search_kwargs
+                    )
+                ]
+            ]
+        else:
+            results = [
+                [(0, result) for result in query_results]
+                for query_results in get_batch_search_results(
+                    queryfiles, dbs[0], *search_args, **search_kwargs
+                )
+            ]
+
+        # Results from several databases are prefixed with the name of theirs.
+        prefixes = (
+            [f"{name}_" for name in _query_names(databases)] if len(dbs) > 1 else [""]
+        )
+        located, rows = [], []
+
+        for query_name, query_file, query_results in zip(
+            _query_names(queryfiles), queryfiles, results, strict=True
+        ):
+            query_output = output if single_query else os.path.join(output, query_name)
+            os.makedirs(query_output, exist_ok=True)
+
+            for rank, (i, result) in enumerate(query_results, start=1):
+                located_result = _locate_results(
+                    dbs[i],
+                    [result],
+                    query_output,
+                    audio_root or all_settings[i].get("AUDIO_ROOT", ""),
+                    duration,
+                    prefixes[i],
+                )[0]
+                _, result_file, file, _, offset = located_result
+                located.append(located_result)
+                rows.append(
+                    [
+                        query_file,
+                        rank,
+                        f"{result.sort_score:.5f}",
+                        file,
+                        offset,
+                        offset + duration,
+                        os.path.relpath(result_file, output),
+                        databases[i],
+                    ]
+                )
+    finally:
+        for db in dbs:
+            db.db.close()
+
+    if len(dbs) > 1 or not single_query:
+        _write_results_table(os.path.join(output, RESULTS_TABLE_FILENAME), rows)
+
+    # Results of all queries from one recording are read from it at once, at the
+    # audio speed of the databases as in the GUI.
+    export_windows(
+        [
+            (source, offset, duration, result_file)
+            for _, result_file, _, source, offset in located
+        ],
+        speed=audio_speed,
     )
 
+
+def _database_settings(dbs, databases: list[str]) -> list:
+    """The settings of the databases, which have to match to be searched together.
+
+    Raises:
+        ValueError: If a database has no settings or its embeddings were computed
+            by another model or with other settings than those of the first.
+    """
+    from birdnet_analyzer.embeddings.core import SETTINGS_KEY, get_model_version
+
+    all_settings = []
+
+    for path, db in zip(databases, dbs, strict=True):
+        try:
+            all_settings.append(db.get_metadata(SETTINGS_KEY))
+        except KeyError as e:
+            message = "No settings present in database"
+            raise ValueError(
+                f"{message} {path}." if len(dbs) > 1 else f"{message}."
+            ) from e
+
+    def key(db, settings):
+        return {
+            "BANDPASS_FMIN": settings.get("BANDPASS_FMIN"),
+            "BANDPASS_FMAX": settings.get("BANDPASS_FMAX"),
+            "AUDIO_SPEED": settings.get("AUDIO_SPEED"),
+            "SIG_LENGTH": settings.get("SIG_LENGTH", 3.0),
+            "version": get_model_version(settings),
+            "embedding dimension": db.get_embedding_dim(),
+        }
+
+    expected = key(dbs[0], all_settings[0])
+
+    for path, db, settings in zip(
+        databases[1:], dbs[1:], all_settings[1:], strict=True
+    ):
+        actual = key(db, settings)
+        differing = [name for name in expected if actual[name] != expected[name]]
+
+        if differing:
+            raise ValueError(
+                f"The database {path} cannot be searched together with "
+                f"{databases[0]}, their {', '.join(differing)} differ."
+            )
+
+    return all_settings
+
+
+def _collect_query_files(queryfile: str | list[str]) -> list[str]:
+    """The query files, with the audio files of any directory among them."""
+    import os
+
+    from birdnet_analyzer import utils
+
+    files = []
+
+    for path in [queryfile] if isinstance(queryfile, str) else queryfile:
+        if os.path.isdir(path):
+            files.extend(utils.collect_audio_files(path))
+        else:
+            files.append(path)
+
+    return files
+
+
+def _query_names(queryfiles: list[str]) -> list[str]:
+    """Unique folder names for the results of the query files."""
+    import os
+
+    names = []
+
+    for path in queryfiles:
+        stem = name = os.path.splitext(os.path.basename(path))[0]
+        i = 1
+
+        while name in names:
+            i += 1
+            name = f"{stem}_{i}"
+
+        names.append(name)
+
+    return names
+
+
+def _locate_results(
+    db, results, output: str, audio_root: str, duration: float, prefix: str = ""
+):
+    """Finds the audio of the results and names the files to save it to.
+
+    The name of the source file is prefixed with ``prefix`` in them.
+
+    Returns:
+        For each result, the result, the file to save its audio to, the source
+        file relative to the audio root, the path to it and the offset in it.
+    """
+    import os
+
+    located = []
+
     for r in results:
         window = db.get_window(r.window_id)
         recording = db.get_recording(window.recording_id)
         file = os.path.join(audio_root, recording.filename)
         filebasename = os.path.basename(file)
-        filebasename = os.path.splitext(filebasename)[0]
+        filebasename = prefix + os.path.splitext(filebasename)[0]
         offset = window.offsets[0]
-        sig, rate = audio.open_audio_file(
-            file, offset=offset, duration=duration, sample_rate=None
-        )
         result_path = os.path.join(
             output,
             f"{r.sort_score:.5f}_{filebasename}_{offset}_{offset + duration}.wav",
         )
-        audio.save_signal(sig, result_path, rate)
+        located.append((r, result_path, recording.filename, file, offset))
+
+    return located
+
+
+def _write_results_table(path: str, rows: list[list]):
+    import csv
 
-    db.db.close()
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(RESULTS_TABLE_HEADER)
+        writer.writerows(rows)
 
 
 def get_database(database_path):
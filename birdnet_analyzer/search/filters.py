@@ -0,0 +1,139 @@
+"""Metadata filters restricting a search to the windows of some recordings.
+
+A filter is resolved to the sorted ids of the windows it keeps with a single SQL
+query, before any embedding is scored:
+
+- ``filename``: a glob matched against the file name of the recording relative
+  to the audio root with SQLite's ``GLOB``, so it is case sensitive and ``*``
+  also matches ``/``, e.g. ``"site_x/*"``.
+- ``deployment``: the name of the hoplite deployment of the recording.
+- ``start`` and ``end``: the range of the start times of the recordings, taken
+  from the ``datetime`` column of the recording or else parsed from its file
+  name by :func:`parse_recording_datetime`. Recordings without a start time are
+  left out when either bound is set.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import re
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from perch_hoplite.db.sqlite_usearch_impl import SQLiteUSearchDB
+
+# A date with an optional time, as written by most recorders, e.g.
+# 20230501_053000.wav (AudioMoth), SITE1_20230501_053000.wav (Song Meter) or
+# 2023-05-01T05-30-00.flac. The digits may not be part of a longer number.
+_DATETIME_PATTERN = re.compile(
+    r"(?<!\d)(\d{4})-?(\d{2})-?(\d{2})"
+    r"(?:[T_ -]?(\d{2})[-:]?(\d{2})(?:[-:]?(\d{2}))?)?(?!\d)"
+)
+_SQL_FUNCTION = "birdnet_recording_time"
+
+
+def parse_recording_datetime(filename: str) -> dt.datetime | None:
+    """The start time of a recording encoded in its file name.
+
+    Only the last path component is parsed; the last valid date in it is used.
+
+    Args:
+        filename: The path of the recording.
+
+    Returns:
+        The start time, midnight if the name holds only a date, or None if it
+        holds no valid date.
+    """
+    name = re.split(r"[\\/]", filename)[-1]
+
+    for match in reversed(list(_DATETIME_PATTERN.finditer(name))):
+        try:
+            return dt.datetime(*(int(part) for part in match.groups() if part))
+        except ValueError:
+            continue
+
+    return None
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """Restricts a search to the windows of the recordings matching all fields.
+
+    Attributes:
+        filename: Glob the file name relative to the audio root has to match.
+        deployment: Name of the deployment of the recordings.
+        start: Earliest start time of the recordings, inclusive.
+        end: Latest start time of the recordings, exclusive.
+    """
+
+    filename: str | None = None
+    deployment: str | None = None
+    start: dt.datetime | None = None
+    end: dt.datetime | None = None
+
+    def __bool__(self):
+        return any(
+            value is not None
+            for value in (self.filename, self.deployment, self.start, self.end)
+        )
+
+    def window_ids(self, db: SQLiteUSearchDB) -> np.ndarray:
+        """The ids of the windows of the database kept by the filter, ascending."""
+        joins, conditions, params = [], [], []
+
+        if self.filename is not None:
+            conditions.append("r.filename GLOB ?")
+            params.append(self.filename)
+
+        if self.deployment is not None:
+            joins.append("JOIN deployments d ON d.id = r.deployment_id")
+            conditions.append("d.name = ?")
+            params.append(self.deployment)
+
+        for bound, operator in ((self.start, ">="), (self.end, "<")):
+            if bound is not None:
+                conditions.append(
+                    f"{_SQL_FUNCTION}(r.filename, r.datetime) {operator} ?"
+                )
+                params.append(_sql_time(bound))
+
+        if self.start is not None or self.end is not None:
+            db.db.create_function(_SQL_FUNCTION, 2, _recording_time, deterministic=True)
+
+        # The recordings are selected first, so the start time of each is parsed
+        # once rather than once per window.
+        cursor = db.db.execute(
+            " ".join(
+                [
+                    "SELECT id FROM windows WHERE recording_id IN",
+                    "(SELECT r.id FROM recordings r",
+                    *joins,
+                    "WHERE",
+                    " AND ".join(conditions) or "1",
+                    ") ORDER BY id",
+                ]
+            ),
+            params,
+        )
+
+        return np.fromiter((row[0] for row in cursor), dtype=np.int64)
+
+
+def _sql_time(value: dt.datetime) -> str:
+    """The time as text that sorts like it, ignoring any time zone."""
+    return value.replace(tzinfo=None).isoformat(sep=" ", timespec="seconds")
+
+
+def _recording_time(filename: str, stored: str | None) -> str | None:
+    if stored:
+        try:
+            return _sql_time(dt.datetime.fromisoformat(stored))
+        except ValueError:
+            pass
+
+    parsed = parse_recording_datetime(filename)
+
+    return None if parsed is None else _sql_time(parsed)
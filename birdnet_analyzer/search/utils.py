@@ -1,18 +1,41 @@
 from __future__ import annotations
 
+import logging
 from typing import TYPE_CHECKING, get_args
 
 import numpy as np
-from perch_hoplite.db import brutalism
 from perch_hoplite.db.search_results import SearchResult
 from scipy.spatial.distance import euclidean
 
 from birdnet_analyzer import audio, model_utils
 from birdnet_analyzer.config import CROP_MODES, SCORE_FUNCTIONS
+from birdnet_analyzer.embeddings import ann, clusters, compression
+from birdnet_analyzer.embeddings.export import iter_window_ids
+from birdnet_analyzer.embeddings.matrix import EmbeddingMatrix
 
 if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from birdnet.globals import ACOUSTIC_MODEL_VERSIONS
     from perch_hoplite.db.sqlite_usearch_impl import SQLiteUSearchDB
 
+    from birdnet_analyzer.search.cache import SearchResultsCache
+    from birdnet_analyzer.search.filters import SearchFilter
+
+logger = logging.getLogger(__name__)
+
+# Embeddings scored against all query crops at once by the brute-force search.
+BRUTE_SEARCH_BLOCK_SIZE = 16_384
+# Blocks read ahead of the one being scored by the brute-force search.
+BRUTE_SEARCH_PREFETCH = 1
+# Filters keeping a smaller share of the embeddings score all of them instead of
+# taking the inverse share more candidates from an ANN index.
+FILTER_ANN_MIN_SELECTIVITY = 0.05
+# Results searched per result kept when collapsing them to one per cluster.
+COLLAPSE_OVERSAMPLE = 4
+# Threads reading and writing audio in export_windows.
+EXPORT_MAX_WORKERS = 8
+
 
 def _get_usearch_metric_name(db: SQLiteUSearchDB) -> str | None:
     try:
@@ -22,16 +45,6 @@ def _get_usearch_metric_name(db: SQLiteUSearchDB) -> str | None:
     return str(usearch_cfg.get("metric_name", "")).upper() or None
 
 
-def _search_ann_ip(
-    db: SQLiteUSearchDB, query_embedding: np.ndarray, n_results: int
-) -> list[SearchResult]:
-    matches = db.ui.search(query_embedding, count=n_results)
-    return [
-        SearchResult(window_id=int(window_id), sort_score=float(score))
-        for window_id, score in zip(matches.keys, matches.distances, strict=False)
-    ]
-
-
 def cosine_sim(data: np.ndarray, query: np.ndarray) -> float | np.ndarray:
     if data.ndim == 2:
         norms = np.linalg.norm(data, axis=1) * np.linalg.norm(query)
@@ -51,7 +64,311 @@ def euclidean_scoring_inverse(
     return -euclidean_scoring(data, query)
 
 
-def get_query_embedding(
+def _score_matrix(
+    block: np.ndarray,
+    queries: np.ndarray,
+    score_function: SCORE_FUNCTIONS,
+    block_norms: np.ndarray | None = None,
+) -> np.ndarray:
+    """Scores a block of embeddings against all queries, higher is more similar.
+
+    Args:
+        block: The (n, dim) float32 embeddings.
+        queries: The (n_queries, dim) float32 queries, of unit length for "cosine".
+        score_function: One of SCORE_FUNCTIONS, "euclidean" scores the negative
+            distance like euclidean_scoring_inverse.
+        block_norms: The L2 norms of the embeddings, computed if None.
+
+    Returns:
+        The (n_queries, n) scores.
+    """
+    scores = queries @ block.T
+
+    if score_function == "dot":
+        return scores
+
+    if block_norms is None:
+        block_sq_norms = np.einsum("ij,ij->i", block, block)
+        block_norms = np.sqrt(block_sq_norms)
+    else:
+        block_sq_norms = np.square(block_norms)
+
+    if score_function == "cosine":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores /= block_norms
+    else:
+        # |b - q|^2 = |b|^2 - 2 q.b + |q|^2, the products come from the one matmul.
+        scores *= -2
+        scores += block_sq_norms
+        scores += np.einsum("ij,ij->i", queries, queries)[:, None]
+        np.sqrt(np.maximum(scores, 0, out=scores), out=scores)
+        np.negative(scores, out=scores)
+
+    return scores
+
+
+def _prepare_queries(queries: np.ndarray, score_function: SCORE_FUNCTIONS):
+    """The queries as a float32 matrix, of unit length for "cosine"."""
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+
+    if score_function == "cosine":
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+    return queries
+
+
+def _best_first(ids: np.ndarray, scores: np.ndarray):
+    order = np.argsort(-scores, axis=1, kind="stable")
+
+    return np.take_along_axis(ids, order, 1), np.take_along_axis(scores, order, 1)
+
+
+def _top_k(ids: np.ndarray, scores: np.ndarray, k: int):
+    """The k best ids and scores of each row, unordered."""
+    if scores.shape[1] <= k:
+        return ids, scores
+
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+    return np.take_along_axis(ids, best, 1), np.take_along_axis(scores, best, 1)
+
+
+def brute_search_block_size(dim: int, n_queries: int, memory_budget_mb: float) -> int:
+    """The largest block size at which a brute-force search fits the budget.
+
+    While a block is scored, up to BRUTE_SEARCH_PREFETCH more are queued and
+    the next is being read, each row taking its float32 vector and norm and its
+    int64 window id. Scoring a row takes the float32 scores of all queries, their
+    negation and the int64 indices partitioning them.
+
+    Args:
+        dim: The dimension of the embeddings.
+        n_queries: The number of query embeddings.
+        memory_budget_mb: The memory in MiB the blocks may take.
+
+    Returns:
+        The block size, at least 1.
+    """
+    bytes_per_row = (BRUTE_SEARCH_PREFETCH + 2) * (dim * 4 + 12) + n_queries * 16
+
+    return max(1, int(memory_budget_mb * 2**20) // bytes_per_row)
+
+
+def batched_brute_search(
+    db: SQLiteUSearchDB,
+    queries: np.ndarray,
+    n_results: int,
+    score_function: SCORE_FUNCTIONS,
+    block_size: int = BRUTE_SEARCH_BLOCK_SIZE,
+    memory_budget_mb: float | None = None,
+    window_ids: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Searches the best embeddings of each query in one pass over the database.
+
+    The embeddings are read in blocks of ``block_size``; each block is scored
+    against all queries with a single matrix product and only the best
+    ``n_results`` per query are kept. They are read from the EmbeddingMatrix of
+    the database, which is built on first use, or in rowid order from the
+    database if it cannot be. Either way the next block is read ahead while the
+    current one is scored and no more than a few blocks are held in memory at
+    any time, so databases larger than it can be searched.
+
+    Args:
+        db: The database.
+        queries: The (n_queries, dim) query embeddings.
+        n_results: The number of results per query.
+        score_function: One of SCORE_FUNCTIONS.
+        block_size: The number of embeddings scored at once.
+        memory_budget_mb: If given, the block size is chosen to keep the memory
+            taken by the blocks below this many MiB, see brute_search_block_size.
+        window_ids: If given, only the embeddings of these windows are read and
+            scored. Must be ascending.
+
+    Returns:
+        The (n_queries, k) window ids and scores, best first, with k the smaller
+        of n_results and the number of embeddings. Scores are higher for more
+        similar embeddings, "euclidean" scores are negative distances.
+    """
+    queries = _prepare_queries(queries, score_function)
+    top_ids = np.empty((len(queries), 0), dtype=np.int64)
+    top_scores = np.empty((len(queries), 0), dtype=np.float32)
+
+    if memory_budget_mb is not None:
+        block_size = brute_search_block_size(
+            db.get_embedding_dim(), len(queries), memory_budget_mb
+        )
+
+    for ids, block, block_norms in _embedding_blocks(db, block_size, window_ids):
+        block_ids, block_scores = _top_k(
+            np.broadcast_to(ids, (len(queries), len(ids))),
+            _score_matrix(block, queries, score_function, block_norms),
+            n_results,
+        )
+        top_ids, top_scores = _top_k(
+            np.concatenate([top_ids, block_ids], axis=1),
+            np.concatenate([top_scores, block_scores], axis=1),
+            n_results,
+        )
+
+    return _best_first(top_ids, top_scores)
+
+
+def _embedding_blocks(
+    db: SQLiteUSearchDB, block_size: int, window_ids: np.ndarray | None = None
+):
+    """Yields the window ids, float32 embeddings and their norms, if known.
+
+    All windows are read unless ``window_ids`` are given. Blocks read from the
+    database are read by a background thread, the kernel reads ahead those of
+    the memory-mapped matrix.
+    """
+    matrix = EmbeddingMatrix.open(db)
+
+    if matrix is not None:
+        if window_ids is None:
+            yield from matrix.blocks(block_size)
+        else:
+            yield from matrix.subset_blocks(window_ids, block_size)
+        return
+
+    if window_ids is None:
+        batches = iter_window_ids(db, block_size)
+    else:
+        batches = (
+            window_ids[start : start + block_size]
+            for start in range(0, len(window_ids), block_size)
+        )
+
+    yield from _prefetched(
+        (ids, np.asarray(db.get_embeddings_batch(ids), dtype=np.float32), None)
+        for ids in batches
+    )
+
+
+def _prefetched(items: Iterator, depth: int = BRUTE_SEARCH_PREFETCH):
+    """Iterates the items, producing up to ``depth`` ahead on another thread.
+
+    Exceptions raised producing an item are raised when it is reached. When the
+    iteration is stopped early the producing thread closes the items.
+    """
+    import queue
+    import threading
+
+    pending = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+
+            put(done)
+        except BaseException as e:
+            put(e)
+        finally:
+            if hasattr(items, "close"):
+                items.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while (item := pending.get()) is not done:
+            if isinstance(item, BaseException):
+                raise item
+
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def rank_candidates(
+    db: SQLiteUSearchDB,
+    queries: np.ndarray,
+    candidates: np.ndarray,
+    n_results: int,
+    score_function: SCORE_FUNCTIONS,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Ranks the candidates of each query with the exact embeddings.
+
+    Args:
+        db: The database.
+        queries: The (n_queries, dim) query embeddings.
+        candidates: The (n_queries, n) candidate window ids, padded with -1.
+        n_results: The number of results per query.
+        score_function: One of SCORE_FUNCTIONS.
+
+    Returns:
+        The (n_queries, k) window ids and scores, best first, as returned by
+        batched_brute_search. Missing results are padded with -1 and -inf.
+    """
+    valid = candidates >= 0
+    unique_ids = np.unique(candidates[valid])
+    scores = np.full(candidates.shape, -np.inf, dtype=np.float32)
+
+    if len(unique_ids):
+        matrix = _score_matrix(
+            np.asarray(db.get_embeddings_batch(unique_ids), dtype=np.float32),
+            _prepare_queries(queries, score_function),
+            score_function,
+        )
+        positions = np.searchsorted(unique_ids, np.where(valid, candidates, 0))
+        positions = np.minimum(positions, len(unique_ids) - 1)
+        scores[valid] = np.take_along_axis(matrix, positions, 1)[valid]
+
+    return _best_first(*_top_k(candidates, scores, n_results))
+
+
+def _merge_crop_results(
+    window_ids: np.ndarray,
+    scores: np.ndarray,
+    n_queries: int,
+    n_results: int,
+    score_function: SCORE_FUNCTIONS,
+) -> list[SearchResult]:
+    """Averages the scores of each window over all query crops.
+
+    A window scores 0 for the crops it is not among the results of.
+
+    Args:
+        window_ids: The window ids of the results of all crops.
+        scores: Their scores, "euclidean" scores are negative distances.
+        n_queries: The number of query crops.
+        n_results: The number of results.
+        score_function: One of SCORE_FUNCTIONS.
+
+    Returns:
+        The best results, "euclidean" scored by their distance.
+    """
+    unique_ids, inverse = np.unique(window_ids, return_inverse=True)
+    mean_scores = np.bincount(inverse, weights=scores) / n_queries
+
+    if score_function == "euclidean":
+        mean_scores = -mean_scores
+        order = np.argsort(mean_scores, kind="stable")
+    else:
+        order = np.argsort(-mean_scores, kind="stable")
+
+    return [
+        SearchResult(window_id=int(unique_ids[i]), sort_score=float(mean_scores[i]))
+        for i in order[:n_results]
+    ]
+
+
+def get_query_signals(
     queryfile_path,
     crop_mode: CROP_MODES = "center",
     crop_overlap=0.0,
@@ -60,33 +377,115 @@ def get_query_embedding(
     audio_speed=1.0,
     sig_length=3.0,
     sig_minlen=1.0,
-):
+    resampler=audio.DEFAULT_RESAMPLER,
+    version: ACOUSTIC_MODEL_VERSIONS = "2.4",
+) -> list[np.ndarray]:
     """
-    Extracts the embedding for a query file. Reads only the first 3 seconds
+    Reads the crops of a query file that get_query_embedding encodes.
     Args:
         queryfile_path: The path to the query file.
+        version: The BirdNET version that encoded the database, see
+            embeddings.core.get_model_version.
     Returns:
-        The query embedding.
+        The signals of the crops, at the sample rate of the model.
     """
 
     sig, rate = audio.open_audio_file(
         queryfile_path,
+        sample_rate=model_utils.acoustic_model_class(version).get_sample_rate(),
         duration=sig_length * audio_speed if crop_mode == "first" else None,
         fmin=bandpass_fmin,
         fmax=bandpass_fmax,
         speed=audio_speed,
+        resampler=resampler,
     )
 
     if crop_mode == "center":
-        sig_splits = [audio.crop_center(sig, rate, sig_length)]
-    elif crop_mode == "first":
-        sig_splits = [
-            audio.split_signal(sig, rate, sig_length, crop_overlap, sig_minlen)[0]
-        ]
-    else:
-        sig_splits = audio.split_signal(sig, rate, sig_length, crop_overlap, sig_minlen)
+        return [audio.crop_center(sig, rate, sig_length)]
+
+    if crop_mode == "first":
+        return [audio.split_signal(sig, rate, sig_length, crop_overlap, sig_minlen)[0]]
+
+    return audio.split_signal(sig, rate, sig_length, crop_overlap, sig_minlen)
+
+
+def get_query_embedding(
+    queryfile_path,
+    crop_mode: CROP_MODES = "center",
+    crop_overlap=0.0,
+    bandpass_fmin=0,
+    bandpass_fmax=15000,
+    audio_speed=1.0,
+    sig_length=3.0,
+    sig_minlen=1.0,
+    resampler=audio.DEFAULT_RESAMPLER,
+    version: ACOUSTIC_MODEL_VERSIONS = "2.4",
+):
+    """
+    Extracts the embedding for a query file. Reads only the first 3 seconds
+    Args:
+        queryfile_path: The path to the query file.
+        version: The BirdNET version that encoded the database, see
+            embeddings.core.get_model_version.
+    Returns:
+        The query embedding.
+    """
+    sig_splits = get_query_signals(
+        queryfile_path,
+        crop_mode=crop_mode,
+        crop_overlap=crop_overlap,
+        bandpass_fmin=bandpass_fmin,
+        bandpass_fmax=bandpass_fmax,
+        audio_speed=audio_speed,
+        sig_length=sig_length,
+        sig_minlen=sig_minlen,
+        resampler=resampler,
+        version=version,
+    )
+
+    return model_utils.get_query_embeddings_array(sig_splits, version=version)
+
+
+def get_query_embeddings_batch(
+    queryfile_paths: list[str],
+    crop_mode: CROP_MODES = "center",
+    crop_overlap=0.0,
+    bandpass_fmin=0,
+    bandpass_fmax=15000,
+    audio_speed=1.0,
+    sig_length=3.0,
+    sig_minlen=1.0,
+    resampler=audio.DEFAULT_RESAMPLER,
+    version: ACOUSTIC_MODEL_VERSIONS = "2.4",
+) -> list[np.ndarray]:
+    """
+    Encodes the crops of several query files in one run of the query session.
+    Args:
+        queryfile_paths: The paths to the query files.
+        The other arguments are those of get_query_embedding.
+    Returns:
+        The (n_crops, dim) embeddings of each query file.
+    """
+    sig_splits = [
+        get_query_signals(
+            path,
+            crop_mode=crop_mode,
+            crop_overlap=crop_overlap,
+            bandpass_fmin=bandpass_fmin,
+            bandpass_fmax=bandpass_fmax,
+            audio_speed=audio_speed,
+            sig_length=sig_length,
+            sig_minlen=sig_minlen,
+            resampler=resampler,
+            version=version,
+        )
+        for path in queryfile_paths
+    ]
+    embeddings = model_utils.get_query_embeddings_array(
+        [sig for splits in sig_splits for sig in splits], version=version
+    )
 
-    return model_utils.get_embeddings_array(sig_splits, n_workers=1)
+    return np.split(embeddings, np.cumsum([len(splits) for splits in sig_splits])[:-1])
 
 
 def get_search_results(
@@ -102,7 +501,52 @@ def get_search_results(
     sig_length=3.0,
     sig_fmin=0,
     sig_fmax=15000,
+    resampler=audio.DEFAULT_RESAMPLER,
+    version: ACOUSTIC_MODEL_VERSIONS = "2.4",
+    exact: bool = False,
+    memory_budget_mb: float | None = None,
+    search_filter: SearchFilter | None = None,
+    collapse_duplicates: bool = False,
+    cache: SearchResultsCache | None = None,
 ):
+    """Searches the database for a query file.
+
+    The query is encoded by get_query_embedding and searched for by
+    search_query_embeddings, with the arguments clamped.
+
+    Args:
+        cache: If given, the results are looked up in it first, or else at least
+            its ``min_results`` results are searched for and kept in it, see
+            birdnet_analyzer.search.cache.
+
+    Returns:
+        The results, best first.
+    """
+    if cache is not None:
+        key = cache.key(
+            queryfile_path,
+            db,
+            audio_speed,
+            fmin,
+            fmax,
+            score_function,
+            crop_mode,
+            crop_overlap,
+            sig_length,
+            sig_fmin,
+            sig_fmax,
+            resampler,
+            version,
+            exact,
+            search_filter,
+            collapse_duplicates,
+        )
+        cached = cache.get(key, n_results)
+
+        if cached is not None:
+            return cached
+
+    n_searched = n_results if cache is None else max(n_results, cache.min_results)
     bandpass_fmin = max(0, min(sig_fmax, int(fmin)))
     bandpass_fmax = max(sig_fmin, min(sig_fmax, int(fmax)))
     audio_speed = max(0.01, audio_speed)
@@ -115,8 +559,250 @@ def get_search_results(
         bandpass_fmax=bandpass_fmax,
         audio_speed=audio_speed,
         sig_length=sig_length,
+        resampler=resampler,
+        version=version,
+    )
+
+    results = search_query_embeddings(
+        db,
+        [query_embeddings],
+        n_searched,
+        score_function,
+        exact,
+        memory_budget_mb,
+        search_filter,
+        collapse_duplicates,
+    )[0]
+
+    if cache is not None:
+        cache.put(key, n_searched, results)
+
+    return results[:n_results]
+
+
+def get_batch_search_results(
+    queryfile_paths: list[str],
+    db: SQLiteUSearchDB,
+    n_results=10,
+    audio_speed=1.0,
+    fmin=0,
+    fmax=15000,
+    score_function: SCORE_FUNCTIONS = "cosine",
+    crop_mode: CROP_MODES = "center",
+    crop_overlap=0.0,
+    sig_length=3.0,
+    sig_fmin=0,
+    sig_fmax=15000,
+    resampler=audio.DEFAULT_RESAMPLER,
+    version: ACOUSTIC_MODEL_VERSIONS = "2.4",
+    exact: bool = False,
+    memory_budget_mb: float | None = None,
+    search_filter: SearchFilter | None = None,
+    collapse_duplicates: bool = False,
+) -> list[list[SearchResult]]:
+    """Searches the database for several query files at once.
+
+    The crops of all queries are encoded together and scored in one pass over
+    the database; the arguments are those of get_search_results.
+
+    Returns:
+        The results of each query file, in the order of ``queryfile_paths``.
+    """
+    query_embeddings = _encode_query_files(
+        queryfile_paths,
+        audio_speed,
+        fmin,
+        fmax,
+        crop_mode,
+        crop_overlap,
+        sig_length,
+        sig_fmin,
+        sig_fmax,
+        resampler,
+        version,
+    )
+
+    return search_query_embeddings(
+        db,
+        query_embeddings,
+        n_results,
+        score_function,
+        exact,
+        memory_budget_mb,
+        search_filter,
+        collapse_duplicates,
+    )
+
+
+def get_federated_search_results(
+    queryfile_paths: list[str],
+    dbs: list[SQLiteUSearchDB],
+    n_results=10,
+    audio_speed=1.0,
+    fmin=0,
+    fmax=15000,
+    score_function: SCORE_FUNCTIONS = "cosine",
+    crop_mode: CROP_MODES = "center",
+    crop_overlap=0.0,
+    sig_length=3.0,
+    sig_fmin=0,
+    sig_fmax=15000,
+    resampler=audio.DEFAULT_RESAMPLER,
+    version: ACOUSTIC_MODEL_VERSIONS = "2.4",
+    exact: bool = False,
+    memory_budget_mb: float | None = None,
+    search_filter: SearchFilter | None = None,
+    collapse_duplicates: bool = False,
+) -> list[list[tuple[int, SearchResult]]]:
+    """Searches several databases for several query files at once.
+
+    The queries are encoded once and searched in all databases by
+    search_databases; the arguments are those of get_search_results. The
+    databases have to hold embeddings of the same model and settings.
+
+    Returns:
+        The results of each query file, in the order of ``queryfile_paths``, as
+        pairs of the index of the database in ``dbs`` and the result.
+    """
+    query_embeddings = _encode_query_files(
+        queryfile_paths,
+        audio_speed,
+        fmin,
+        fmax,
+        crop_mode,
+        crop_overlap,
+        sig_length,
+        sig_fmin,
+        sig_fmax,
+        resampler,
+        version,
+    )
+
+    return search_databases(
+        dbs,
+        query_embeddings,
+        n_results,
+        score_function,
+        exact,
+        memory_budget_mb,
+        search_filter,
+        collapse_duplicates,
+    )
+
+
+def _encode_query_files(
+    queryfile_paths: list[str],
+    audio_speed,
+    fmin,
+    fmax,
+    crop_mode: CROP_MODES,
+    crop_overlap,
+    sig_length,
+    sig_fmin,
+    sig_fmax,
+    resampler,
+    version: ACOUSTIC_MODEL_VERSIONS,
+) -> list[np.ndarray]:
+    """The crop embeddings of the query files, with the arguments clamped."""
+    return get_query_embeddings_batch(
+        queryfile_paths,
+        crop_mode=crop_mode,
+        crop_overlap=max(0.0, min(2.9, float(crop_overlap))),
+        bandpass_fmin=max(0, min(sig_fmax, int(fmin))),
+        bandpass_fmax=max(sig_fmin, min(sig_fmax, int(fmax))),
+        audio_speed=max(0.01, audio_speed),
+        sig_length=sig_length,
+        resampler=resampler,
+        version=version,
     )
 
+
+def search_query_embeddings(
+    db: SQLiteUSearchDB,
+    query_embeddings: list[np.ndarray],
+    n_results: int,
+    score_function: SCORE_FUNCTIONS = "cosine",
+    exact: bool = False,
+    memory_budget_mb: float | None = None,
+    search_filter: SearchFilter | None = None,
+    collapse_duplicates: bool = False,
+) -> list[list[SearchResult]]:
+    """Searches the database for the crops of several queries at once.
+
+    The crops of all queries are searched together, by an ANN index, the
+    compressed copy or the brute-force search, and their results are then
+    merged per query.
+
+    Args:
+        db: The database.
+        query_embeddings: The (n_crops, dim) crop embeddings of each query.
+        n_results: The number of results per query.
+        score_function: One of SCORE_FUNCTIONS.
+        exact: Score every embedding even if there is an ANN index or a
+            compressed copy.
+        memory_budget_mb: The memory in MiB the embeddings scored at once by the
+            brute-force search may take, see batched_brute_search.
+        search_filter: If given, only the windows it keeps are searched. They
+            are looked up first; an ANN index is used for them unless they are
+            fewer than FILTER_ANN_MIN_SELECTIVITY of all, in which case only
+            they are scored.
+        collapse_duplicates: Keep only the best result of each cluster of
+            near-duplicates, see birdnet_analyzer.embeddings.clusters.
+            COLLAPSE_OVERSAMPLE times ``n_results`` results are searched for
+            it, and as many times more again for queries left with too few.
+
+    Returns:
+        The results of each query.
+    """
+    if not collapse_duplicates:
+        return _search_query_embeddings(
+            db,
+            query_embeddings,
+            n_results,
+            score_function,
+            exact,
+            memory_budget_mb,
+            search_filter,
+        )
+
+    results: list[list[SearchResult]] = [[] for _ in query_embeddings]
+    pending = list(range(len(query_embeddings)))
+    n_candidates = n_results * COLLAPSE_OVERSAMPLE
+
+    while pending:
+        found = _search_query_embeddings(
+            db,
+            [query_embeddings[i] for i in pending],
+            n_candidates,
+            score_function,
+            exact,
+            memory_budget_mb,
+            search_filter,
+        )
+        short = []
+
+        for i, candidates in zip(pending, found, strict=True):
+            results[i] = clusters.collapse_results(db, candidates, n_results)
+
+            # Fewer candidates than searched for are all there are.
+            if len(results[i]) < n_results and len(candidates) == n_candidates:
+                short.append(i)
+
+        pending = short
+        n_candidates *= COLLAPSE_OVERSAMPLE
+
+    return results
+
+
+def _search_query_embeddings(
+    db: SQLiteUSearchDB,
+    query_embeddings: list[np.ndarray],
+    n_results: int,
+    score_function: SCORE_FUNCTIONS = "cosine",
+    exact: bool = False,
+    memory_budget_mb: float | None = None,
+    search_filter: SearchFilter | None = None,
+) -> list[list[SearchResult]]:
     if score_function == "cosine":
         score_fn = cosine_sim
     elif score_function == "dot":
@@ -132,48 +818,248 @@ def get_search_results(
 
     db_embeddings_count = db.count_embeddings()
     n_results = min(n_results, db_embeddings_count - 1)
+    kept_ids = search_filter.window_ids(db) if search_filter else None
+
+    if kept_ids is not None:
+        n_results = min(n_results, len(kept_ids))
+
     if n_results <= 0:
-        return []
+        return [[] for _ in query_embeddings]
 
-    usearch_metric_name = _get_usearch_metric_name(db)
-    # ANN path is currently safe only for inner product scoring.
-    use_ann = score_function == "dot" and usearch_metric_name == "IP"
+    crops = np.concatenate(query_embeddings)
+    selectivity = 1.0 if kept_ids is None else len(kept_ids) / db_embeddings_count
+    candidates = (
+        None
+        if exact or selectivity < FILTER_ANN_MIN_SELECTIVITY
+        else _ann_candidates(db, crops, n_results, score_function, kept_ids)
+    )
 
-    scores_by_embedding_id: dict[int, list[float]] = {}
+    if candidates is not None:
+        window_ids, scores = rank_candidates(
+            db, crops, candidates, n_results, score_function
+        )
+    else:
+        compressed = (
+            None
+            if exact or kept_ids is not None
+            else compression.CompressedEmbeddings.load(db)
+        )
 
-    for embedding in query_embeddings:
-        if use_ann:
-            sorted_results = _search_ann_ip(db, embedding, n_results)
-        else:
-            results = brutalism.threaded_brute_search(
+        if compressed is not None and not compressed.is_current(db):
+            logger.warning(
+                "The compressed embeddings are out of date, searching the full "
+                "embeddings. Run birdnet-embeddings again to update them."
+            )
+            compressed = None
+
+        if compressed is None:
+            window_ids, scores = batched_brute_search(
                 db,
-                embedding,
+                crops,
+                n_results,
+                score_function,
+                memory_budget_mb=memory_budget_mb,
+                window_ids=kept_ids,
+            )
+        else:
+            window_ids = np.full((len(crops), n_results), -1, dtype=np.int64)
+            scores = np.full((len(crops), n_results), -np.inf)
+
+            for row, embedding in enumerate(crops):
+                sorted_results = compression.search(
+                    db, compressed, embedding, n_results, score_function, score_fn
+                )
+                window_ids[row, : len(sorted_results)] = [
+                    result.window_id for result in sorted_results
+                ]
+                scores[row, : len(sorted_results)] = [
+                    result.sort_score for result in sorted_results
+                ]
+
+    results = []
+    start = 0
+
+    for embeddings in query_embeddings:
+        rows = slice(start, start + len(embeddings))
+        found = window_ids[rows] >= 0
+        results.append(
+            _merge_crop_results(
+                window_ids[rows][found],
+                scores[rows][found],
+                len(embeddings),
                 n_results,
-                score_fn,  # ty:ignore[invalid-argument-type]
+                score_function,
+            )
+        )
+        start += len(embeddings)
+
+    return results
+
+
+def search_databases(
+    dbs: list[SQLiteUSearchDB],
+    query_embeddings: list[np.ndarray],
+    n_results: int,
+    score_function: SCORE_FUNCTIONS = "cosine",
+    exact: bool = False,
+    memory_budget_mb: float | None = None,
+    search_filter: SearchFilter | None = None,
+    collapse_duplicates: bool = False,
+) -> list[list[tuple[int, SearchResult]]]:
+    """Searches several databases for the crops of several queries at once.
+
+    Each database is searched by search_query_embeddings on its own thread and
+    the results of each query are merged by score.
+
+    Args:
+        dbs: The databases, of embeddings of the same model and settings.
+        query_embeddings: The (n_crops, dim) crop embeddings of each query.
+        n_results: The number of results per query over all databases.
+        score_function: One of SCORE_FUNCTIONS.
+        exact: Passed to search_query_embeddings.
+        memory_budget_mb: Passed to search_query_embeddings, for each database.
+        search_filter: Passed to search_query_embeddings.
+        collapse_duplicates: Passed to search_query_embeddings, the clusters of
+            each database are collapsed.
+
+    Returns:
+        The best results of each query, best first, as pairs of the index of the
+        database in ``dbs`` and the result.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=len(dbs)) as pool:
+        results = list(
+            pool.map(
+                lambda db: search_query_embeddings(
+                    db,
+                    query_embeddings,
+                    n_results,
+                    score_function,
+                    exact,
+                    memory_budget_mb,
+                    search_filter,
+                    collapse_duplicates,
+                ),
+                dbs,
             )
-            sorted_results = results.search_results
+        )
+
+    # "euclidean" results are scored by their distance, lower is better.
+    sign = 1 if score_function == "euclidean" else -1
+    merged = []
+
+    for query in range(len(query_embeddings)):
+        tagged = [
+            (i, result)
+            for i, db_results in enumerate(results)
+            for result in db_results[query]
+        ]
+        tagged.sort(key=lambda item: sign * item[1].sort_score)
+        merged.append(tagged[:n_results])
 
-        if not use_ann and score_function == "euclidean":
-            for result in sorted_results:
-                result.sort_score *= -1
+    return merged
 
-        for result in sorted_results:
-            if result.window_id not in scores_by_embedding_id:
-                scores_by_embedding_id[result.window_id] = []
 
-            scores_by_embedding_id[result.window_id].append(result.sort_score)
+def _ann_candidates(
+    db: SQLiteUSearchDB,
+    queries: np.ndarray,
+    n_results: int,
+    score_function: SCORE_FUNCTIONS,
+    window_ids: np.ndarray | None = None,
+) -> np.ndarray | None:
+    """The candidates of an up-to-date ANN index for the queries, if there is one.
+
+    "dot" searches the usearch index of the database if it scores by inner
+    product, "cosine" and "euclidean" the indexes of
+    :mod:`birdnet_analyzer.embeddings.ann`.
+
+    If ``window_ids`` are given, only those are kept of the inverse of their
+    share more candidates. None is returned if that leaves fewer than
+    ``n_results`` for a query.
+    """
+    count = ann.candidate_count(n_results)
+
+    if window_ids is not None:
+        total = db.count_embeddings()
+        count = min(total, int(np.ceil(count * total / max(len(window_ids), 1))))
+
+    if score_function == "dot":
+        if _get_usearch_metric_name(db) != "IP":
+            return None
+
+        candidates = ann.usearch_candidates(
+            db.ui, np.asarray(queries, dtype=np.float32), count
+        )
+    else:
+        index = ann.AnnIndex.load(db, score_function)
 
-    search_results: list[SearchResult] = []
+        if index is None:
+            return None
 
-    for window_id, scores in scores_by_embedding_id.items():
-        search_results.append(
-            SearchResult(
-                window_id=window_id, sort_score=np.sum(scores) / len(query_embeddings)
+        if not index.is_current(db):
+            logger.warning(
+                "The %s ANN index is out of date, searching exhaustively. Run "
+                "birdnet-embeddings again to update it.",
+                score_function,
             )
+            return None
+
+        candidates = index.candidates(queries, count)
+
+    if window_ids is None:
+        return candidates
+
+    kept = np.isin(candidates, window_ids)
+
+    if (kept.sum(axis=1) < n_results).any():
+        return None
+
+    return np.where(kept, candidates, -1)
+
+
+def export_windows(
+    windows: list[tuple[str, float, float, str]],
+    speed=1.0,
+    max_workers: int = EXPORT_MAX_WORKERS,
+):
+    """Saves windows of audio files, e.g. the audio of search results.
+
+    The windows are grouped by file, so each file is opened once and its windows
+    are read with seeks. The files are read and the windows written by a thread
+    pool.
+
+    Args:
+        windows: The source file, offset and duration in seconds, and destination
+            file of each window.
+        speed: Speed factor for audio playback, see audio.open_audio_file.
+        max_workers: The number of threads.
+    """
+    from collections import defaultdict
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    by_file = defaultdict(list)
+
+    for path, offset, duration, dest in windows:
+        by_file[path].append((offset, duration, dest))
+
+    if not by_file:
+        return
+
+    def read(path):
+        return audio.read_windows(
+            path, [(offset, duration) for offset, duration, _ in by_file[path]], speed
         )
 
-    reverse = score_function != "euclidean"
+    with ThreadPoolExecutor(max_workers) as executor:
+        reads = {executor.submit(read, path): path for path in by_file}
+        writes = []
+
+        for future in as_completed(reads):
+            signals, rate = future.result()
 
-    search_results.sort(key=lambda x: x.sort_score, reverse=reverse)
+            for sig, (_, _, dest) in zip(signals, by_file[reads[future]], strict=True):
+                writes.append(executor.submit(audio.save_signal, sig, dest, rate))
 
-    return search_results[0:n_results]
+        for future in writes:
+            future.result()
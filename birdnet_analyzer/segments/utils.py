@@ -5,6 +5,7 @@ Can be used to save the segments of the audio files for each detection.
 
 import logging
 import os
+from collections import deque
 
 import numpy as np
 
@@ -404,6 +405,9 @@ def extract_segments(
     Extracts audio segments from a given audio file based on provided segment
     information.
 
+    The file is streamed once in chunks, so only the segments are held in memory, not
+    the whole recording.
+
     Args:
         file_path (str): Path to the input audio file.
         output_path (str): Directory where the extracted segments will be saved.
@@ -421,41 +425,75 @@ def extract_segments(
     Raises:
         Exception: If there is an error opening the audio file or extracting segments.
     """
+    rate = sample_rate
+    fname = file_path.rsplit(os.sep, 1)[-1].rsplit(".", 1)[0]
+
+    # Sample ranges of the segments, in file order, so the file can be streamed once
+    pending = []
+
+    for seg_cnt, seg in enumerate(segments, 1):
+        start = int((seg["start"] * rate) / audio_speed)
+        end = int((seg["end"] * rate) / audio_speed)
+        offset = max(0, ((seg_length * rate) - (end - start)) // 2)
+        pending.append((int(max(0, start - offset)), int(end + offset), seg_cnt, seg))
+
+    pending = deque(sorted(pending, key=lambda p: p[0]))
+
+    def save(pieces, seg_cnt, seg):
+        seg_sig = np.concatenate(pieces) if pieces else []
+
+        if len(seg_sig) == 0:
+            return
+
+        outpath = os.path.join(output_path, seg["species"])
+        seg_name = "{:.3f}_{}_{}_{:.2f}s_{:.2f}s.wav".format(
+            seg["confidence"], seg_cnt, fname, seg["start"], seg["end"]
+        )
+        seg_path = os.path.join(outpath, seg_name)
+
+        os.makedirs(outpath, exist_ok=True)
+        audio.save_signal(seg_sig, seg_path, rate)
+
+    # Segments that started, with the pieces of their signal read so far
+    active: list[tuple[int, int, int, dict, list]] = []
+    position = 0
+    chunks = audio.iter_chunks(file_path, sample_rate=sample_rate, speed=audio_speed)
+
     try:
-        sig, rate = audio.open_audio_file(file_path, sample_rate, speed=audio_speed)
+        chunk = next(chunks, None)
     except Exception as ex:
         logger.error(f"Error: Cannot open audio file {file_path}", exc_info=ex)
 
         return file_path, False
 
-    for seg_cnt, seg in enumerate(segments, 1):
-        try:
-            start = int((seg["start"] * rate) / audio_speed)
-            end = int((seg["end"] * rate) / audio_speed)
-            offset = max(0, ((seg_length * rate) - (end - start)) // 2)
-            start = max(0, start - offset)
-            end = min(len(sig), end + offset)
-
-            if end > start:
-                seg_sig = sig[int(start) : int(end)]
-                outpath = os.path.join(output_path, seg["species"])
-                seg_name = "{:.3f}_{}_{}_{:.2f}s_{:.2f}s.wav".format(
-                    seg["confidence"],
-                    seg_cnt,
-                    file_path.rsplit(os.sep, 1)[-1].rsplit(".", 1)[0],
-                    seg["start"],
-                    seg["end"],
-                )
-                seg_path = os.path.join(outpath, seg_name)
-
-                os.makedirs(outpath, exist_ok=True)
-                audio.save_signal(seg_sig, seg_path, rate)
-
-        except Exception as ex:
-            logger.error(
-                f"Error: Cannot extract segments from {file_path}.", exc_info=ex
-            )
+    try:
+        while chunk is not None:
+            chunk_end = position + len(chunk)
+
+            while pending and pending[0][0] < chunk_end:
+                active.append((*pending.popleft(), []))
+
+            still_active = []
+
+            for start, end, seg_cnt, seg, pieces in active:
+                pieces.append(chunk[max(0, start - position) : max(0, end - position)])
+
+                if end <= chunk_end:
+                    save(pieces, seg_cnt, seg)
+                else:
+                    still_active.append((start, end, seg_cnt, seg, pieces))
+
+            active = still_active
+            position = chunk_end
+            chunk = next(chunks, None)
+
+        # Segments running past the end of the file are cut off there
+        for _, _, seg_cnt, seg, pieces in active:
+            save(pieces, seg_cnt, seg)
 
-            return file_path, False
+    except Exception as ex:
+        logger.error(f"Error: Cannot extract segments from {file_path}.", exc_info=ex)
+
+        return file_path, False
 
     return file_path, True
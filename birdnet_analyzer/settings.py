@@ -42,6 +42,7 @@ MAX_LOG_SIZE = 5 * 1024 * 1024
 GUI_SETTINGS_PATH = str(APPDIR / "gui-settings.json")
 LANG_DIR = str(Path(SCRIPT_DIR) / "lang")
 STATE_SETTINGS_PATH = str(APPDIR / "state.json")
+AUDIO_INDEX_PATH = str(APPDIR / "audio-index.sqlite")
 TAB_SETTINGS_KEY = "tab-settings"
 
 
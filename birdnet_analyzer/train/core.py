@@ -40,6 +40,7 @@ def train(
     fmin: float = 0.0,
     fmax: float = 15000.0,
     audio_speed: float = 1.0,
+    resampler: str | None = None,
     autotune: bool = False,
     autotune_trials: int = 50,
     autotune_n_repeats: int = 1,
@@ -92,6 +93,8 @@ def train(
         fmax (float, optional): Maximum frequency for bandpass filtering.
                                 Defaults to 15000.0.
         audio_speed (float, optional): Speed factor for audio playback. Defaults to 1.0.
+        resampler (str, optional): Resampler used while decoding the training data,
+            one of audio.RESAMPLERS. Defaults to audio.DEFAULT_RESAMPLER.
         autotune (bool, optional): Whether to use hyperparameter autotuning.
                                    Defaults to False.
         autotune_trials (int, optional): Number of trials for autotuning.
@@ -107,6 +110,7 @@ def train(
     Returns:
         None
     """
+    from birdnet_analyzer import audio
     from birdnet_analyzer.train.utils import train_model
 
     train_model(
@@ -135,6 +139,7 @@ def train(
         fmin=fmin,
         fmax=fmax,
         audio_speed=audio_speed,
+        resampler=resampler or audio.DEFAULT_RESAMPLER,
         autotune=autotune,
         autotune_trials=autotune_trials,
         autotune_n_repeats=autotune_n_repeats,
@@ -94,6 +94,7 @@ def _read_and_crop_file(
     sig_length=3.0,
     overlap=0.0,
     min_len=1.0,
+    resampler=audio.DEFAULT_RESAMPLER,
 ):
     """Decode and crop one audio file into fixed-length signal segments.
 
@@ -116,6 +117,7 @@ def _read_and_crop_file(
         sig_length: Segment length in seconds.
         overlap: Overlap between segments in seconds.
         min_len: Minimum length of a segment in seconds.
+        resampler: The resampler used while decoding, one of audio.RESAMPLERS.
 
     Returns:
         A tuple ``(sig_splits, labels)`` where ``sig_splits`` is a list of float32
@@ -124,14 +126,29 @@ def _read_and_crop_file(
         usable segment (e.g. a signal shorter than ``min_len``).
     """
     try:
-        sig, rate = audio.open_audio_file(
-            f,
-            sample_rate=sample_rate,
-            duration=sig_length if crop_mode == "first" else None,
-            fmin=fmin,
-            fmax=fmax,
-            speed=audio_speed,
-        )
+        if crop_mode == "smart":
+            # Streams long files instead of loading them into memory as a whole.
+            sig_splits, rate = audio.smart_crop_file(
+                f,
+                sample_rate,
+                sig_length,
+                overlap,
+                min_len,
+                fmin=fmin,
+                fmax=fmax,
+                speed=audio_speed,
+                resampler=resampler,
+            )
+        else:
+            sig, rate = audio.open_audio_file(
+                f,
+                sample_rate=sample_rate,
+                duration=sig_length if crop_mode == "first" else None,
+                fmin=fmin,
+                fmax=fmax,
+                speed=audio_speed,
+                resampler=resampler,
+            )
     except Exception as e:
         logger.error(f"\t Error when loading file {f}\n\t {e}", exc_info=e)
         return [], []
@@ -139,12 +156,10 @@ def _read_and_crop_file(
     if crop_mode == "center":
         sig_splits = [audio.crop_center(sig, rate, sig_length)]
     elif crop_mode == "first":
-        # split_signal returns [] for signals shorter than min_len; slicing (not
+        # split_signal returns no splits for signals shorter than min_len; slicing (not
         # indexing [0]) keeps such files fail-soft instead of raising IndexError.
         sig_splits = audio.split_signal(sig, rate, sig_length, overlap, min_len)[:1]
-    elif crop_mode == "smart":
-        sig_splits = audio.smart_crop_signal(sig, rate, sig_length, overlap, min_len)
-    else:
+    elif crop_mode != "smart":  # Smart crops were already cut while streaming
         sig_splits = audio.split_signal(sig, rate, sig_length, overlap, min_len)
 
     sig_splits = [np.asarray(s, dtype="float32") for s in sig_splits]
@@ -191,6 +206,7 @@ def _load_training_data(
     overlap=0.0,
     min_len=1.0,
     threads=1,
+    resampler=audio.DEFAULT_RESAMPLER,
     save_cache_to: str | None = None,
     progress_callback=None,
 ):
@@ -217,6 +233,8 @@ def _load_training_data(
         crop_mode: Mode for cropping audio samples. Defaults to "center".
         overlap: Overlap between audio chunks. Defaults to 0.0.
         min_len: Minimum length of audio chunks. Defaults to 1.0.
+        resampler: The resampler used while decoding. Defaults to
+            audio.DEFAULT_RESAMPLER.
 
     Returns:
         A tuple of (x_train, y_train, x_test, y_test, labels, is_binary, is_multi_label)
@@ -362,6 +380,7 @@ def _load_training_data(
                             crop_mode=crop_mode,
                             overlap=overlap,
                             min_len=min_len,
+                            resampler=resampler,
                         )
                         for f in files
                     ]
@@ -461,6 +480,7 @@ def train_model(
     fmin: float = 0.0,
     fmax: float = 15000.0,
     audio_speed: float = 1.0,
+    resampler: str = audio.DEFAULT_RESAMPLER,
     autotune: bool = False,
     autotune_trials: int = 50,
     autotune_n_splits: int = 1,
@@ -504,6 +524,7 @@ def train_model(
         overlap=overlap,
         min_len=1.0,
         threads=threads,
+        resampler=resampler,
         save_cache_to=save_cache_to,
         progress_callback=on_data_load_end,
     )
@@ -786,6 +807,7 @@ def train_model(
                 "Bandpass filter minimum": fmin,
                 "Bandpass filter maximum": fmax,
                 "Audio speed": audio_speed,
+                "Resampler": resampler,
                 "Crop mode": crop_mode,
                 "Crop overlap": overlap,
                 "Autotune": autotune,
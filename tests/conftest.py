@@ -0,0 +1,17 @@
+import pytest
+
+from birdnet_analyzer import audio_index, settings
+
+
+@pytest.fixture(autouse=True)
+def audio_index_path(tmp_path, monkeypatch):
+    """Keeps the audio metadata index of each test in its temporary directory."""
+    monkeypatch.setattr(
+        settings, "AUDIO_INDEX_PATH", str(tmp_path / "audio-index.sqlite")
+    )
+    audio_index._open_index.cache_clear()
+    yield
+
+    if audio_index._open_index.cache_info().currsize:
+        audio_index._open_index().close()
+        audio_index._open_index.cache_clear()
@@ -0,0 +1,219 @@
+import os
+import timeit
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from birdnet_analyzer.embeddings import ann
+from birdnet_analyzer.embeddings.ann import AnnIndex
+from birdnet_analyzer.embeddings.core import (
+    _ensure_deployment,
+    _update_ann_indexes,
+    get_or_create_database,
+)
+from birdnet_analyzer.search.utils import (
+    batched_brute_search,
+    get_search_results,
+    rank_candidates,
+)
+
+
+def _clustered(rng, n, dim, n_clusters=20):
+    centers = rng.standard_normal((n_clusters, dim)) * 2
+    labels = rng.integers(0, n_clusters, n)
+    return (centers[labels] + rng.standard_normal((n, dim)) * 0.5).astype(np.float16)
+
+
+def _create_database(path, embeddings):
+    db = get_or_create_database(path, embedding_dim=embeddings.shape[1])
+    recording_id = db.insert_recording(
+        filename="a.wav", deployment_id=_ensure_deployment(db)
+    )
+    db.insert_windows_batch(
+        windows_batch=[
+            {"recording_id": recording_id, "offsets": [i * 3.0, i * 3.0 + 3.0]}
+            for i in range(len(embeddings))
+        ],
+        embeddings_batch=embeddings,
+        handle_duplicates="allow",
+    )
+    db.commit()
+    return db
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    db = _create_database(
+        str(tmp_path_factory.mktemp("db") / "db"), _clustered(rng, 5000, 64)
+    )
+    yield db, rng.standard_normal((20, 64)).astype(np.float32)
+    db.db.close()
+
+
+@pytest.mark.parametrize("score_function", ["cosine", "euclidean"])
+def test_ann_recall_against_brute_force(database, score_function):
+    db, queries = database
+    index = AnnIndex.build(db, score_function)
+
+    assert len(index) == 5000
+    assert index.is_current(db)
+
+    candidates = index.candidates(queries, ann.candidate_count(10))
+    ann_ids, ann_scores = rank_candidates(db, queries, candidates, 10, score_function)
+    exact_ids, exact_scores = batched_brute_search(db, queries, 10, score_function)
+
+    recalls = [
+        len(set(a) & set(e)) / 10
+        for a, e in zip(ann_ids.tolist(), exact_ids.tolist(), strict=True)
+    ]
+    assert np.mean(recalls) >= 0.95
+
+    # The candidates are ranked with the exact scores
+    for ids, scores, e_ids, e_scores in zip(
+        ann_ids, ann_scores, exact_ids, exact_scores, strict=True
+    ):
+        exact = dict(zip(e_ids.tolist(), e_scores.tolist(), strict=True))
+        for window_id, score in zip(ids.tolist(), scores.tolist(), strict=True):
+            if window_id in exact:
+                assert score == pytest.approx(exact[window_id], rel=1e-5)
+
+
+def test_ann_index_is_saved_and_updated(tmp_path):
+    rng = np.random.default_rng(1)
+    db = _create_database(str(tmp_path / "db"), _clustered(rng, 200, 16))
+
+    assert AnnIndex.load(db, "cosine") is None
+
+    _update_ann_indexes(db, [])
+    assert AnnIndex.load(db, "cosine") is None
+
+    _update_ann_indexes(db, ["cosine"])
+    index = AnnIndex.load(db, "cosine")
+    assert index.is_current(db)
+    assert AnnIndex.load(db, "euclidean") is None
+
+    db.remove_recording(1)
+    db.db.execute("DELETE FROM windows WHERE recording_id = 1")
+    recording_id = db.insert_recording(filename="b.wav", deployment_id=1)
+    for i in range(3):
+        db.insert_window(
+            recording_id=recording_id,
+            offsets=[i * 3.0, i * 3.0 + 3.0],
+            embedding=np.ones(16, np.float16) * (i + 1),
+        )
+    db.commit()
+    assert not AnnIndex.load(db, "cosine").is_current(db)
+
+    # Existing indexes are updated even if not asked for
+    _update_ann_indexes(db, [])
+
+    index = AnnIndex.load(db, "cosine")
+    assert index.is_current(db)
+    assert sorted(np.asarray(index.index.keys).tolist()) == db.match_window_ids()
+    assert os.path.exists(os.path.join(ann.ann_dir(db), "cosine.usearch"))
+    db.db.close()
+
+
+def test_build_rejects_dot(database):
+    with pytest.raises(ValueError, match="No ANN index for score function 'dot'"):
+        AnnIndex.build(database[0], "dot")
+
+
+@pytest.mark.parametrize("score_function", ["cosine", "euclidean"])
+def test_get_search_results_picks_the_ann_index(tmp_path, score_function):
+    rng = np.random.default_rng(2)
+    db = _create_database(str(tmp_path / "db"), _clustered(rng, 2000, 32))
+    query = rng.standard_normal((2, 32)).astype(np.float32)
+
+    def run(**kwargs):
+        with (
+            patch(
+                "birdnet_analyzer.search.utils.get_query_embedding",
+                return_value=query,
+            ),
+            patch.object(
+                AnnIndex, "candidates", autospec=True, side_effect=AnnIndex.candidates
+            ) as candidates,
+        ):
+            results = get_search_results(
+                "query.wav", db, 10, score_function=score_function, **kwargs
+            )
+
+        return [r.window_id for r in results], candidates.called
+
+    exact_ids, used_ann = run()
+    assert not used_ann
+
+    AnnIndex.build(db, score_function)
+    ann_ids, used_ann = run()
+    assert used_ann
+    assert len(set(ann_ids) & set(exact_ids)) >= 9
+
+    ids, used_ann = run(exact=True)
+    assert not used_ann
+    assert ids == exact_ids
+
+    # A stale index is not used
+    db.insert_window(
+        recording_id=1, offsets=[9999.0, 10002.0], embedding=np.zeros(32, np.float16)
+    )
+    _, used_ann = run()
+    assert not used_ann
+    db.db.close()
+
+
+def test_dot_search_ranks_the_database_index_exactly(tmp_path):
+    rng = np.random.default_rng(3)
+    db = _create_database(str(tmp_path / "db"), _clustered(rng, 1000, 32))
+    query = rng.standard_normal((1, 32)).astype(np.float32)
+
+    with patch("birdnet_analyzer.search.utils.get_query_embedding", return_value=query):
+        results = get_search_results("query.wav", db, 10, score_function="dot")
+        exact = get_search_results(
+            "query.wav", db, 10, score_function="dot", exact=True
+        )
+
+    scores = [r.sort_score for r in results]
+    assert scores == sorted(scores, reverse=True)
+    assert len({r.window_id for r in results} & {r.window_id for r in exact}) >= 9
+    db.db.close()
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+BENCH_ROWS = 20_000
+BENCH_DIM = 1024
+
+
+def test_benchmark_ann_search(tmp_path, capsys):
+    rng = np.random.default_rng(4)
+    db = _create_database(str(tmp_path / "db"), _clustered(rng, BENCH_ROWS, BENCH_DIM))
+    AnnIndex.build(db, "cosine")
+    query = rng.standard_normal((1, BENCH_DIM)).astype(np.float32)
+
+    def run(exact):
+        with patch(
+            "birdnet_analyzer.search.utils.get_query_embedding", return_value=query
+        ):
+            return get_search_results("query.wav", db, 10, exact=exact)
+
+    t_new = min(timeit.repeat(lambda: run(False), number=3, repeat=3)) / 3
+    t_ref = min(timeit.repeat(lambda: run(True), number=1, repeat=3))
+    recall = len({r.window_id for r in run(False)} & {r.window_id for r in run(True)})
+
+    with capsys.disabled():
+        print(
+            f"\nann search ({BENCH_ROWS}x{BENCH_DIM}, cosine): "
+            f"new={t_new * 1000:.2f}ms  ref={t_ref * 1000:.2f}ms  "
+            f"speedup={t_ref / t_new:.1f}x  recall@10={recall / 10:.1f}"
+        )
+
+    db.db.close()
+    assert t_new < t_ref, (
+        f"ANN search ({t_new * 1000:.2f}ms) should be faster than the exact "
+        f"search ({t_ref * 1000:.2f}ms)"
+    )
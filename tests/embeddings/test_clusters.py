@@ -0,0 +1,293 @@
+import csv
+import sys
+import timeit
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from birdnet_analyzer.cli import cluster_parser
+from birdnet_analyzer.embeddings import clusters
+from birdnet_analyzer.embeddings.ann import AnnIndex
+from birdnet_analyzer.embeddings.core import _ensure_deployment, get_or_create_database
+from birdnet_analyzer.embeddings.export import export_embeddings
+from birdnet_analyzer.search.utils import search_query_embeddings
+
+
+def _duplicates(rng, n_groups, copies, dim, noise=0.05):
+    """Shuffled embeddings of groups of near-duplicates and their groups."""
+    groups = np.repeat(np.arange(n_groups), copies)
+    rng.shuffle(groups)
+    centers = rng.standard_normal((n_groups, dim))
+    embeddings = centers[groups] + rng.standard_normal((len(groups), dim)) * noise
+    return embeddings.astype(np.float16), groups
+
+
+def _insert(db, embeddings):
+    recording_id = db.insert_recording(
+        filename=f"{db.count_embeddings()}.wav", deployment_id=_ensure_deployment(db)
+    )
+    db.insert_windows_batch(
+        windows_batch=[
+            {"recording_id": recording_id, "offsets": [i * 3.0, i * 3.0 + 3.0]}
+            for i in range(len(embeddings))
+        ],
+        embeddings_batch=embeddings,
+        handle_duplicates="allow",
+    )
+    db.commit()
+
+
+def _create_database(path, embeddings):
+    db = get_or_create_database(path, embedding_dim=embeddings.shape[1])
+    _insert(db, embeddings)
+    return db
+
+
+def _read_clusters(db):
+    return dict(
+        db.db.execute(f"SELECT window_id, cluster_id FROM {clusters.CLUSTERS_TABLE}")
+    )
+
+
+def _leader_clusters_ref(db, threshold):
+    """Leader clustering one window at a time, in window id order."""
+    window_ids = np.array(sorted(db.match_window_ids()), dtype=np.int64)
+    vectors = np.asarray(db.get_embeddings_batch(window_ids), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    leaders, assigned = [], {}
+
+    for window_id, vector in zip(window_ids.tolist(), vectors, strict=True):
+        scores = vectors[leaders] @ vector if leaders else np.empty(0)
+
+        if len(scores) and scores.max() >= threshold:
+            assigned[window_id] = int(window_ids[leaders[int(np.argmax(scores))]])
+        else:
+            leaders.append(len(assigned))
+            assigned[window_id] = window_id
+
+    return assigned
+
+
+@pytest.fixture
+def duplicates(tmp_path):
+    embeddings, groups = _duplicates(np.random.default_rng(0), 60, 8, 32)
+    db = _create_database(str(tmp_path / "db"), embeddings)
+    yield db, groups
+    db.db.close()
+
+
+def test_clusters_group_near_duplicates(duplicates):
+    db, groups = duplicates
+
+    assert clusters.update_clusters(db, 0.9) == len(groups)
+
+    assigned = _read_clusters(db)
+    window_ids = sorted(assigned)
+    cluster_of_group = {}
+
+    for window_id, group in zip(window_ids, groups.tolist(), strict=True):
+        assert (
+            cluster_of_group.setdefault(group, assigned[window_id])
+            == (assigned[window_id])
+        )
+
+    assert len(set(cluster_of_group.values())) == 60
+    # The representatives are the first windows of their group, in their cluster
+    assert all(assigned[c] == c for c in cluster_of_group.values())
+    similarities = [
+        row[0] for row in db.db.execute("SELECT similarity FROM birdnet_clusters")
+    ]
+    assert min(similarities) >= 0.9
+
+
+@pytest.mark.parametrize("block_size", [7, 64, 2048])
+def test_blockwise_clustering_matches_one_window_at_a_time(tmp_path, block_size):
+    # Loose groups, so that windows are close to several representatives
+    embeddings, _ = _duplicates(np.random.default_rng(1), 40, 10, 16, noise=0.4)
+    db = _create_database(str(tmp_path / "db"), embeddings)
+
+    clusters.update_clusters(db, 0.9, block_size=block_size)
+
+    assert _read_clusters(db) == _leader_clusters_ref(db, 0.9)
+    db.db.close()
+
+
+def test_new_windows_are_clustered_incrementally(tmp_path):
+    embeddings, _ = _duplicates(np.random.default_rng(2), 40, 10, 16, noise=0.4)
+    db = _create_database(str(tmp_path / "db"), embeddings[:150])
+
+    assert clusters.update_clusters(db, 0.9, block_size=64) == 150
+    first = _read_clusters(db)
+
+    _insert(db, embeddings[150:])
+    assert clusters.update_clusters(db, 0.9, block_size=64) == 250
+
+    assigned = _read_clusters(db)
+    assert {w: assigned[w] for w in first} == first
+    assert assigned == _leader_clusters_ref(db, 0.9)
+    assert clusters.update_clusters(db, 0.9) == 0
+    db.db.close()
+
+
+def test_removed_representatives_and_threshold_changes_recluster(duplicates):
+    db, groups = duplicates
+    clusters.update_clusters(db, 0.9)
+    representative = next(c for w, c in _read_clusters(db).items() if w != c)
+
+    db.db.execute("DELETE FROM windows WHERE id = ?", (representative,))
+    db.commit()
+
+    # The other 7 windows of its group are clustered again, among themselves
+    assert clusters.update_clusters(db, 0.9) == 7
+    assigned = _read_clusters(db)
+    assert representative not in assigned
+    assert representative not in assigned.values()
+    assert len(set(assigned.values())) == 60
+
+    # Nothing is similar enough to anything else
+    assert clusters.update_clusters(db, 1.01) == len(groups) - 1
+    assert len(set(_read_clusters(db).values())) == len(groups) - 1
+
+
+def test_ann_index_finds_the_representatives(tmp_path):
+    embeddings, _ = _duplicates(np.random.default_rng(3), 200, 10, 32)
+    db = _create_database(str(tmp_path / "db"), embeddings)
+    AnnIndex.build(db, "cosine")
+
+    with patch.object(
+        AnnIndex, "candidates", autospec=True, side_effect=AnnIndex.candidates
+    ) as candidates:
+        clusters.update_clusters(db, 0.9, block_size=256)
+
+    assert candidates.call_count == 8
+    assert _read_clusters(db) == _leader_clusters_ref(db, 0.9)
+    db.db.close()
+
+
+def test_ann_index_clusters_groups_larger_than_the_neighbours(tmp_path):
+    # The neighbours of a window are all members of its group, not its leader
+    copies = clusters.ANN_NEIGHBOURS * 6
+    embeddings, _ = _duplicates(np.random.default_rng(5), 20, copies, 32)
+    db = _create_database(str(tmp_path / "db"), embeddings)
+    AnnIndex.build(db, "cosine")
+
+    clusters.update_clusters(db, 0.9, block_size=256)
+
+    assigned = _read_clusters(db)
+    assert len(set(assigned.values())) == 20
+    assert assigned == _leader_clusters_ref(db, 0.9)
+    db.db.close()
+
+
+def test_search_collapses_results_per_cluster(duplicates):
+    db, _ = duplicates
+    clusters.update_clusters(db, 0.9)
+    assigned = _read_clusters(db)
+    query = [np.asarray(db.get_embeddings_batch([1]), dtype=np.float32)]
+
+    everything = search_query_embeddings(db, query, 8)[0]
+    collapsed = search_query_embeddings(db, query, 8, collapse_duplicates=True)[0]
+
+    # The 7 other copies of the query fill the plain results
+    assert len({assigned[r.window_id] for r in everything}) == 1
+    assert len(collapsed) == 8
+    assert len({assigned[r.window_id] for r in collapsed}) == 8
+    assert collapsed[0].window_id == everything[0].window_id
+    scores = [r.sort_score for r in collapsed]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_search_without_clusters_is_not_collapsed(duplicates):
+    db, _ = duplicates
+    query = [np.asarray(db.get_embeddings_batch([1]), dtype=np.float32)]
+
+    assert [
+        r.window_id
+        for r in search_query_embeddings(db, query, 5, collapse_duplicates=True)[0]
+    ] == [r.window_id for r in search_query_embeddings(db, query, 5)[0]]
+
+
+def test_export_of_representatives(duplicates, tmp_path):
+    db, _ = duplicates
+    clusters.update_clusters(db, 0.9)
+    representatives = sorted(set(_read_clusters(db).values()))
+    output = str(tmp_path / "representatives.csv")
+
+    assert export_embeddings(db.db_path, output, representatives_only=True) == 60
+
+    with open(output, encoding="utf-8") as f:
+        rows = list(csv.reader(f))[1:]
+
+    # The windows of the one recording start every 3 s from id 1
+    assert [float(row[1]) for row in rows] == [(w - 1) * 3.0 for w in representatives]
+
+
+def test_cluster_cli(duplicates, tmp_path):
+    db, _ = duplicates
+    database = str(db.db_path)
+    output = str(tmp_path / "out")
+    args = cluster_parser().parse_args(
+        ["-db", database, "--threshold", "0.8", "--file_output", output]
+    )
+
+    assert vars(args) == {
+        "database": database,
+        "threshold": 0.8,
+        "file_output": output,
+        "file_output_format": None,
+    }
+
+    with (
+        patch.object(sys, "argv", ["birdnet-embeddings", "cluster", "-db", database]),
+        patch("birdnet_analyzer.embeddings.clusters.cluster") as cluster,
+    ):
+        from birdnet_analyzer.embeddings.cli import main
+
+        main()
+
+    cluster.assert_called_once_with(
+        database=database, threshold=0.95, file_output=None, file_output_format=None
+    )
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+BENCH_GROUPS = 1000
+BENCH_COPIES = 8
+BENCH_DIM = 256
+
+
+def test_benchmark_clustering(tmp_path, capsys):
+    embeddings, _ = _duplicates(
+        np.random.default_rng(4), BENCH_GROUPS, BENCH_COPIES, BENCH_DIM
+    )
+    db = _create_database(str(tmp_path / "db"), embeddings)
+
+    def run():
+        clusters.update_clusters(db, 0.9)
+        assigned = _read_clusters(db)
+        db.db.execute(f"DELETE FROM {clusters.CLUSTERS_TABLE}")
+        return assigned
+
+    def run_ref():
+        return _leader_clusters_ref(db, 0.9)
+
+    assert run() == run_ref()
+    t_new = min(timeit.repeat(run, number=1, repeat=3))
+    t_ref = min(timeit.repeat(run_ref, number=1, repeat=3))
+
+    with capsys.disabled():
+        print(
+            f"\nclustering ({len(embeddings)}x{BENCH_DIM}, {BENCH_GROUPS} clusters): "
+            f"new={t_new * 1000:.2f}ms  ref={t_ref * 1000:.2f}ms  "
+            f"speedup={t_ref / t_new:.1f}x"
+        )
+
+    db.db.close()
+    assert t_new < t_ref, (
+        f"Blockwise clustering ({t_new * 1000:.2f}ms) should be faster than "
+        f"clustering one window at a time ({t_ref * 1000:.2f}ms)"
+    )
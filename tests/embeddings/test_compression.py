@@ -0,0 +1,236 @@
+import os
+import timeit
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from birdnet_analyzer.embeddings import compression
+from birdnet_analyzer.embeddings.compression import CompressedEmbeddings
+from birdnet_analyzer.embeddings.core import _ensure_deployment, get_or_create_database
+from birdnet_analyzer.search.utils import cosine_sim, euclidean_scoring_inverse
+
+SCORE_FNS = {
+    "cosine": cosine_sim,
+    "dot": np.dot,
+    "euclidean": euclidean_scoring_inverse,
+}
+
+
+def _clustered(rng, n, dim, n_clusters=20):
+    centers = rng.standard_normal((n_clusters, dim)) * 2
+    labels = rng.integers(0, n_clusters, n)
+    return (centers[labels] + rng.standard_normal((n, dim)) * 0.5).astype(np.float16)
+
+
+def _create_database(path, embeddings):
+    db = get_or_create_database(path, embedding_dim=embeddings.shape[1])
+    recording_id = db.insert_recording(
+        filename="a.wav", deployment_id=_ensure_deployment(db)
+    )
+    db.insert_windows_batch(
+        windows_batch=[
+            {"recording_id": recording_id, "offsets": [i * 3.0, i * 3.0 + 3.0]}
+            for i in range(len(embeddings))
+        ],
+        embeddings_batch=embeddings,
+        handle_duplicates="allow",
+    )
+    db.commit()
+    return db
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    embeddings = _clustered(rng, 3000, 64)
+    db = _create_database(str(tmp_path_factory.mktemp("db") / "db"), embeddings)
+    yield db, embeddings.astype(np.float32), rng.standard_normal((5, 64))
+    db.db.close()
+
+
+def _exact_top(embeddings, query, score_function, n):
+    scores = SCORE_FNS[score_function](embeddings, query)
+    return list(np.argsort(-scores, kind="stable")[:n] + 1)
+
+
+@pytest.mark.parametrize("score_function", ["cosine", "dot", "euclidean"])
+@pytest.mark.parametrize(
+    ("mode", "pca_dim"), [("float16", None), ("int8", None), ("int8", 32)]
+)
+def test_compressed_search_matches_exact_search(
+    database, mode, pca_dim, score_function
+):
+    db, embeddings, queries = database
+    compressed = CompressedEmbeddings.build(db, mode, pca_dim)
+
+    assert compressed.codes.dtype == (np.float16 if mode == "float16" else np.int8)
+    assert compressed.codes.shape == (len(embeddings), pca_dim or 64)
+    assert isinstance(compressed.codes, np.memmap)
+
+    for query in queries:
+        results = compression.search(
+            db, compressed, query, 10, score_function, SCORE_FNS[score_function]
+        )
+        exact = SCORE_FNS[score_function](embeddings, query)
+
+        expected = _exact_top(embeddings, query, score_function, 10)
+
+        if pca_dim is None:
+            assert [r.window_id for r in results] == expected
+        else:
+            # The projection drops the weakest components, the noise here
+            assert len({r.window_id for r in results} & set(expected)) >= 8
+        np.testing.assert_allclose(
+            [r.sort_score for r in results],
+            exact[[r.window_id - 1 for r in results]],
+            rtol=1e-5,
+        )
+
+
+def test_int8_scores_approximate_the_exact_scores(database):
+    db, embeddings, queries = database
+    compressed = CompressedEmbeddings.build(db, "int8")
+
+    for score_function in SCORE_FNS:
+        approx = compressed.scores(queries[0], score_function)
+        exact = SCORE_FNS[score_function](embeddings, queries[0])
+        assert np.corrcoef(approx, exact)[0, 1] > 0.999
+
+
+def test_compressed_embeddings_track_the_database(tmp_path):
+    rng = np.random.default_rng(1)
+    db = _create_database(str(tmp_path / "db"), _clustered(rng, 50, 16))
+
+    assert CompressedEmbeddings.load(db) is None
+
+    CompressedEmbeddings.build(db, "float16")
+    assert CompressedEmbeddings.load(db).is_current(db)
+
+    db.insert_window(
+        recording_id=1, offsets=[999.0, 1002.0], embedding=np.zeros(16, np.float16)
+    )
+    assert not CompressedEmbeddings.load(db).is_current(db)
+
+    # An interrupted rebuild leaves no readable copy behind
+    with (
+        patch(
+            "birdnet_analyzer.embeddings.export.iter_window_batches",
+            side_effect=OSError("disk full"),
+        ),
+        pytest.raises(OSError, match="disk full"),
+    ):
+        CompressedEmbeddings.build(db, "int8")
+    assert CompressedEmbeddings.load(db) is None
+    db.db.close()
+
+
+def test_build_rejects_invalid_settings(database):
+    db = database[0]
+
+    with pytest.raises(ValueError, match="Unknown compression mode"):
+        CompressedEmbeddings.build(db, "int4")
+    with pytest.raises(ValueError, match="pca_dim"):
+        CompressedEmbeddings.build(db, "int8", pca_dim=65)
+
+
+@pytest.mark.parametrize("score_function", ["cosine", "euclidean"])
+def test_get_search_results_uses_current_compressed_embeddings(
+    tmp_path, score_function
+):
+    from birdnet_analyzer.search.utils import get_search_results
+
+    rng = np.random.default_rng(2)
+    embeddings = _clustered(rng, 500, 32)
+    db = _create_database(str(tmp_path / "db"), embeddings)
+    query = rng.standard_normal((1, 32)).astype(np.float32)
+
+    def run():
+        with patch(
+            "birdnet_analyzer.search.utils.get_query_embedding", return_value=query
+        ):
+            results = get_search_results(
+                "query.wav", db, 5, score_function=score_function
+            )
+        return [int(r.window_id) for r in results], [r.sort_score for r in results]
+
+    exact_ids, exact_scores = run()
+    CompressedEmbeddings.build(db, "int8")
+
+    with patch.object(
+        compression, "search", wraps=compression.search
+    ) as compressed_search:
+        ids, scores = run()
+    assert compressed_search.called
+    assert ids == exact_ids
+    # The brute-force search scores the float16 vectors in float16
+    np.testing.assert_allclose(scores, exact_scores, rtol=1e-2)
+    db.db.close()
+
+
+def test_embeddings_keeps_the_compressed_copy_up_to_date(tmp_path):
+    from birdnet_analyzer.embeddings.core import _update_compressed_embeddings
+
+    rng = np.random.default_rng(3)
+    db = _create_database(str(tmp_path / "db"), _clustered(rng, 50, 16))
+
+    _update_compressed_embeddings(db, None, None)
+    assert CompressedEmbeddings.load(db) is None
+
+    _update_compressed_embeddings(db, "int8", 8)
+    db.insert_window(
+        recording_id=1, offsets=[999.0, 1002.0], embedding=np.zeros(16, np.float16)
+    )
+    _update_compressed_embeddings(db, None, None)
+
+    compressed = CompressedEmbeddings.load(db)
+    assert (compressed.mode, compressed.pca_dim) == ("int8", 8)
+    assert compressed.is_current(db)
+    assert os.path.isdir(compression.compressed_dir(db))
+    db.db.close()
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+BENCH_ROWS = 20_000
+BENCH_DIM = 1024
+
+
+def test_benchmark_compressed_scan(tmp_path, capsys):
+    """Scanning int8 codes against the float32 matrix the brute-force search uses."""
+    rng = np.random.default_rng(4)
+    embeddings = _clustered(rng, BENCH_ROWS, BENCH_DIM)
+    data = embeddings.astype(np.float32)
+    scale = np.ones(BENCH_DIM, dtype=np.float32)
+    compressed = CompressedEmbeddings(
+        codes=np.clip(np.rint(data * 10), -128, 127).astype(np.int8),
+        window_ids=np.arange(BENCH_ROWS),
+        norms=np.linalg.norm(data, axis=1),
+        scale=scale / 10,
+        offset=np.zeros(BENCH_DIM, dtype=np.float32),
+        mean=None,
+        components=None,
+        mode="int8",
+        max_window_id=BENCH_ROWS,
+    )
+    query = rng.standard_normal(BENCH_DIM).astype(np.float32)
+
+    t_new = min(
+        timeit.repeat(lambda: compressed.scores(query, "cosine"), number=3, repeat=3)
+    )
+    t_ref = min(timeit.repeat(lambda: cosine_sim(data, query), number=3, repeat=3))
+
+    with capsys.disabled():
+        print(
+            f"\ncompressed scan ({BENCH_ROWS}x{BENCH_DIM}, int8): "
+            f"new={t_new / 3 * 1000:.2f}ms  ref={t_ref / 3 * 1000:.2f}ms  "
+            f"memory={compressed.codes.nbytes / data.nbytes:.2f}x"
+        )
+
+    assert compressed.codes.nbytes * 4 == data.nbytes
+    assert t_new < t_ref, (
+        f"Scanning int8 codes ({t_new / 3 * 1000:.2f}ms) should be faster than "
+        f"scanning float32 embeddings ({t_ref / 3 * 1000:.2f}ms)"
+    )
@@ -1,6 +1,7 @@
 import os
 import pathlib
 import shutil
+import sqlite3
 import tempfile
 from unittest.mock import MagicMock, patch
 
@@ -11,18 +12,30 @@ from birdnet_analyzer.cli import embeddings_parser
 from birdnet_analyzer.embeddings.core import embeddings
 
 
-def _make_empty_encoding_result():
-    """Create a mock AcousticFileEncodingResult with zero inputs."""
-    mock_result = MagicMock()
-    mock_result.segment_duration_s = 3.0
-    mock_result.overlap_duration_s = 0.0
-    mock_result.n_inputs = 0
-    mock_result.max_n_segments = 0
-    mock_result.embeddings = np.zeros((0, 0, 1024), dtype=np.float32)
-    mock_result.embeddings_masked = np.zeros((0, 0, 1024), dtype=bool)
-    mock_result.inputs = np.array([], dtype="<U1")
-    mock_result.input_durations = np.array([])
-    return mock_result
+def _split_encoding_result(result):
+    """Splits a multi-file encoding result into the per-file results of a session."""
+    for i in range(result.n_inputs):
+        file_result = MagicMock()
+        file_result.segment_duration_s = result.segment_duration_s
+        file_result.overlap_duration_s = result.overlap_duration_s
+        file_result.n_inputs = 1
+        file_result.max_n_segments = result.max_n_segments
+        file_result.embeddings = result.embeddings[i : i + 1]
+        file_result.embeddings_masked = result.embeddings_masked[i : i + 1]
+        file_result.inputs = result.inputs[i : i + 1]
+        file_result.input_durations = result.input_durations[i : i + 1]
+        yield file_result
+
+
+def _fake_encode_files(result):
+    """A stand-in for model_utils.encode_files that streams ``result`` file by file."""
+
+    def encode_files(files, on_file_complete, **kwargs):
+        for file_result in _split_encoding_result(result):
+            if str(file_result.inputs[0]) in files:
+                on_file_complete(file_result)
+
+    return encode_files
 
 
 @pytest.fixture
@@ -43,20 +56,21 @@ def setup_test_environment():
     shutil.rmtree(test_dir)
 
 
-@patch("birdnet_analyzer.embeddings.core.create_csv_output")
+@patch("birdnet_analyzer.embeddings.export.export_embeddings")
 @patch("birdnet_analyzer.embeddings.core._check_database_settings")
 @patch("birdnet_analyzer.embeddings.core.get_or_create_database")
-@patch("birdnet_analyzer.model_utils.get_embeddings")
+@patch("birdnet_analyzer.model_utils.list_audio_inputs", return_value=[])
+@patch("birdnet_analyzer.model_utils.encode_files")
 def test_embeddings_cli(
-    mock_get_embeddings: MagicMock,
+    mock_encode_files: MagicMock,
+    mock_list_inputs: MagicMock,
     mock_get_db: MagicMock,
     mock_check_settings: MagicMock,
-    mock_csv_output: MagicMock,
+    mock_export: MagicMock,
     setup_test_environment,
 ):
     env = setup_test_environment
 
-    mock_get_embeddings.return_value = _make_empty_encoding_result()
     mock_db = MagicMock()
     mock_get_db.return_value = mock_db
 
@@ -65,26 +79,30 @@ def test_embeddings_cli(
 
     embeddings(**vars(args))
 
-    mock_get_embeddings.assert_called_once()
-    call_kwargs = mock_get_embeddings.call_args
-    assert call_kwargs[0][0] == env["input_dir"]
+    mock_list_inputs.assert_called_once_with(env["input_dir"])
+    mock_encode_files.assert_called_once()
+    call_kwargs = mock_encode_files.call_args
+    assert call_kwargs[0][0] == []
     assert call_kwargs[1]["version"] == "2.4"
 
 
-@patch("birdnet_analyzer.embeddings.core.create_csv_output")
+@patch("birdnet_analyzer.embeddings.core._update_ann_indexes")
+@patch("birdnet_analyzer.embeddings.export.export_embeddings")
 @patch("birdnet_analyzer.embeddings.core._check_database_settings")
 @patch("birdnet_analyzer.embeddings.core.get_or_create_database")
-@patch("birdnet_analyzer.model_utils.get_embeddings")
+@patch("birdnet_analyzer.model_utils.list_audio_inputs", return_value=[])
+@patch("birdnet_analyzer.model_utils.encode_files")
 def test_embeddings_cli_accepts_full_parser_surface(
-    mock_get_embeddings: MagicMock,
+    mock_encode_files: MagicMock,
+    mock_list_inputs: MagicMock,
     mock_get_db: MagicMock,
     mock_check_settings: MagicMock,
-    mock_csv_output: MagicMock,
+    mock_export: MagicMock,
+    mock_update_ann_indexes: MagicMock,
     setup_test_environment,
 ):
     env = setup_test_environment
 
-    mock_get_embeddings.return_value = _make_empty_encoding_result()
     mock_db = MagicMock()
     mock_get_db.return_value = mock_db
 
@@ -112,13 +130,21 @@ def test_embeddings_cli_accepts_full_parser_surface(
             "3",
             "--file_output",
             file_output,
+            "--birdnet",
+            "3.0",
+            "--ann_indexes",
+            "cosine",
+            "euclidean",
         ]
     )
 
     embeddings(**vars(args))
 
-    mock_get_embeddings.assert_called_once()
-    call_kwargs = mock_get_embeddings.call_args.kwargs
+    mock_get_db.assert_called_once_with(env["output_dir"], embedding_dim=1280)
+    assert mock_check_settings.call_args.kwargs["version"] == "3.0"
+
+    mock_encode_files.assert_called_once()
+    call_kwargs = mock_encode_files.call_args.kwargs
     assert call_kwargs["batch_size"] == 4
     assert call_kwargs["overlap_duration_s"] == 0.5
     assert call_kwargs["bandpass_fmin"] == 100
@@ -126,26 +152,31 @@ def test_embeddings_cli_accepts_full_parser_surface(
     assert call_kwargs["speed"] == 1.1
     assert call_kwargs["n_workers"] == 2
     assert call_kwargs["n_producers"] == 3
-    assert mock_csv_output.called
+    assert call_kwargs["version"] == "3.0"
+    mock_update_ann_indexes.assert_called_once_with(mock_db, ["cosine", "euclidean"])
+    mock_export.assert_called_once_with(env["output_dir"], file_output, None)
 
 
-@patch("birdnet_analyzer.embeddings.core._ensure_recording")
+@patch("birdnet_analyzer.embeddings.core._RecordingIndex")
 @patch("birdnet_analyzer.embeddings.core._ensure_deployment")
 @patch("birdnet_analyzer.embeddings.core._check_database_settings")
 @patch("birdnet_analyzer.embeddings.core.get_or_create_database")
-@patch("birdnet_analyzer.model_utils.get_embeddings")
+@patch("birdnet_analyzer.model_utils.list_audio_inputs")
+@patch("birdnet_analyzer.model_utils.encode_files")
 def test_embeddings_inserts_windows_per_file_in_batch(
-    mock_get_embeddings: MagicMock,
+    mock_encode_files: MagicMock,
+    mock_list_inputs: MagicMock,
     mock_get_db: MagicMock,
     mock_check_settings: MagicMock,
     mock_ensure_deployment: MagicMock,
-    mock_ensure_recording: MagicMock,
+    mock_recording_index: MagicMock,
 ):
     # Use a real temp directory so paths are valid on all platforms
     tmpdir = tempfile.mkdtemp()
     try:
         audio_input = tmpdir
         example_wav = os.path.join(tmpdir, "example.wav")
+        pathlib.Path(example_wav).write_bytes(b"RIFF")
 
         mock_result = MagicMock()
         mock_result.segment_duration_s = 3.0
@@ -158,12 +189,13 @@ def test_embeddings_inserts_windows_per_file_in_batch(
         mock_result.embeddings_masked = np.zeros((1, 3, 1), dtype=bool)
         mock_result.inputs = np.array([example_wav])
         mock_result.input_durations = np.array([5.0])
-        mock_get_embeddings.return_value = mock_result
+        mock_list_inputs.return_value = [example_wav]
+        mock_encode_files.side_effect = _fake_encode_files(mock_result)
 
         mock_db = MagicMock()
         mock_get_db.return_value = mock_db
         mock_ensure_deployment.return_value = 10
-        mock_ensure_recording.return_value = 20
+        mock_recording_index.return_value.ensure.return_value = [20]
 
         embeddings(
             audio_input=audio_input, database=os.path.join(tmpdir, "test.sqlite")
@@ -174,7 +206,10 @@ def test_embeddings_inserts_windows_per_file_in_batch(
         audio_root = str(pathlib.Path(audio_input).parent)
         expected_fpath = str(pathlib.Path(example_wav).relative_to(audio_root))
 
-        mock_ensure_recording.assert_called_once_with(mock_db, expected_fpath, 10)
+        mock_recording_index.assert_called_once_with(mock_db, 10)
+        mock_recording_index.return_value.ensure.assert_called_once_with(
+            [expected_fpath]
+        )
         mock_db.insert_windows_batch.assert_called_once()
 
         call_kwargs = mock_db.insert_windows_batch.call_args.kwargs
@@ -192,6 +227,437 @@ def test_embeddings_inserts_windows_per_file_in_batch(
         np.testing.assert_array_equal(
             embeddings_batch[1], np.array([5, 6, 7, 8], dtype=np.float32)
         )
-        assert call_kwargs["handle_duplicates"] == "skip"
+        assert call_kwargs["handle_duplicates"] == "allow"
     finally:
         shutil.rmtree(tmpdir)
+
+
+def _make_encoding_result(inputs, durations, n_segments, dim=1024, masked=None):
+    """A synthetic encoding result with 3 s segments and random embeddings."""
+    rng = np.random.default_rng(0)
+    result = MagicMock()
+    result.segment_duration_s = 3.0
+    result.overlap_duration_s = 0.0
+    result.n_inputs = len(inputs)
+    result.max_n_segments = n_segments
+    result.embeddings = rng.standard_normal(
+        (len(inputs), n_segments, dim), dtype=np.float32
+    )
+    result.embeddings_masked = (
+        masked
+        if masked is not None
+        else np.zeros((len(inputs), n_segments, 1), dtype=bool)
+    )
+    result.inputs = np.array(inputs)
+    result.input_durations = np.array(durations)
+    return result
+
+
+def _read_windows(database):
+    from birdnet_analyzer.search.core import get_database
+
+    db = get_database(database)
+    windows = {}
+    for window_id in db.match_window_ids():
+        window = db.get_window(window_id)
+        filename = db.get_recording(window.recording_id).filename
+        windows.setdefault(filename, []).append(list(window.offsets))
+    n_embeddings = db.count_embeddings()
+    db.db.close()
+
+    assert n_embeddings == sum(len(w) for w in windows.values())
+    return {filename: sorted(w) for filename, w in windows.items()}
+
+
+@pytest.fixture
+def two_file_input(tmp_path):
+    """Two audio files and the encoder output for them, 12 s and 7.5 s long."""
+    audio_input = tmp_path / "audio"
+    audio_input.mkdir()
+    inputs = [str(audio_input / "a.wav"), str(audio_input / "b.wav")]
+    for path in inputs:
+        pathlib.Path(path).write_bytes(b"RIFF")
+    masked = np.zeros((2, 4, 1), dtype=bool)
+    masked[0, 1] = True  # A masked segment in the middle of a file
+    masked[1, 3] = True
+
+    with (
+        patch("birdnet_analyzer.model_utils.list_audio_inputs", return_value=inputs),
+        patch("birdnet_analyzer.model_utils.encode_files") as mock_encode_files,
+    ):
+        mock_encode_files.side_effect = _fake_encode_files(
+            _make_encoding_result(inputs, [12.0, 7.5], 4, masked=masked)
+        )
+        yield str(audio_input), inputs, mock_encode_files
+
+
+EXPECTED_WINDOWS = {
+    os.path.join("audio", "a.wav"): [[0.0, 3.0], [6.0, 9.0], [9.0, 12.0]],
+    os.path.join("audio", "b.wav"): [[0.0, 3.0], [3.0, 6.0], [6.0, 7.5]],
+}
+
+
+def test_embeddings_rerun_skips_existing_windows(two_file_input, tmp_path):
+    audio_input, inputs, mock_encode_files = two_file_input
+    database = str(tmp_path / "db")
+
+    embeddings(audio_input, database)
+    # Recordings without a stored file state, as written by older versions, are
+    # encoded again; their existing windows must not be duplicated.
+    with sqlite3.connect(os.path.join(database, "hoplite.sqlite")) as conn:
+        conn.execute("UPDATE recordings SET file_size = NULL")
+    embeddings(audio_input, database)
+
+    assert mock_encode_files.call_args.args[0] == inputs
+    assert _read_windows(database) == EXPECTED_WINDOWS
+
+
+def test_embeddings_skips_finished_files_and_reencodes_changed_ones(
+    two_file_input, tmp_path
+):
+    audio_input, inputs, mock_encode_files = two_file_input
+    database = str(tmp_path / "db")
+
+    embeddings(audio_input, database)
+    embeddings(audio_input, database)
+
+    assert mock_encode_files.call_args.args[0] == []
+    assert _read_windows(database) == EXPECTED_WINDOWS
+
+    pathlib.Path(inputs[1]).write_bytes(b"RIFF, edited")
+    embeddings(audio_input, database)
+
+    assert mock_encode_files.call_args.args[0] == [inputs[1]]
+    assert _read_windows(database) == EXPECTED_WINDOWS
+
+    # The windows of another overlap replace those of the previous run
+    result = _make_encoding_result(inputs, [12.0, 7.5], 4)
+    result.overlap_duration_s = 1.0
+    mock_encode_files.side_effect = _fake_encode_files(result)
+    embeddings(audio_input, database, overlap=1.0)
+
+    assert mock_encode_files.call_args.args[0] == inputs
+    assert _read_windows(database) == {
+        os.path.join("audio", "a.wav"): [
+            [0.0, 3.0],
+            [2.0, 5.0],
+            [4.0, 7.0],
+            [6.0, 9.0],
+        ],
+        os.path.join("audio", "b.wav"): [
+            [0.0, 3.0],
+            [2.0, 5.0],
+            [4.0, 7.0],
+            [6.0, 7.5],
+        ],
+    }
+
+
+def test_embeddings_resumes_after_the_last_committed_file(two_file_input, tmp_path):
+    audio_input, inputs, mock_encode_files = two_file_input
+    database = str(tmp_path / "db")
+    encode = mock_encode_files.side_effect
+
+    def interrupted(files, on_file_complete, **kwargs):
+        encode(files[:1], on_file_complete)
+        raise KeyboardInterrupt
+
+    mock_encode_files.side_effect = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        embeddings(audio_input, database)
+
+    mock_encode_files.side_effect = encode
+    embeddings(audio_input, database)
+
+    assert mock_encode_files.call_args.args[0] == inputs[1:]
+    assert _read_windows(database) == EXPECTED_WINDOWS
+
+
+def test_embeddings_stores_the_model_version(two_file_input, tmp_path):
+    from birdnet_analyzer.embeddings.core import SETTINGS_KEY
+    from birdnet_analyzer.search.core import get_database
+
+    audio_input, _, mock_encode_files = two_file_input
+    database = str(tmp_path / "db")
+
+    embeddings(audio_input, database)
+
+    db = get_database(database)
+    settings = db.get_metadata(SETTINGS_KEY)
+    assert (settings["MODEL_VERSION"], settings["EMBEDDING_DIM"]) == ("2.4", 1024)
+
+    # Databases of earlier versions hold 2.4 embeddings
+    del settings["MODEL_VERSION"]
+    del settings["EMBEDDING_DIM"]
+    db.insert_metadata(SETTINGS_KEY, settings)
+    db.commit()
+    db.db.close()
+
+    with pytest.raises(ValueError, match=r"BirdNET 3\.0 produces 1280-d"):
+        embeddings(audio_input, database, version="3.0")
+
+    embeddings(audio_input, database)
+
+    assert mock_encode_files.call_args.kwargs["version"] == "2.4"
+    db = get_database(database)
+    assert db.get_metadata(SETTINGS_KEY)["MODEL_VERSION"] == "2.4"
+    db.db.close()
+
+
+def test_check_database_settings_rejects_another_version(tmp_path):
+    from birdnet_analyzer.embeddings.core import (
+        _check_database_settings,
+        get_or_create_database,
+    )
+
+    db = get_or_create_database(str(tmp_path / "db"), embedding_dim=1280)
+    _check_database_settings(db, version="3.0")
+
+    with pytest.raises(ValueError, match=r"1280-d embeddings, BirdNET 2\.4"):
+        _check_database_settings(db, version="2.4")
+
+    db.db.close()
+
+
+def test_recording_index_inserts_missing_recordings_in_bulk(tmp_path):
+    from ml_collections import config_dict
+
+    from birdnet_analyzer.embeddings.core import (
+        _ensure_deployment,
+        _RecordingIndex,
+        get_or_create_database,
+    )
+
+    db = get_or_create_database(str(tmp_path / "db"))
+    deployment_id = _ensure_deployment(db)
+    other_deployment = db.insert_deployment(name="other", project="other")
+    existing_id = db.insert_recording(filename="a.wav", deployment_id=deployment_id)
+    db.insert_recording(filename="b.wav", deployment_id=other_deployment)
+
+    index = _RecordingIndex(db, deployment_id)
+    assert len(index) == 1
+
+    ids = index.ensure(["b.wav", "a.wav", "c.wav", "b.wav"])
+
+    assert ids[1] == existing_id
+    assert ids[0] == ids[3]
+    assert len(set(ids)) == 3
+    for fpath, recording_id in zip(["b.wav", "a.wav", "c.wav"], ids, strict=False):
+        (recording,) = db.get_all_recordings(
+            config_dict.create(eq={"filename": fpath, "deployment_id": deployment_id})
+        )
+        assert recording.id == recording_id
+    assert _RecordingIndex(db, deployment_id).ensure(["c.wav"]) == [ids[2]]
+    db.db.close()
+
+
+def _file_results(n_files):
+    inputs = [f"/audio/{i}.wav" for i in range(n_files)]
+    result = _make_encoding_result(inputs, [6.0] * n_files, 2, dim=4)
+    return inputs, list(_split_encoding_result(result))
+
+
+def test_embeddings_writer_throttles_the_encoder():
+    import threading
+
+    from birdnet_analyzer.embeddings.core import _EmbeddingsWriter
+
+    inputs, results = _file_results(3)
+    unblock = threading.Event()
+    db = MagicMock()
+    db.insert_windows_batch.side_effect = lambda **kwargs: unblock.wait()
+    writer = _EmbeddingsWriter(
+        db, dict.fromkeys(inputs, (1, (4, 0, 0.0))), max_pending=1
+    )
+
+    writer.put(results[0])  # Picked up by the writer, which then blocks
+    producer = threading.Thread(target=lambda: [writer.put(r) for r in results[1:]])
+    producer.start()
+    producer.join(0.5)
+    assert producer.is_alive()
+
+    unblock.set()
+    producer.join(5)
+    writer.close()
+
+    assert not producer.is_alive()
+    assert (
+        sum(
+            len(c.kwargs["windows_batch"])
+            for c in db.insert_windows_batch.call_args_list
+        )
+        == 6
+    )
+    db.commit.assert_called_once()
+
+
+def test_embeddings_writer_batches_files_and_reports_rates():
+    import threading
+
+    from birdnet_analyzer.embeddings.core import _EmbeddingsWriter
+
+    inputs, results = _file_results(5)
+    db = MagicMock()
+    # The writer waits in its first duplicate lookup until every result is queued
+    queued = threading.Event()
+    db.db.execute.side_effect = lambda *args: queued.wait() and MagicMock(fetchall=list)
+    writer = _EmbeddingsWriter(
+        db, {f: (i, (4, 0, 0.0)) for i, f in enumerate(inputs)}, resumed={0, 3}
+    )
+    for result in results:
+        writer.put(result)
+    queued.set()
+
+    stats = writer.close()
+
+    db.insert_windows_batch.assert_called_once()
+    call_kwargs = db.insert_windows_batch.call_args.kwargs
+    assert [w["recording_id"] for w in call_kwargs["windows_batch"]] == [
+        0, 0, 1, 1, 2, 2, 3, 3, 4, 4
+    ]  # fmt: skip
+    assert call_kwargs["embeddings_batch"].shape == (10, 4)
+    updates = db.db.executemany.call_args.args[1]
+    assert updates == [(4, 0, 0.0, i) for i in range(5)]
+    # Recordings inserted by the run cannot hold windows yet
+    assert [c.args[1] for c in db.db.execute.call_args_list] == [(0,), (3,)]
+    assert (stats.n_files, stats.n_windows) == (5, 10)
+    assert stats.encode_rate > 0
+    assert stats.write_rate > 0
+
+
+def test_embeddings_writer_error_cancels_the_encoder():
+    from birdnet_analyzer.embeddings.core import _EmbeddingsWriter
+
+    inputs, results = _file_results(3)
+    db = MagicMock()
+    db.insert_windows_batch.side_effect = OSError("disk full")
+    writer = _EmbeddingsWriter(
+        db, dict.fromkeys(inputs, (1, (4, 0, 0.0))), max_pending=1
+    )
+
+    writer.put(results[0])
+    writer._thread.join(5)
+
+    with pytest.raises(RuntimeError, match="Writing embeddings failed"):
+        writer.put(results[1])
+
+    with pytest.raises(OSError, match="disk full"):
+        writer.close()
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+BENCH_FILES = 20
+BENCH_SEGMENTS = 1200
+BENCH_REPEATS = 5
+
+
+class _CountingDB:
+    """Just enough of SQLiteUSearchDB to receive the windows of a run."""
+
+    def __init__(self):
+        self.n_windows = 0
+
+    def insert_windows_batch(self, windows_batch, embeddings_batch, **kwargs):
+        assert len(windows_batch) == len(embeddings_batch)
+        self.n_windows += len(windows_batch)
+
+
+def _insert_all_ref(db, result):
+    """The original per-segment loop of embeddings()."""
+    step = result.segment_duration_s - result.overlap_duration_s
+
+    for i in range(result.n_inputs):
+        file_dur = float(result.input_durations[i])
+        windows_batch = []
+        embeddings_batch = []
+
+        for j in range(result.max_n_segments):
+            if result.embeddings_masked[i, j, 0]:
+                continue
+
+            s_start = j * step
+            s_end = s_start + result.segment_duration_s
+
+            if s_start >= file_dur:
+                continue
+
+            s_end = min(s_end, file_dur)
+            windows_batch.append(
+                {"recording_id": i, "offsets": [float(s_start), float(s_end)]}
+            )
+            embeddings_batch.append(result.embeddings[i, j, :])
+
+        if windows_batch:
+            db.insert_windows_batch(
+                windows_batch=windows_batch,
+                embeddings_batch=np.asarray(embeddings_batch),
+            )
+
+
+def _insert_all(db, result):
+    """The windows of a run as selected and inserted by the writer thread."""
+    from birdnet_analyzer.embeddings.core import (
+        _insert_new_windows,
+        _new_windows,
+        _segment_windows,
+    )
+
+    valid, starts, ends = _segment_windows(result)
+    windows, embeddings = [], []
+
+    for i in range(result.n_inputs):
+        file_windows, file_embeddings = _new_windows(
+            db, i, starts, ends[i], valid[i], result.embeddings[i], check_existing=False
+        )
+        windows.extend(file_windows)
+        embeddings.append(file_embeddings)
+
+    _insert_new_windows(db, windows, embeddings)
+
+
+def test_benchmark_window_insertion(capsys):
+    import timeit
+
+    # One hour files, the last one shorter than the longest
+    durations = [BENCH_SEGMENTS * 3.0] * (BENCH_FILES - 1) + [1000.0]
+    masked = np.zeros((BENCH_FILES, BENCH_SEGMENTS, 1), dtype=bool)
+    masked[-1, 334:] = True
+    result = _make_encoding_result(
+        [f"/audio/{i}.wav" for i in range(BENCH_FILES)],
+        durations,
+        BENCH_SEGMENTS,
+        masked=masked,
+    )
+
+    new_db, ref_db = _CountingDB(), _CountingDB()
+    _insert_all(new_db, result)
+    _insert_all_ref(ref_db, result)
+    assert new_db.n_windows == ref_db.n_windows
+
+    t_new = min(
+        timeit.repeat(
+            lambda: _insert_all(_CountingDB(), result), number=1, repeat=BENCH_REPEATS
+        )
+    )
+    t_ref = min(
+        timeit.repeat(
+            lambda: _insert_all_ref(_CountingDB(), result),
+            number=1,
+            repeat=BENCH_REPEATS,
+        )
+    )
+
+    with capsys.disabled():
+        print(
+            f"\nwindow insertion ({BENCH_FILES} files x {BENCH_SEGMENTS} segments): "
+            f"new={t_new * 1000:.2f}ms  ref={t_ref * 1000:.2f}ms  "
+            f"speedup={t_ref / t_new:.1f}x"
+        )
+
+    assert t_new < t_ref, (
+        f"Vectorized window construction ({t_new * 1000:.2f}ms) should be faster than "
+        f"the per-segment loop ({t_ref * 1000:.2f}ms)"
+    )
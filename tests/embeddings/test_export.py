@@ -0,0 +1,229 @@
+import csv
+import os
+import timeit
+
+import numpy as np
+import pytest
+
+from birdnet_analyzer.embeddings import export
+from birdnet_analyzer.embeddings.core import (
+    _ensure_deployment,
+    create_csv_output,
+    get_or_create_database,
+)
+
+DIM = 8
+
+
+def _create_database(path, n_files, n_windows, dim=DIM):
+    """A database with ``n_windows`` windows of 3 s per file and random embeddings."""
+    rng = np.random.default_rng(0)
+    db = get_or_create_database(path, embedding_dim=dim)
+    deployment_id = _ensure_deployment(db)
+    expected = []
+
+    for i in range(n_files):
+        filename = os.path.join("audio", f"{i}.wav")
+        recording_id = db.insert_recording(
+            filename=filename, deployment_id=deployment_id
+        )
+        offsets = [[j * 3.0, j * 3.0 + 3.0] for j in range(n_windows)]
+        values = rng.standard_normal((n_windows, dim)).astype(np.float16)
+        db.insert_windows_batch(
+            windows_batch=[
+                {"recording_id": recording_id, "offsets": o} for o in offsets
+            ],
+            embeddings_batch=values,
+            handle_duplicates="allow",
+        )
+        expected.extend(
+            (filename, start, end, value.astype(np.float32))
+            for (start, end), value in zip(offsets, values, strict=True)
+        )
+
+    db.commit()
+    db.db.close()
+
+    return expected
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "db")
+    return path, _create_database(path, n_files=3, n_windows=5)
+
+
+def _assert_rows(filenames, starts, ends, embeddings, expected):
+    assert list(filenames) == [e[0] for e in expected]
+    np.testing.assert_array_equal(starts, [e[1] for e in expected])
+    np.testing.assert_array_equal(ends, [e[2] for e in expected])
+    np.testing.assert_array_equal(embeddings, np.stack([e[3] for e in expected]))
+
+
+@pytest.mark.parametrize(
+    ("path", "fmt"),
+    [("a.csv", "csv"), ("a.parquet", "parquet"), ("dir", "npy"), ("b.npy", "npy")],
+)
+def test_infer_export_format(path, fmt):
+    assert export.infer_export_format(path) == fmt
+
+
+def test_export_csv_keeps_the_legacy_layout(database, tmp_path):
+    path, expected = database
+    output = str(tmp_path / "out" / "embeddings.csv")
+
+    create_csv_output(output, path)
+
+    with open(output, newline="") as f:
+        reader = csv.reader(f)
+        assert next(reader) == ["file_path", "start", "end", "embedding"]
+        rows = list(reader)
+
+    _assert_rows(
+        [r[0] for r in rows],
+        [float(r[1]) for r in rows],
+        [float(r[2]) for r in rows],
+        np.array([r[3].split(",") for r in rows], dtype=np.float32),
+        expected,
+    )
+
+
+def test_csv_values_round_trip_float32_and_float16():
+    rng = np.random.default_rng(1)
+    values = rng.standard_normal((4, DIM)).astype(np.float32)
+    values[0, 0] = np.nan
+
+    for embeddings in (values, values.astype(np.float16).astype(np.float32)):
+        rows = export._format_embeddings(embeddings)
+        parsed = np.array([r.split(",") for r in rows], dtype=np.float32)
+        np.testing.assert_array_equal(parsed, embeddings)
+
+
+def test_export_parquet_has_a_fixed_size_list_column(database, tmp_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path, expected = database
+    output = str(tmp_path / "embeddings.parquet")
+
+    assert export.export_embeddings(path, output, batch_size=4) == len(expected)
+
+    table = pq.read_table(output)
+    assert table.schema.field("embedding").type == pa.list_(pa.float32(), DIM)
+    assert pq.ParquetFile(output).num_row_groups == 4
+    _assert_rows(
+        table["file_path"].to_pylist(),
+        table["start"].to_numpy(),
+        table["end"].to_numpy(),
+        np.stack(table["embedding"].to_numpy(zero_copy_only=False)),
+        expected,
+    )
+
+
+def test_export_npy_shards_can_be_memory_mapped(database, tmp_path, monkeypatch):
+    import pyarrow.parquet as pq
+
+    monkeypatch.setattr(export, "NPY_SHARD_ROWS", 6)
+    path, expected = database
+    output = str(tmp_path / "npy")
+
+    export.export_embeddings(path, output, "npy", batch_size=4)
+
+    shards = [
+        np.load(os.path.join(output, f"embeddings-{i:05d}.npy"), mmap_mode="r")
+        for i in range(3)
+    ]
+    assert [len(s) for s in shards] == [6, 6, 3]
+    assert not os.path.exists(os.path.join(output, "embeddings-00003.npy"))
+
+    metadata = pq.read_table(os.path.join(output, export.NPY_METADATA_FILENAME))
+    embeddings = np.stack(
+        [
+            shards[shard][row]
+            for shard, row in zip(
+                metadata["shard"].to_numpy(), metadata["row"].to_numpy(), strict=True
+            )
+        ]
+    )
+    _assert_rows(
+        metadata["file_path"].to_pylist(),
+        metadata["start"].to_numpy(),
+        metadata["end"].to_numpy(),
+        embeddings,
+        expected,
+    )
+
+
+@pytest.mark.parametrize("fmt", export.EXPORT_FORMATS)
+def test_export_empty_database(tmp_path, fmt):
+    path = str(tmp_path / "db")
+    get_or_create_database(path, embedding_dim=DIM).db.close()
+    output = str(tmp_path / f"out.{fmt}")
+
+    assert export.export_embeddings(path, output, fmt) == 0
+    assert os.path.exists(output)
+
+
+def test_export_rejects_unknown_format(database, tmp_path):
+    with pytest.raises(ValueError, match="Unknown export format"):
+        export.export_embeddings(database[0], str(tmp_path / "a.txt"), "txt")
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+BENCH_FILES = 20
+BENCH_WINDOWS = 100
+BENCH_DIM = 1024
+
+
+def _create_csv_output_ref(output_path: str, database: str):
+    """The original create_csv_output, three lookups per window."""
+    db = get_or_create_database(database)
+
+    with open(output_path, "w") as f:
+        f.write("file_path,start,end,embedding\n")
+
+        for window_id in db.match_window_ids():
+            embedding = db.get_embedding(window_id)
+            window = db.get_window(window_id)
+            recording = db.get_recording(window.recording_id)
+            start, end = window.offsets
+
+            f.write(
+                f"{recording.filename},{start},{end},"
+                f'"{",".join(map(str, embedding.tolist()))}"\n'
+            )
+    db.db.close()
+
+
+def test_benchmark_csv_export(tmp_path, capsys):
+    database = str(tmp_path / "db")
+    _create_database(database, BENCH_FILES, BENCH_WINDOWS, dim=BENCH_DIM)
+    new_path, ref_path = str(tmp_path / "new.csv"), str(tmp_path / "ref.csv")
+
+    t_new = min(
+        timeit.repeat(lambda: create_csv_output(new_path, database), number=1, repeat=3)
+    )
+    t_ref = min(
+        timeit.repeat(
+            lambda: _create_csv_output_ref(ref_path, database), number=1, repeat=3
+        )
+    )
+
+    with open(new_path) as f_new, open(ref_path) as f_ref:
+        for line_new, line_ref in zip(f_new, f_ref, strict=True):
+            assert line_new.split(",")[:3] == line_ref.split(",")[:3]
+
+    with capsys.disabled():
+        print(
+            f"\ncsv export ({BENCH_FILES * BENCH_WINDOWS} windows x {BENCH_DIM}): "
+            f"new={t_new * 1000:.2f}ms  ref={t_ref * 1000:.2f}ms  "
+            f"speedup={t_ref / t_new:.1f}x"
+        )
+
+    assert t_new < t_ref, (
+        f"Batched CSV export ({t_new * 1000:.2f}ms) should be faster than the "
+        f"per-window export ({t_ref * 1000:.2f}ms)"
+    )
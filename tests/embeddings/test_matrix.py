@@ -0,0 +1,327 @@
+import os
+import timeit
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from ml_collections import ConfigDict
+
+from birdnet_analyzer.embeddings import matrix
+from birdnet_analyzer.embeddings.core import (
+    SETTINGS_KEY,
+    _ensure_deployment,
+    get_or_create_database,
+)
+from birdnet_analyzer.embeddings.matrix import EmbeddingMatrix
+from birdnet_analyzer.search.utils import batched_brute_search
+
+
+def _create_database(path, embeddings):
+    db = get_or_create_database(path, embedding_dim=embeddings.shape[1])
+    recording_id = db.insert_recording(
+        filename="a.wav", deployment_id=_ensure_deployment(db)
+    )
+    db.insert_windows_batch(
+        windows_batch=[
+            {"recording_id": recording_id, "offsets": [i * 3.0, i * 3.0 + 3.0]}
+            for i in range(len(embeddings))
+        ],
+        embeddings_batch=embeddings,
+        handle_duplicates="allow",
+    )
+    db.commit()
+    return db
+
+
+def _uncached_search(*args, **kwargs):
+    with patch.object(EmbeddingMatrix, "open", return_value=None):
+        return batched_brute_search(*args, **kwargs)
+
+
+@pytest.mark.parametrize("score_function", ["cosine", "dot", "euclidean"])
+def test_search_on_the_matrix_is_exact(tmp_path, score_function):
+    rng = np.random.default_rng(0)
+    db = _create_database(
+        str(tmp_path / "db"), rng.standard_normal((1000, 32)).astype(np.float16)
+    )
+    queries = rng.standard_normal((3, 32)).astype(np.float32)
+
+    expected_ids, expected_scores = _uncached_search(
+        db, queries, 10, score_function, block_size=128
+    )
+    assert EmbeddingMatrix.load(db) is None
+
+    ids, scores = batched_brute_search(db, queries, 10, score_function, block_size=128)
+
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+    assert EmbeddingMatrix.load(db).is_current(db)
+    db.db.close()
+
+
+def test_matrix_holds_the_stored_embeddings(tmp_path):
+    rng = np.random.default_rng(1)
+    embeddings = rng.standard_normal((300, 16)).astype(np.float16)
+    db = _create_database(str(tmp_path / "db"), embeddings)
+
+    cached = EmbeddingMatrix.build(db)
+
+    # Stored as in the database, scanned as float32
+    assert isinstance(cached.embeddings, np.memmap)
+    assert cached.embeddings.dtype == np.float16
+    np.testing.assert_array_equal(cached.window_ids, db.match_window_ids())
+    np.testing.assert_array_equal(cached.embeddings, embeddings)
+    block = next(cached.blocks(1000))[1]
+    assert block.dtype == np.float32
+    np.testing.assert_array_equal(block, embeddings)
+    np.testing.assert_allclose(
+        cached.norms, np.linalg.norm(embeddings.astype(np.float32), axis=1), rtol=1e-6
+    )
+    assert os.path.exists(os.path.join(matrix.matrix_dir(db), "embeddings.npy"))
+    db.db.close()
+
+
+def test_matrix_is_rebuilt_when_the_database_changes(tmp_path):
+    rng = np.random.default_rng(2)
+    db = _create_database(
+        str(tmp_path / "db"), rng.standard_normal((100, 16)).astype(np.float16)
+    )
+    settings = ConfigDict({"AUDIO_ROOT": str(tmp_path), "AUDIO_SPEED": 1.0})
+    db.insert_metadata(SETTINGS_KEY, settings)
+
+    assert len(EmbeddingMatrix.open(db)) == 100
+
+    # The audio root does not change the embeddings
+    settings["AUDIO_ROOT"] = str(tmp_path / "moved")
+    db.insert_metadata(SETTINGS_KEY, settings)
+    assert EmbeddingMatrix.load(db).is_current(db)
+
+    db.insert_window(
+        recording_id=1, offsets=[9999.0, 10002.0], embedding=np.ones(16, np.float16)
+    )
+    db.commit()
+    assert not EmbeddingMatrix.load(db).is_current(db)
+    assert len(EmbeddingMatrix.open(db)) == 101
+
+    settings["AUDIO_SPEED"] = 2.0
+    db.insert_metadata(SETTINGS_KEY, settings)
+    assert not EmbeddingMatrix.load(db).is_current(db)
+    db.db.close()
+
+
+def test_search_falls_back_to_the_database(tmp_path):
+    rng = np.random.default_rng(3)
+    db = _create_database(
+        str(tmp_path / "db"), rng.standard_normal((100, 16)).astype(np.float16)
+    )
+    queries = rng.standard_normal((1, 16)).astype(np.float32)
+
+    with patch.object(EmbeddingMatrix, "build", side_effect=PermissionError):
+        ids, _ = batched_brute_search(db, queries, 5, "cosine")
+
+    assert EmbeddingMatrix.load(db) is None
+    np.testing.assert_array_equal(ids, _uncached_search(db, queries, 5, "cosine")[0])
+    db.db.close()
+
+
+def test_failed_builds_leave_no_files_behind(tmp_path, caplog):
+    rng = np.random.default_rng(8)
+    db = _create_database(
+        str(tmp_path / "db"), rng.standard_normal((100, 16)).astype(np.float16)
+    )
+
+    # A window is added while the matrix is built
+    with patch.object(matrix, "_fingerprint", return_value=matrix._fingerprint(db)):
+        db.insert_window(
+            recording_id=1, offsets=[9999.0, 10002.0], embedding=np.ones(16, np.float16)
+        )
+        db.commit()
+        assert EmbeddingMatrix.open(db) is None
+
+    assert os.listdir(matrix.matrix_dir(db)) == []
+    assert "The database changed" in caplog.text
+    assert caplog.records[-1].levelname == "WARNING"
+
+    # The disk fills up after a few batches
+    read = db.get_embeddings_batch
+    batches = []
+
+    def read_until_the_disk_is_full(ids):
+        batches.append(ids)
+        if len(batches) > 3:
+            raise OSError(28, "No space left on device")
+        return read(ids)
+
+    with (
+        patch.object(matrix, "BUILD_BATCH_SIZE", 10),
+        patch.object(
+            db, "get_embeddings_batch", side_effect=read_until_the_disk_is_full
+        ),
+    ):
+        assert EmbeddingMatrix.open(db) is None
+
+    assert os.listdir(matrix.matrix_dir(db)) == []
+    assert len(EmbeddingMatrix.open(db)) == 101
+    db.db.close()
+
+
+def _save_matrix(path, embeddings):
+    np.save(path / "embeddings.npy", embeddings)
+    np.save(path / "window_ids.npy", np.arange(1, len(embeddings) + 1))
+    np.save(path / "norms.npy", np.linalg.norm(embeddings, axis=1))
+
+
+def _load_matrix(path):
+    return EmbeddingMatrix(
+        *(
+            np.load(path / f"{name}.npy", mmap_mode="r")
+            for name in ("embeddings", "window_ids", "norms")
+        ),
+        {},
+    )
+
+
+def _resident_file_bytes():
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("RssFile:"):
+                return int(line.split()[1]) * 1024
+
+    raise KeyError("RssFile")
+
+
+def _peak_resident_scan(blocks):
+    """The most file pages resident at once while scanning the blocks."""
+    before = peak = _resident_file_bytes()
+    rows = 0
+
+    for ids, block, norms in blocks:
+        rows += len(ids)
+        block.sum()
+        norms.sum()
+        peak = max(peak, _resident_file_bytes())
+
+    return rows, peak - before
+
+
+needs_proc = pytest.mark.skipif(
+    not os.path.exists("/proc/self/status") or matrix._MADV_DONTNEED is None,
+    reason="Needs /proc and madvise",
+)
+
+
+def test_blocks_of_a_matrix_in_memory(tmp_path):
+    embeddings = np.random.default_rng(5).standard_normal((10, 4)).astype(np.float32)
+    _save_matrix(tmp_path, embeddings)
+    loaded = _load_matrix(tmp_path)
+    in_memory = EmbeddingMatrix(
+        np.array(loaded.embeddings),
+        np.array(loaded.window_ids),
+        np.array(loaded.norms),
+        {},
+    )
+
+    for mapped, plain in zip(loaded.blocks(3), in_memory.blocks(3), strict=True):
+        for a, b in zip(mapped, plain, strict=True):
+            np.testing.assert_array_equal(a, b)
+
+
+@needs_proc
+def test_scanning_the_matrix_keeps_about_one_block_resident(tmp_path):
+    embeddings = np.random.default_rng(6).standard_normal((32_768, 256))
+    _save_matrix(tmp_path, embeddings.astype(np.float32))
+    block_bytes = 1024 * 256 * 4
+
+    rows, resident = _peak_resident_scan(_load_matrix(tmp_path).blocks(1024))
+
+    assert rows == 32_768
+    # The whole matrix is 32 blocks, other files of the process page in too
+    assert resident < 8 * block_bytes
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+BENCH_ROWS = 20_000
+BENCH_DIM = 1024
+
+
+def test_benchmark_matrix_search(tmp_path, capsys):
+    rng = np.random.default_rng(4)
+    db = _create_database(
+        str(tmp_path / "db"),
+        rng.standard_normal((BENCH_ROWS, BENCH_DIM)).astype(np.float16),
+    )
+    queries = rng.standard_normal((1, BENCH_DIM)).astype(np.float32)
+    EmbeddingMatrix.build(db)
+
+    t_new = min(
+        timeit.repeat(
+            lambda: batched_brute_search(db, queries, 10, "cosine"),
+            number=3,
+            repeat=3,
+        )
+    )
+    t_ref = min(
+        timeit.repeat(
+            lambda: _uncached_search(db, queries, 10, "cosine"), number=3, repeat=3
+        )
+    )
+
+    with capsys.disabled():
+        print(
+            f"\nmatrix search ({BENCH_ROWS}x{BENCH_DIM}, cosine): "
+            f"new={t_new / 3 * 1000:.2f}ms  ref={t_ref / 3 * 1000:.2f}ms  "
+            f"speedup={t_ref / t_new:.1f}x"
+        )
+
+    db.db.close()
+    assert t_new < t_ref, (
+        f"Searching the cached matrix ({t_new / 3 * 1000:.2f}ms) should be faster "
+        f"than reading the database ({t_ref / 3 * 1000:.2f}ms)"
+    )
+
+
+@needs_proc
+def test_benchmark_matrix_scan_memory(tmp_path, capsys):
+    embeddings = np.random.default_rng(7).standard_normal((BENCH_ROWS, BENCH_DIM))
+    _save_matrix(tmp_path, embeddings.astype(np.float32))
+    del embeddings
+
+    def slices():
+        # The blocks as sliced before, whose pages stay mapped once read
+        loaded = _load_matrix(tmp_path)
+
+        for start in range(0, len(loaded), 1024):
+            end = start + 1024
+            yield (
+                loaded.window_ids[start:end],
+                loaded.embeddings[start:end],
+                loaded.norms[start:end],
+            )
+
+    t_new = min(
+        timeit.repeat(
+            lambda: _peak_resident_scan(_load_matrix(tmp_path).blocks(1024)),
+            number=1,
+            repeat=3,
+        )
+    )
+    t_ref = min(
+        timeit.repeat(lambda: _peak_resident_scan(slices()), number=1, repeat=3)
+    )
+    _, resident_new = _peak_resident_scan(_load_matrix(tmp_path).blocks(1024))
+    _, resident_ref = _peak_resident_scan(slices())
+
+    with capsys.disabled():
+        print(
+            f"\nmatrix scan ({BENCH_ROWS}x{BENCH_DIM}): "
+            f"new={t_new * 1000:.2f}ms {resident_new / 2**20:.1f}MiB resident  "
+            f"ref={t_ref * 1000:.2f}ms {resident_ref / 2**20:.1f}MiB resident"
+        )
+
+    assert resident_new < resident_ref / 4, (
+        f"Scanning the matrix ({resident_new / 2**20:.1f}MiB) should keep much "
+        f"less of it resident than slicing it ({resident_ref / 2**20:.1f}MiB)"
+    )
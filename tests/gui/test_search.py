@@ -0,0 +1,72 @@
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+# The search tab needs gradio, which only comes with the gui and gui-tests extras.
+pytest.importorskip("gradio")
+
+from birdnet_analyzer.gui import search
+
+
+def test_export_plays_results_at_the_audio_speed(tmp_path):
+    source = str(tmp_path / "source.wav")
+    sf.write(source, np.zeros(22050 * 20, np.float32), 22050)
+    export_folder = tmp_path / "export"
+    export_folder.mkdir()
+    # file, offset, duration, index, score, speed, fmin, fmax as in the search tab
+    export_state = {
+        0: [source, 3.0, 6.0, 0, 0.9, 2.0, 0, 15000],
+        1: [source, 12.0, 6.0, 1, 0.8, 2.0, 0, 15000],
+    }
+
+    with (
+        patch.object(search.gu, "select_folder", return_value=str(export_folder)),
+        patch.object(search.gr, "Info"),
+    ):
+        search.run_export(export_state)
+
+    exported = sorted(export_folder.iterdir())
+    assert [p.name for p in exported] == [
+        "0.80000_source_12.0_18.0.wav",
+        "0.90000_source_3.0_9.0.wav",
+    ]
+    for path in exported:
+        info = sf.info(path)
+        assert info.samplerate == 44100
+        assert info.frames == 22050 * 6
+
+
+def test_search_keeps_the_database_unchanged_for_the_cache(tmp_path):
+    from ml_collections import ConfigDict
+
+    from birdnet_analyzer.embeddings.core import SETTINGS_KEY
+    from birdnet_analyzer.search.cache import database_fingerprint
+
+    database = str(tmp_path / "db")
+    db = search.get_embeddings_database(database, embedding_dim=4)
+    db.insert_metadata(
+        SETTINGS_KEY,
+        ConfigDict({"BANDPASS_FMIN": 0, "BANDPASS_FMAX": 15000, "AUDIO_SPEED": 1.0}),
+    )
+    db.commit()
+    db.db.close()
+    fingerprints = []
+
+    def get_search_results(query_path, db, *args, **kwargs):
+        assert kwargs["cache"] is search.SEARCH_CACHE
+        fingerprints.append(database_fingerprint(db))
+        return []
+
+    with patch(
+        "birdnet_analyzer.search.utils.get_search_results",
+        side_effect=get_search_results,
+    ):
+        for _ in range(2):
+            search.run_search(
+                database, str(tmp_path), "query.wav", 10, "cosine", "center", 0
+            )
+
+    # Only the first search stores the audio root
+    assert fingerprints[0] == fingerprints[1]
@@ -0,0 +1,184 @@
+import shutil
+import time
+import timeit
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from birdnet_analyzer import audio
+from birdnet_analyzer.embeddings.core import _ensure_deployment, get_or_create_database
+from birdnet_analyzer.search.cache import SearchResultsCache, database_fingerprint
+from birdnet_analyzer.search.utils import get_search_results
+
+DIM = 32
+
+
+def _insert(db, embeddings):
+    recording_id = db.insert_recording(
+        filename=f"{db.count_embeddings()}.wav", deployment_id=_ensure_deployment(db)
+    )
+    db.insert_windows_batch(
+        windows_batch=[
+            {"recording_id": recording_id, "offsets": [i * 3.0, i * 3.0 + 3.0]}
+            for i in range(len(embeddings))
+        ],
+        embeddings_batch=embeddings,
+        handle_duplicates="allow",
+    )
+    db.commit()
+
+
+def _encode(signals, **kwargs):
+    return np.random.default_rng(len(signals)).standard_normal((len(signals), DIM))
+
+
+@pytest.fixture
+def database(tmp_path):
+    db = get_or_create_database(str(tmp_path / "db"), embedding_dim=DIM)
+    _insert(db, np.random.default_rng(0).standard_normal((500, DIM)).astype(np.float16))
+    yield db
+    db.db.close()
+
+
+@pytest.fixture
+def query(tmp_path):
+    path = str(tmp_path / "query.wav")
+    audio.save_signal(np.zeros(48000 * 9, np.float32), path, 48000)
+    return path
+
+
+@pytest.fixture
+def encoder():
+    with patch(
+        "birdnet_analyzer.model_utils.get_query_embeddings_array", side_effect=_encode
+    ) as encode:
+        yield encode
+
+
+def _ids(results):
+    return [r.window_id for r in results]
+
+
+def test_fewer_results_and_pages_are_served_from_the_cache(database, query, encoder):
+    cache = SearchResultsCache(min_results=50)
+
+    first = get_search_results(query, database, 10, crop_mode="segments", cache=cache)
+    more = get_search_results(query, database, 50, crop_mode="segments", cache=cache)
+    fewer = get_search_results(query, database, 5, crop_mode="segments", cache=cache)
+
+    assert encoder.call_count == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert _ids(first) == _ids(more)[:10]
+    assert _ids(fewer) == _ids(first)[:5]
+    assert _ids(more) == _ids(
+        get_search_results(query, database, 50, crop_mode="segments")
+    )
+
+
+def test_more_results_than_kept_are_searched_again(database, query, encoder):
+    cache = SearchResultsCache(min_results=20)
+
+    get_search_results(query, database, 10, cache=cache)
+    results = get_search_results(query, database, 30, cache=cache)
+    assert len(results) == 30
+    assert encoder.call_count == 2
+
+    # All there are, whatever is asked for
+    get_search_results(query, database, 1000, cache=cache)
+    assert len(get_search_results(query, database, 2000, cache=cache)) == 499
+    assert encoder.call_count == 3
+
+
+def test_the_key_covers_the_query_the_arguments_and_the_database(
+    database, query, encoder, tmp_path
+):
+    cache = SearchResultsCache()
+    get_search_results(query, database, 10, cache=cache)
+
+    # The same audio under another name is the same query
+    renamed = str(tmp_path / "renamed.wav")
+    shutil.copy(query, renamed)
+    get_search_results(renamed, database, 10, cache=cache)
+    assert encoder.call_count == 1
+
+    get_search_results(query, database, 10, crop_mode="segments", cache=cache)
+    get_search_results(query, database, 10, score_function="dot", cache=cache)
+    get_search_results(query, database, 10, crop_overlap=1.0, cache=cache)
+    assert encoder.call_count == 4
+
+    audio.save_signal(np.ones(48000 * 9, np.float32) * 0.1, renamed, 48000)
+    get_search_results(renamed, database, 10, cache=cache)
+    assert encoder.call_count == 5
+
+    before = database_fingerprint(database)
+    _insert(database, np.ones((1, DIM), np.float16))
+    assert database_fingerprint(database) != before
+    results = get_search_results(query, database, 10, cache=cache)
+    assert encoder.call_count == 6
+    assert len(cache) == 6
+    assert _ids(results) == _ids(get_search_results(query, database, 10))
+
+
+def test_least_recently_used_queries_are_dropped(database, query, encoder):
+    cache = SearchResultsCache(maxsize=2)
+
+    for crop_mode in ("center", "first", "center", "segments", "center", "first"):
+        get_search_results(query, database, 10, crop_mode=crop_mode, cache=cache)
+
+    # "first" was dropped for "segments" and searched again
+    assert encoder.call_count == 4
+    assert len(cache) == 2
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+
+def test_benchmark_repeated_search(tmp_path, query, capsys):
+    # Encoding the query costs about as much as running the model on a few crops.
+    db = get_or_create_database(str(tmp_path / "bench"), embedding_dim=256)
+    _insert(
+        db, np.random.default_rng(1).standard_normal((20000, 256)).astype(np.float16)
+    )
+    cache = SearchResultsCache()
+
+    def encode(signals, **kwargs):
+        time.sleep(0.02)
+        return np.random.default_rng(len(signals)).standard_normal((len(signals), 256))
+
+    def run_ref():
+        # Paging through the results by searching for each page again
+        return [
+            _ids(get_search_results(query, db, n, crop_mode="segments"))
+            for n in (6, 12, 18)
+        ]
+
+    def run():
+        return [
+            _ids(get_search_results(query, db, n, crop_mode="segments", cache=cache))
+            for n in (6, 12, 18)
+        ]
+
+    with patch(
+        "birdnet_analyzer.model_utils.get_query_embeddings_array", side_effect=encode
+    ):
+        # Cached pages are the best of min_results per crop, scored more completely
+        deeper = _ids(get_search_results(query, db, 100, crop_mode="segments"))
+        assert run() == [deeper[:n] for n in (6, 12, 18)]
+        t_new = min(timeit.repeat(run, number=3, repeat=3)) / 3
+        t_ref = min(timeit.repeat(run_ref, number=3, repeat=3)) / 3
+
+    with capsys.disabled():
+        print(
+            f"\nrepeated search (3 pages, 20000x256): "
+            f"new={t_new * 1000:.2f}ms  ref={t_ref * 1000:.2f}ms  "
+            f"speedup={t_ref / t_new:.1f}x"
+        )
+
+    db.db.close()
+    assert t_new < t_ref, (
+        f"Serving repeated searches from the cache ({t_new * 1000:.2f}ms) should be "
+        f"faster than searching again ({t_ref * 1000:.2f}ms)"
+    )
@@ -0,0 +1,239 @@
+import datetime as dt
+import timeit
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from birdnet_analyzer.embeddings.ann import AnnIndex
+from birdnet_analyzer.embeddings.core import get_or_create_database
+from birdnet_analyzer.search.filters import SearchFilter, parse_recording_datetime
+from birdnet_analyzer.search.utils import batched_brute_search, search_query_embeddings
+
+# Three sites with a recording per day in May 2023 and one without a date.
+RECORDINGS = [
+    *(
+        f"site_{site}/{site.upper()}1_202305{day:02d}_053000.wav"
+        for site in "abc"
+        for day in range(1, 31)
+    ),
+    "site_a/undated.wav",
+]
+
+
+def _create_database(path, windows_per_recording, dim, rng):
+    db = get_or_create_database(path, embedding_dim=dim)
+    deployments = {
+        name: db.insert_deployment(name=name, project="test") for name in ("n", "s")
+    }
+
+    for i, filename in enumerate(RECORDINGS):
+        recording_id = db.insert_recording(
+            filename=filename, deployment_id=deployments["n" if i % 2 else "s"]
+        )
+        db.insert_windows_batch(
+            windows_batch=[
+                {"recording_id": recording_id, "offsets": [j * 3.0, j * 3.0 + 3.0]}
+                for j in range(windows_per_recording)
+            ],
+            embeddings_batch=rng.standard_normal((windows_per_recording, dim)).astype(
+                np.float16
+            ),
+        )
+
+    db.commit()
+    return db
+
+
+def _kept_by_hand(db, keep):
+    rows = db.db.execute(
+        "SELECT w.id, r.filename, d.name FROM windows w "
+        "JOIN recordings r ON r.id = w.recording_id "
+        "JOIN deployments d ON d.id = r.deployment_id ORDER BY w.id"
+    ).fetchall()
+
+    return np.array([row[0] for row in rows if keep(row[1], row[2])], dtype=np.int64)
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    db = _create_database(
+        str(tmp_path_factory.mktemp("db") / "db"), 10, 16, np.random.default_rng(0)
+    )
+    yield db
+    db.db.close()
+
+
+@pytest.mark.parametrize(
+    ("filename", "expected"),
+    [
+        ("20230501_053000.wav", dt.datetime(2023, 5, 1, 5, 30)),
+        ("site/SMA01234_20230501_053000.wav", dt.datetime(2023, 5, 1, 5, 30)),
+        ("2023-05-01T05-30-00.flac", dt.datetime(2023, 5, 1, 5, 30)),
+        ("2023-05-01 05:30.mp3", dt.datetime(2023, 5, 1, 5, 30)),
+        ("recorded_20230501.wav", dt.datetime(2023, 5, 1)),
+        ("20230501/unit7.wav", None),
+        ("123456789012.wav", None),
+        ("20231301_000000.wav", None),
+        ("undated.wav", None),
+    ],
+)
+def test_parse_recording_datetime(filename, expected):
+    assert parse_recording_datetime(filename) == expected
+
+
+@pytest.mark.parametrize(
+    ("search_filter", "keep"),
+    [
+        (SearchFilter(filename="site_b/*"), lambda f, d: f.startswith("site_b/")),
+        (SearchFilter(deployment="n"), lambda f, d: d == "n"),
+        (
+            SearchFilter(
+                start=dt.datetime(2023, 5, 10), end=dt.datetime(2023, 5, 12, 5, 30)
+            ),
+            lambda f, d: "_20230510_" in f or "_20230511_" in f,
+        ),
+        (
+            SearchFilter(
+                filename="site_[ac]/*", deployment="s", end=dt.datetime(2023, 5, 3)
+            ),
+            lambda f, d: (
+                f[5] in "ac" and d == "s" and ("_20230501_" in f or "_20230502_" in f)
+            ),
+        ),
+        (SearchFilter(filename="nothing/*"), lambda f, d: False),
+    ],
+)
+def test_filter_window_ids(database, search_filter, keep):
+    ids = search_filter.window_ids(database)
+
+    np.testing.assert_array_equal(ids, _kept_by_hand(database, keep))
+    assert np.all(np.diff(ids) > 0)
+
+
+def test_empty_filter_keeps_everything(database):
+    assert not SearchFilter()
+    assert SearchFilter(deployment="n")
+    assert len(SearchFilter().window_ids(database)) == len(RECORDINGS) * 10
+
+
+def test_stored_recording_time_is_preferred(tmp_path):
+    db = _create_database(str(tmp_path / "db"), 1, 4, np.random.default_rng(1))
+    db.db.execute(
+        "UPDATE recordings SET datetime = ? WHERE filename = ?",
+        ("2024-01-01T00:00:00", "site_a/undated.wav"),
+    )
+
+    ids = SearchFilter(start=dt.datetime(2024, 1, 1)).window_ids(db)
+
+    assert len(ids) == 1
+    db.db.close()
+
+
+@pytest.mark.parametrize("score_function", ["cosine", "dot", "euclidean"])
+def test_filtered_search_matches_filtering_all_results(database, score_function):
+    search_filter = SearchFilter(filename="site_c/*", start=dt.datetime(2023, 5, 20))
+    kept = search_filter.window_ids(database)
+    queries = [np.random.default_rng(2).standard_normal((1, 16)).astype(np.float32)]
+
+    results = search_query_embeddings(
+        database, queries, 10, score_function, search_filter=search_filter
+    )[0]
+    everything = search_query_embeddings(
+        database, queries, len(RECORDINGS) * 10, score_function
+    )[0]
+
+    expected = [r for r in everything if r.window_id in set(kept)][:10]
+    assert [r.window_id for r in results] == [r.window_id for r in expected]
+
+
+def test_filter_keeping_nothing_finds_nothing(database):
+    queries = [np.ones((1, 16), np.float32)]
+
+    assert search_query_embeddings(
+        database, queries, 10, search_filter=SearchFilter(deployment="missing")
+    ) == [[]]
+
+
+def test_ann_index_is_used_unless_the_filter_is_selective(tmp_path):
+    rng = np.random.default_rng(3)
+    db = _create_database(str(tmp_path / "db"), 20, 16, rng)
+    AnnIndex.build(db, "cosine")
+    queries = [rng.standard_normal((1, 16)).astype(np.float32)]
+
+    def run(search_filter):
+        with patch.object(
+            AnnIndex, "candidates", autospec=True, side_effect=AnnIndex.candidates
+        ) as candidates:
+            results = search_query_embeddings(
+                db, queries, 10, search_filter=search_filter
+            )[0]
+
+        kept = set(search_filter.window_ids(db))
+        assert {r.window_id for r in results} <= kept
+        return [r.window_id for r in results], candidates.called
+
+    # A third of the database, enough candidates remain after filtering
+    ids, used_ann = run(SearchFilter(filename="site_a/*"))
+    assert used_ann
+    assert len(ids) == 10
+
+    # One recording of 91, scored exhaustively
+    search_filter = SearchFilter(filename="site_b/B1_20230507_*")
+    ids, used_ann = run(search_filter)
+    assert not used_ann
+    exact, _ = batched_brute_search(
+        db, queries[0], 10, "cosine", window_ids=search_filter.window_ids(db)
+    )
+    assert ids == exact[0].tolist()
+    db.db.close()
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+BENCH_WINDOWS_PER_RECORDING = 50
+BENCH_DIM = 1024
+
+
+def test_benchmark_filtered_search(tmp_path, capsys):
+    rng = np.random.default_rng(4)
+    db = _create_database(
+        str(tmp_path / "db"), BENCH_WINDOWS_PER_RECORDING, BENCH_DIM, rng
+    )
+    queries = [rng.standard_normal((1, BENCH_DIM)).astype(np.float32)]
+    # Three recordings of 91
+    search_filter = SearchFilter(
+        filename="site_a/*",
+        start=dt.datetime(2023, 5, 10),
+        end=dt.datetime(2023, 5, 13),
+    )
+    n_windows = len(RECORDINGS) * BENCH_WINDOWS_PER_RECORDING
+
+    def run_ref():
+        # Search everything and filter afterwards
+        kept = set(search_filter.window_ids(db))
+        everything = search_query_embeddings(db, queries, n_windows)[0]
+        return [r.window_id for r in everything if r.window_id in kept][:10]
+
+    def run():
+        results = search_query_embeddings(db, queries, 10, search_filter=search_filter)
+        return [r.window_id for r in results[0]]
+
+    assert run() == run_ref()
+    t_new = min(timeit.repeat(run, number=5, repeat=3)) / 5
+    t_ref = min(timeit.repeat(run_ref, number=5, repeat=3)) / 5
+
+    with capsys.disabled():
+        print(
+            f"\nfiltered search ({n_windows}x{BENCH_DIM}, 3 of 91 recordings): "
+            f"new={t_new * 1000:.2f}ms  ref={t_ref * 1000:.2f}ms  "
+            f"speedup={t_ref / t_new:.1f}x"
+        )
+
+    db.db.close()
+    assert t_new < t_ref, (
+        f"Scoring the filtered windows ({t_new * 1000:.2f}ms) should be faster than "
+        f"filtering the results of the whole database ({t_ref * 1000:.2f}ms)"
+    )
@@ -1,10 +1,12 @@
 import os
 import shutil
 import tempfile
+from datetime import datetime
 from unittest.mock import MagicMock, patch
 
 from birdnet_analyzer.cli import search_parser
 from birdnet_analyzer.search.core import search
+from birdnet_analyzer.search.filters import SearchFilter
 
 
 def _make_test_environment():
@@ -22,14 +24,45 @@ def _make_test_environment():
     }
 
 
+def _create_search_database(path, rng, filename="source.wav", **settings):
+    import numpy as np
+    from ml_collections import ConfigDict
+
+    from birdnet_analyzer.embeddings.core import (
+        SETTINGS_KEY,
+        _ensure_deployment,
+        get_or_create_database,
+    )
+
+    db = get_or_create_database(path, embedding_dim=16)
+    db.insert_metadata(
+        SETTINGS_KEY,
+        ConfigDict(
+            {"BANDPASS_FMIN": 0, "BANDPASS_FMAX": 15000, "AUDIO_SPEED": 1.0} | settings
+        ),
+    )
+    recording_id = db.insert_recording(
+        filename=filename, deployment_id=_ensure_deployment(db)
+    )
+    db.insert_windows_batch(
+        windows_batch=[
+            {"recording_id": recording_id, "offsets": [i * 3.0, i * 3.0 + 3.0]}
+            for i in range(10)
+        ],
+        embeddings_batch=rng.standard_normal((10, 16)).astype(np.float16),
+    )
+    db.commit()
+    db.db.close()
+
+
 @patch("birdnet_analyzer.audio.save_signal")
-@patch("birdnet_analyzer.audio.open_audio_file")
+@patch("birdnet_analyzer.audio.read_windows")
 @patch("birdnet_analyzer.search.utils.get_search_results")
 @patch("birdnet_analyzer.search.core.get_database")
 def test_search_cli_accepts_full_parser_surface(
     mock_get_database,
     mock_get_search_results,
-    mock_open_audio_file,
+    mock_read_windows,
     mock_save_signal,
 ):
     env = _make_test_environment()
@@ -53,6 +86,14 @@ def test_search_cli_accepts_full_parser_surface(
                 os.path.join(env["test_dir"], "database.sqlite"),
                 "--overlap",
                 "0.5",
+                "--exact",
+                "--memory_budget",
+                "256",
+                "--file_glob",
+                "site_x/*",
+                "--time_from",
+                "2023-05-01",
+                "--collapse_duplicates",
             ]
         )
 
@@ -71,18 +112,182 @@ def test_search_cli_accepts_full_parser_surface(
         mock_get_search_results.return_value = [
             MagicMock(window_id=11, sort_score=0.12345)
         ]
-        mock_open_audio_file.return_value = (b"signal", 48000)
+        mock_read_windows.return_value = ([b"signal"], 48000)
 
         search(**vars(args))
 
         mock_get_search_results.assert_called_once()
         search_kwargs = mock_get_search_results.call_args.args
-        assert search_kwargs[0] == args.queryfile
+        assert search_kwargs[0] == args.queryfile[0]
         assert search_kwargs[2] == 5
         assert search_kwargs[6] == "dot"
         assert search_kwargs[7] == "segments"
         assert search_kwargs[8] == 0.5
-        mock_open_audio_file.assert_called_once()
+        # Databases without a stored version hold BirdNET 2.4 embeddings
+        assert mock_get_search_results.call_args.kwargs["version"] == "2.4"
+        assert mock_get_search_results.call_args.kwargs["exact"] is True
+        assert mock_get_search_results.call_args.kwargs["memory_budget_mb"] == 256
+        assert mock_get_search_results.call_args.kwargs[
+            "search_filter"
+        ] == SearchFilter(filename="site_x/*", start=datetime(2023, 5, 1))
+        assert mock_get_search_results.call_args.kwargs["collapse_duplicates"] is True
+        mock_read_windows.assert_called_once()
+        # The window is read at the audio speed of the database
+        assert mock_read_windows.call_args.args[1] == [(1.0, 3.0 * 1.1)]
+        assert mock_read_windows.call_args.args[2] == 1.1
         mock_save_signal.assert_called_once()
     finally:
         shutil.rmtree(env["test_dir"])
+
+
+@patch("birdnet_analyzer.model_utils.get_query_embeddings_array")
+@patch("birdnet_analyzer.audio.open_audio_file")
+def test_query_is_encoded_with_the_database_model(
+    mock_open_audio_file, mock_get_query_embeddings_array
+):
+    import numpy as np
+
+    from birdnet_analyzer.search.utils import get_query_embedding
+
+    mock_open_audio_file.return_value = (np.zeros(32000 * 5), 32000)
+
+    get_query_embedding("query.wav", version="3.0")
+
+    assert mock_open_audio_file.call_args.kwargs["sample_rate"] == 32000
+    (signals,), kwargs = mock_get_query_embeddings_array.call_args
+    assert kwargs["version"] == "3.0"
+    assert len(signals[0]) == 32000 * 3
+
+
+@patch("birdnet_analyzer.model_utils.get_query_embeddings_array")
+def test_search_writes_a_folder_per_query_and_a_results_table(
+    mock_get_query_embeddings_array,
+):
+    import csv
+
+    import numpy as np
+
+    from birdnet_analyzer import audio
+    from birdnet_analyzer.search.core import RESULTS_TABLE_FILENAME
+
+    env = _make_test_environment()
+    try:
+        rng = np.random.default_rng(0)
+        db_path = os.path.join(env["test_dir"], "database")
+        _create_search_database(db_path, rng)
+        audio.save_signal(
+            np.zeros(48000 * 30, np.float32),
+            os.path.join(env["input_dir"], "source.wav"),
+            48000,
+        )
+
+        query_dir = os.path.join(env["test_dir"], "queries")
+        os.makedirs(os.path.join(query_dir, "nested"))
+        for name in ("a.wav", "b.wav", os.path.join("nested", "a.wav")):
+            audio.save_signal(
+                np.zeros(48000 * 5, np.float32), os.path.join(query_dir, name), 48000
+            )
+
+        mock_get_query_embeddings_array.side_effect = lambda sigs, **kwargs: (
+            rng.standard_normal((len(sigs), 16))
+        )
+
+        search(
+            env["output_dir"],
+            db_path,
+            env["input_dir"],
+            query_dir,
+            n_results=3,
+        )
+
+        # All queries are encoded at once
+        mock_get_query_embeddings_array.assert_called_once()
+        assert sorted(os.listdir(env["output_dir"])) == [
+            "a",
+            "a_2",
+            "b",
+            RESULTS_TABLE_FILENAME,
+        ]
+
+        with open(
+            os.path.join(env["output_dir"], RESULTS_TABLE_FILENAME), encoding="utf-8"
+        ) as f:
+            rows = list(csv.DictReader(f))
+
+        assert len(rows) == 9
+        assert [row["Rank"] for row in rows[:3]] == ["1", "2", "3"]
+        assert rows[0]["Query"] == os.path.join(query_dir, "a.wav")
+        assert rows[0]["File"] == "source.wav"
+        for row in rows:
+            assert os.path.isfile(os.path.join(env["output_dir"], row["Result"]))
+    finally:
+        shutil.rmtree(env["test_dir"])
+
+
+@patch("birdnet_analyzer.model_utils.get_query_embeddings_array")
+def test_search_several_databases(mock_get_query_embeddings_array):
+    import csv
+
+    import numpy as np
+
+    from birdnet_analyzer import audio
+    from birdnet_analyzer.search.core import RESULTS_TABLE_FILENAME
+
+    env = _make_test_environment()
+    try:
+        rng = np.random.default_rng(1)
+        databases = []
+
+        for season in ("2023", "2024"):
+            databases.append(os.path.join(env["test_dir"], season))
+            # The recordings of each season are stored below the same root
+            _create_search_database(databases[-1], rng, f"{season}.wav")
+            audio.save_signal(
+                np.zeros(48000 * 30, np.float32),
+                os.path.join(env["input_dir"], f"{season}.wav"),
+                48000,
+            )
+
+        query = os.path.join(env["test_dir"], "query.wav")
+        audio.save_signal(np.zeros(48000 * 5, np.float32), query, 48000)
+        mock_get_query_embeddings_array.side_effect = lambda sigs, **kwargs: (
+            rng.standard_normal((len(sigs), 16))
+        )
+
+        search(env["output_dir"], databases, env["input_dir"], query, n_results=6)
+
+        # The query is encoded once for both databases
+        mock_get_query_embeddings_array.assert_called_once()
+
+        with open(
+            os.path.join(env["output_dir"], RESULTS_TABLE_FILENAME), encoding="utf-8"
+        ) as f:
+            rows = list(csv.DictReader(f))
+
+        assert len(rows) == 6
+        scores = [float(row["Score"]) for row in rows]
+        assert scores == sorted(scores, reverse=True)
+        for row in rows:
+            season = os.path.basename(row["Database"])
+            assert row["File"] == f"{season}.wav"
+            assert row["Result"].split("_")[1] == season
+            assert os.path.isfile(os.path.join(env["output_dir"], row["Result"]))
+    finally:
+        shutil.rmtree(env["test_dir"])
+
+
+def test_search_rejects_databases_with_different_settings():
+    import numpy as np
+    import pytest
+
+    env = _make_test_environment()
+    try:
+        rng = np.random.default_rng(2)
+        databases = [os.path.join(env["test_dir"], name) for name in ("a", "b")]
+        _create_search_database(databases[0], rng)
+        _create_search_database(databases[1], rng, AUDIO_SPEED=2.0)
+
+        with pytest.raises(ValueError, match="AUDIO_SPEED"):
+            search(env["output_dir"], databases, env["input_dir"], "query.wav")
+    finally:
+        shutil.rmtree(env["test_dir"])
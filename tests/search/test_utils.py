@@ -1,18 +1,39 @@
 """Correctness and benchmark tests for the vectorized cosine_sim and
-euclidean_scoring functions in birdnet_analyzer.search.utils.
+euclidean_scoring functions and the batched brute-force search in
+birdnet_analyzer.search.utils.
 
 The reference implementations below are the exact originals that were
 replaced, kept here so the tests remain self-contained and do not depend
 on git history.
 """
 
+import os
+import time
 import timeit
+from unittest.mock import patch
 
 import numpy as np
 import pytest
+import soundfile as sf
+from perch_hoplite.db import brutalism
 from scipy.spatial.distance import euclidean as scipy_euclidean
 
-from birdnet_analyzer.search.utils import cosine_sim, euclidean_scoring
+from birdnet_analyzer import audio
+from birdnet_analyzer.embeddings.core import _ensure_deployment, get_or_create_database
+from birdnet_analyzer.search.utils import (
+    _prefetched,
+    batched_brute_search,
+    brute_search_block_size,
+    cosine_sim,
+    euclidean_scoring,
+    euclidean_scoring_inverse,
+    export_windows,
+    get_batch_search_results,
+    get_federated_search_results,
+    get_search_results,
+    search_databases,
+    search_query_embeddings,
+)
 
 # ---------------------------------------------------------------------------
 # Reference implementations (original loop-based code)
@@ -33,6 +54,56 @@ def _euclidean_scoring_ref(data: np.ndarray, query: np.ndarray):
     return scipy_euclidean(data, query)
 
 
+def _search_ref(db, query_embeddings, n_results, score_function):
+    """The original per-crop search of get_search_results, merged through dicts."""
+    score_fn = {
+        "cosine": cosine_sim,
+        "dot": np.dot,
+        "euclidean": euclidean_scoring_inverse,
+    }[score_function]
+    scores_by_embedding_id = {}
+
+    for embedding in query_embeddings:
+        sorted_results = brutalism.threaded_brute_search(
+            db, embedding, n_results, score_fn
+        ).search_results
+
+        if score_function == "euclidean":
+            for result in sorted_results:
+                result.sort_score *= -1
+
+        for result in sorted_results:
+            scores_by_embedding_id.setdefault(result.window_id, []).append(
+                result.sort_score
+            )
+
+    results = [
+        (window_id, np.sum(scores) / len(query_embeddings))
+        for window_id, scores in scores_by_embedding_id.items()
+    ]
+    results.sort(key=lambda x: x[1], reverse=score_function != "euclidean")
+
+    return results[:n_results]
+
+
+def _create_database(path, embeddings):
+    db = get_or_create_database(path, embedding_dim=embeddings.shape[1])
+    recording_id = db.insert_recording(
+        filename="a.wav", deployment_id=_ensure_deployment(db)
+    )
+    db.insert_windows_batch(
+        windows_batch=[
+            {"recording_id": recording_id, "offsets": [i * 3.0, i * 3.0 + 3.0]}
+            for i in range(len(embeddings))
+        ],
+        embeddings_batch=embeddings,
+        handle_duplicates="allow",
+    )
+    db.commit()
+
+    return db
+
+
 # ---------------------------------------------------------------------------
 # Fixtures
 # ---------------------------------------------------------------------------
@@ -153,6 +224,265 @@ class TestEuclideanScoring:
         np.testing.assert_allclose(result_2d, [result_1d], rtol=1e-6)
 
 
+# ---------------------------------------------------------------------------
+# Correctness: batched brute-force search
+# ---------------------------------------------------------------------------
+
+
+@pytest.fixture(scope="module")
+def search_database(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((1000, 32)).astype(np.float16)
+    db = _create_database(str(tmp_path_factory.mktemp("db") / "db"), embeddings)
+    yield db, embeddings.astype(np.float32)
+    db.db.close()
+
+
+@pytest.mark.parametrize("score_function", ["cosine", "dot", "euclidean"])
+def test_batched_brute_search_matches_per_query_search(search_database, score_function):
+    db, embeddings = search_database
+    queries = np.random.default_rng(1).standard_normal((4, 32)).astype(np.float32)
+    score_fn = {
+        "cosine": cosine_sim,
+        "dot": np.dot,
+        "euclidean": euclidean_scoring_inverse,
+    }[score_function]
+
+    # Blocks smaller than the database, not aligned with it, merge the top-k
+    window_ids, scores = batched_brute_search(
+        db, queries, 10, score_function, block_size=300
+    )
+
+    assert window_ids.shape == scores.shape == (4, 10)
+    for query, ids, query_scores in zip(queries, window_ids, scores, strict=True):
+        exact = score_fn(embeddings, query)
+        np.testing.assert_array_equal(ids, np.argsort(-exact, kind="stable")[:10] + 1)
+        np.testing.assert_allclose(query_scores, exact[ids - 1], rtol=1e-4)
+
+
+@pytest.mark.parametrize("score_function", ["cosine", "euclidean"])
+@pytest.mark.parametrize("n_crops", [1, 5])
+def test_get_search_results_merges_crops_like_before(
+    search_database, score_function, n_crops
+):
+    db, _ = search_database
+    queries = np.random.default_rng(2).standard_normal((n_crops, 32))
+
+    with patch(
+        "birdnet_analyzer.search.utils.get_query_embedding", return_value=queries
+    ):
+        results = get_search_results("query.wav", db, 10, score_function=score_function)
+
+    expected = _search_ref(db, queries, 10, score_function)
+    assert [r.window_id for r in results] == [e[0] for e in expected]
+    # The reference takes the norms of the float16 vectors in float16
+    np.testing.assert_allclose(
+        [r.sort_score for r in results], [e[1] for e in expected], rtol=1e-3
+    )
+
+
+def test_batched_brute_search_with_fewer_embeddings_than_results(search_database):
+    db, _ = search_database
+
+    window_ids, _ = batched_brute_search(
+        db, np.ones((2, 32)), 5000, "cosine", block_size=256
+    )
+
+    assert window_ids.shape == (2, 1000)
+    assert set(window_ids[0]) == set(range(1, 1001))
+
+
+@pytest.mark.parametrize("score_function", ["cosine", "euclidean"])
+def test_batched_brute_search_within_a_memory_budget(search_database, score_function):
+    db, _ = search_database
+    queries = np.random.default_rng(3).standard_normal((4, 32)).astype(np.float32)
+
+    # 0.1 MiB holds blocks of a few hundred embeddings
+    assert brute_search_block_size(32, 4, 0.1) < 1000
+    ids, scores = batched_brute_search(
+        db, queries, 10, score_function, memory_budget_mb=0.1
+    )
+    expected_ids, expected_scores = batched_brute_search(
+        db, queries, 10, score_function
+    )
+
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+
+
+def test_brute_search_block_size_shrinks_with_the_budget():
+    sizes = [brute_search_block_size(1024, 10, mb) for mb in (1, 64, 1024)]
+
+    assert sizes == sorted(sizes)
+    assert 3 * 64 * 2**20 // (1024 * 4) > sizes[1] > 64 * 2**20 // (4 * 1024 * 4)
+    assert brute_search_block_size(1024, 10, 0) == 1
+
+
+def test_prefetched_keeps_the_order_and_raises_errors():
+    def items():
+        yield from range(5)
+        raise ValueError("broken")
+
+    seen = []
+
+    with pytest.raises(ValueError, match="broken"):
+        seen.extend(_prefetched(items()))
+
+    assert seen == list(range(5))
+
+
+def test_prefetched_closes_the_items_when_stopped():
+    closed = []
+
+    def items():
+        try:
+            yield from range(100)
+        finally:
+            closed.append(True)
+
+    prefetched = _prefetched(items(), depth=2)
+    assert next(prefetched) == 0
+    prefetched.close()
+
+    assert closed == [True]
+
+
+@pytest.mark.parametrize("score_function", ["cosine", "dot", "euclidean"])
+def test_search_query_embeddings_matches_one_search_per_query(
+    search_database, score_function
+):
+    db, _ = search_database
+    rng = np.random.default_rng(3)
+    queries = [rng.standard_normal((n_crops, 32)) for n_crops in (1, 3, 2)]
+
+    results = search_query_embeddings(db, queries, 10, score_function)
+
+    assert len(results) == 3
+    for query, query_results in zip(queries, results, strict=True):
+        with patch(
+            "birdnet_analyzer.search.utils.get_query_embedding", return_value=query
+        ):
+            expected = get_search_results(
+                "query.wav", db, 10, score_function=score_function
+            )
+
+        assert [r.window_id for r in query_results] == [e.window_id for e in expected]
+        np.testing.assert_allclose(
+            [r.sort_score for r in query_results],
+            [e.sort_score for e in expected],
+            rtol=1e-6,
+        )
+
+
+def test_batch_search_encodes_all_queries_at_once(search_database):
+    db, _ = search_database
+    crops = {"a.wav": 1, "b.wav": 3, "c.wav": 2}
+
+    def signals(path, **kwargs):
+        return [np.zeros(10)] * crops[path]
+
+    def encode(sigs, **kwargs):
+        return np.random.default_rng(len(sigs)).standard_normal((len(sigs), 32))
+
+    with (
+        patch("birdnet_analyzer.search.utils.get_query_signals", side_effect=signals),
+        patch(
+            "birdnet_analyzer.model_utils.get_query_embeddings_array",
+            side_effect=encode,
+        ) as get_query_embeddings_array,
+    ):
+        results = get_batch_search_results(list(crops), db, 5, version="3.0")
+
+    get_query_embeddings_array.assert_called_once()
+    (sigs,), kwargs = get_query_embeddings_array.call_args
+    assert len(sigs) == 6
+    assert kwargs["version"] == "3.0"
+    assert [len(r) for r in results] == [5, 5, 5]
+
+
+@pytest.mark.parametrize("score_function", ["cosine", "dot", "euclidean"])
+def test_search_databases_matches_one_combined_database(tmp_path, score_function):
+    rng = np.random.default_rng(6)
+    embeddings = rng.standard_normal((600, 32)).astype(np.float16)
+    parts = [embeddings[:250], embeddings[250:]]
+    dbs = [
+        _create_database(str(tmp_path / f"db{i}"), part) for i, part in enumerate(parts)
+    ]
+    combined = _create_database(str(tmp_path / "combined"), embeddings)
+    queries = [rng.standard_normal((1, 32)).astype(np.float32) for _ in range(3)]
+
+    with patch(
+        "birdnet_analyzer.search.utils.search_query_embeddings",
+        side_effect=search_query_embeddings,
+    ) as searched:
+        results = search_databases(dbs, queries, 10, score_function)
+
+    assert searched.call_count == 2
+    expected = search_query_embeddings(combined, queries, 10, score_function)
+    for query_results, query_expected in zip(results, expected, strict=True):
+        # Window ids of the second database follow those of the first
+        assert [r.window_id + 250 * i for i, r in query_results] == [
+            r.window_id for r in query_expected
+        ]
+        np.testing.assert_allclose(
+            [r.sort_score for _, r in query_results],
+            [r.sort_score for r in query_expected],
+            rtol=1e-5,
+        )
+
+    for db in [*dbs, combined]:
+        db.db.close()
+
+
+def _export_ref(windows, speed=1.0):
+    """The original export, decoding the source once per window."""
+    for path, offset, duration, dest in windows:
+        sig, rate = audio.open_audio_file(
+            path, offset=offset, duration=duration, sample_rate=None, speed=speed
+        )
+        audio.save_signal(sig, dest, rate)
+
+
+def _export_windows(tmp_path, n_files, n_windows, seconds=60.0, ext="wav"):
+    rng = np.random.default_rng(5)
+    t = np.arange(int(seconds * 22050)) / 22050
+    windows = []
+
+    for i in range(n_files):
+        path = str(tmp_path / f"source_{i}.{ext}")
+        sf.write(path, 0.5 * np.sin(2 * np.pi * (440 + 100 * i) * t), 22050)
+        windows.extend(
+            (path, float(offset), 3.0, f"{i}_{j}.wav")
+            for j, offset in enumerate(rng.uniform(0, seconds - 3, n_windows))
+        )
+
+    return windows
+
+
+def test_export_windows_reads_each_file_once(tmp_path):
+    windows = _export_windows(tmp_path, 3, 5)
+    (tmp_path / "new").mkdir()
+    (tmp_path / "ref").mkdir()
+
+    with patch.object(audio, "read_windows", side_effect=audio.read_windows) as read:
+        export_windows(
+            [(p, o, d, str(tmp_path / "new" / dest)) for p, o, d, dest in windows],
+            speed=1.5,
+        )
+    _export_ref(
+        [(p, o, d, str(tmp_path / "ref" / dest)) for p, o, d, dest in windows],
+        speed=1.5,
+    )
+
+    assert read.call_count == 3
+    assert sorted(os.listdir(tmp_path / "new")) == sorted(os.listdir(tmp_path / "ref"))
+    for name in os.listdir(tmp_path / "ref"):
+        new, new_rate = sf.read(tmp_path / "new" / name)
+        ref, ref_rate = sf.read(tmp_path / "ref" / name)
+        assert new_rate == ref_rate == int(22050 * 1.5)
+        np.testing.assert_array_equal(new, ref)
+
+
 # ---------------------------------------------------------------------------
 # Benchmarks
 # ---------------------------------------------------------------------------
@@ -203,3 +533,149 @@ def test_benchmark_euclidean_scoring(capsys):
         f"Vectorized euclidean_scoring ({t_new * 1000:.2f}ms) should be faster than "
         f"loop-based reference ({t_ref * 1000:.2f}ms)"
     )
+
+
+@pytest.fixture(scope="module")
+def bench_database(tmp_path_factory):
+    embeddings = RNG.standard_normal((BENCH_ROWS, BENCH_DIM)).astype(np.float16)
+    db = _create_database(str(tmp_path_factory.mktemp("db") / "db"), embeddings)
+    yield db
+    db.db.close()
+
+
+@pytest.mark.parametrize("n_crops", [1, 10, 100])
+def test_benchmark_multi_crop_search(bench_database, capsys, n_crops):
+    queries = RNG.standard_normal((n_crops, BENCH_DIM)).astype(np.float32)
+
+    def run():
+        with patch(
+            "birdnet_analyzer.search.utils.get_query_embedding", return_value=queries
+        ):
+            return get_search_results("query.wav", bench_database, 10)
+
+    number = 1 if n_crops == 100 else 3
+    t_new = _time(run, number=number, repeat=3)
+    t_ref = _time(
+        _search_ref, bench_database, queries, 10, "cosine", number=1, repeat=1
+    )
+
+    with capsys.disabled():
+        print(
+            f"\nmulti-crop search ({BENCH_ROWS}x{BENCH_DIM}, {n_crops} crops): "
+            f"new={t_new * 1000:.2f}ms  ref={t_ref * 1000:.2f}ms  "
+            f"speedup={t_ref / t_new:.1f}x"
+        )
+
+    assert t_new < t_ref, (
+        f"Batched search ({t_new * 1000:.2f}ms) should be faster than one brute "
+        f"search per crop ({t_ref * 1000:.2f}ms)"
+    )
+
+
+@pytest.mark.parametrize("n_queries", [10, 100])
+def test_benchmark_batch_query_search(bench_database, capsys, n_queries):
+    queries = [
+        RNG.standard_normal((1, BENCH_DIM)).astype(np.float32) for _ in range(n_queries)
+    ]
+
+    def run_ref():
+        return [search_query_embeddings(bench_database, [q], 10)[0] for q in queries]
+
+    t_new = _time(search_query_embeddings, bench_database, queries, 10, repeat=3)
+    t_ref = _time(run_ref, number=1, repeat=3)
+
+    for results, expected in zip(
+        search_query_embeddings(bench_database, queries, 10), run_ref(), strict=True
+    ):
+        assert [r.window_id for r in results] == [e.window_id for e in expected]
+
+    with capsys.disabled():
+        print(
+            f"\nbatch query search ({BENCH_ROWS}x{BENCH_DIM}, {n_queries} queries): "
+            f"new={t_new * 1000:.2f}ms  ref={t_ref * 1000:.2f}ms  "
+            f"speedup={t_ref / t_new:.1f}x"
+        )
+
+    assert t_new < t_ref, (
+        f"Searching all queries at once ({t_new * 1000:.2f}ms) should be faster "
+        f"than one search per query ({t_ref * 1000:.2f}ms)"
+    )
+
+
+def test_benchmark_export_windows(tmp_path, capsys):
+    # Compressed recordings, whose windows cost a decode from their start each
+    windows = _export_windows(tmp_path, 2, 50, seconds=300.0, ext="mp3")
+
+    def run(fn, folder):
+        (tmp_path / folder).mkdir(exist_ok=True)
+        fn([(p, o, d, str(tmp_path / folder / dest)) for p, o, d, dest in windows])
+
+    t_new = _time(run, export_windows, "new", number=1, repeat=3)
+    t_ref = _time(run, _export_ref, "ref", number=1, repeat=3)
+
+    with capsys.disabled():
+        print(
+            f"\nexport ({len(windows)} windows from 2 mp3 files): "
+            f"new={t_new * 1000:.2f}ms  ref={t_ref * 1000:.2f}ms  "
+            f"speedup={t_ref / t_new:.1f}x"
+        )
+
+    assert t_new < t_ref, (
+        f"Grouped export ({t_new * 1000:.2f}ms) should be faster than opening the "
+        f"file per window ({t_ref * 1000:.2f}ms)"
+    )
+
+
+def test_benchmark_federated_search(tmp_path, capsys):
+    # Encoding the query dominates a search of small databases; the stand-in
+    # costs about as much as running the model on a few crops.
+    rng = np.random.default_rng(8)
+    dbs = [
+        _create_database(
+            str(tmp_path / f"db{i}"),
+            rng.standard_normal((2000, 256)).astype(np.float16),
+        )
+        for i in range(4)
+    ]
+    query = str(tmp_path / "query.wav")
+    audio.save_signal(np.zeros(48000 * 9, np.float32), query, 48000)
+
+    def encode(signals, **kwargs):
+        time.sleep(0.02)
+        return np.random.default_rng(len(signals)).standard_normal((len(signals), 256))
+
+    def run_ref():
+        # One birdnet-search per database, merged by hand
+        results = [
+            (i, r)
+            for i, db in enumerate(dbs)
+            for r in get_batch_search_results([query], db, 10, crop_mode="segments")[0]
+        ]
+        return sorted(results, key=lambda item: -item[1].sort_score)[:10]
+
+    def run():
+        return get_federated_search_results([query], dbs, 10, crop_mode="segments")[0]
+
+    with patch(
+        "birdnet_analyzer.model_utils.get_query_embeddings_array", side_effect=encode
+    ):
+        assert [(i, r.window_id) for i, r in run()] == [
+            (i, r.window_id) for i, r in run_ref()
+        ]
+        t_new = _time(run, number=3, repeat=3)
+        t_ref = _time(run_ref, number=3, repeat=3)
+
+    with capsys.disabled():
+        print(
+            f"\nfederated search (4 databases of 2000x256): "
+            f"new={t_new * 1000:.2f}ms  ref={t_ref * 1000:.2f}ms  "
+            f"speedup={t_ref / t_new:.1f}x"
+        )
+
+    for db in dbs:
+        db.db.close()
+
+    assert t_new < t_ref, (
+        f"Searching all databases with one encoding ({t_new * 1000:.2f}ms) should "
+        f"be faster than one search per database ({t_ref * 1000:.2f}ms)"
+    )
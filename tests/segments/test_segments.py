@@ -140,3 +140,48 @@ def test_segments_cli_accepts_full_parser_surface(
     assert parse_files_kwargs["min_conf"] == 0.15
     assert parse_files_kwargs["max_conf"] == 0.9
     mock_extract_segments.assert_called_once()
+
+
+def test_extract_segments_streams_file_once(tmp_path):
+    import numpy as np
+    import soundfile as sf
+
+    from birdnet_analyzer import audio
+    from birdnet_analyzer.segments.utils import extract_segments
+
+    sr = 48000
+    sig = np.random.default_rng(0).uniform(-0.5, 0.5, 130 * sr).astype("float32")
+    wav = tmp_path / "rec.wav"
+    sf.write(wav, sig, sr)
+    segs = [
+        # Spans the boundary between the first two streamed chunks
+        {"start": 59.0, "end": 62.0, "species": "sp1", "confidence": 0.9},
+        {"start": 10.0, "end": 11.0, "species": "sp2", "confidence": 0.8},
+        # Runs past the end of the file
+        {"start": 128.5, "end": 131.5, "species": "sp1", "confidence": 0.7},
+        # Starts after the end of the file
+        {"start": 140.0, "end": 143.0, "species": "sp2", "confidence": 0.6},
+    ]
+
+    with patch.object(audio, "open_audio_file") as mock_open_audio_file:
+        result = extract_segments(str(wav), str(tmp_path), 3.0, segs, sr)
+
+    assert result == (str(wav), True)
+    mock_open_audio_file.assert_not_called()
+
+    # The written files are PCM_16, compare at that resolution
+    expected = {
+        "sp1/0.900_1_rec_59.00s_62.00s.wav": sig[59 * sr : 62 * sr],
+        "sp2/0.800_2_rec_10.00s_11.00s.wav": sig[9 * sr : 12 * sr],
+        "sp1/0.700_3_rec_128.50s_131.50s.wav": sig[int(128.5 * sr) :],
+    }
+    written = sorted(
+        str(p.relative_to(tmp_path)).replace(os.sep, "/")
+        for p in tmp_path.glob("sp*/*.wav")
+    )
+    assert written == sorted(expected)
+
+    for name, ref in expected.items():
+        data, rate = sf.read(tmp_path / name, dtype="float32")
+        assert rate == sr
+        np.testing.assert_allclose(data, ref, atol=1e-4)
@@ -0,0 +1,443 @@
+"""Tests for the signal helpers in birdnet_analyzer.audio."""
+
+import timeit
+
+import numpy as np
+import pytest
+import soundfile as sf
+from scipy.signal import butter, find_peaks, lfilter, resample_poly
+
+from birdnet_analyzer import audio
+
+SR = 48000
+RNG = np.random.default_rng(42)
+
+
+# ---------------------------------------------------------------------------
+# Bandpass
+# ---------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    ("fmin", "fmax", "btype", "wn"),
+    [
+        (500, 15000, "high", 500 / 24000),
+        (0, 8000, "low", 8000 / 24000),
+        (500, 8000, "band", [500 / 24000, 8000 / 24000]),
+    ],
+)
+def test_bandpass_matches_transfer_function_form(fmin, fmax, btype, wn):
+    sig = RNG.standard_normal(SR).astype("float32")
+    b, a = butter(5, wn, btype=btype)
+    expected = lfilter(b, a, sig).astype("float32")
+
+    result = audio.bandpass(sig, SR, fmin, fmax)
+
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, expected, atol=1e-4)
+
+
+def test_bandpass_without_filter_returns_input():
+    sig = RNG.standard_normal(100)
+
+    assert audio.bandpass(sig, SR, 0, 15000) is sig
+    assert audio.bandpass(sig, SR, 5000, 1000) is sig
+
+
+def test_bandpass_outside_the_signal_range_returns_float32():
+    sig = RNG.standard_normal(100)
+
+    result = audio.bandpass(sig, SR, 0, 15000, sig_fmin=100)
+
+    assert result.dtype == np.float32
+    np.testing.assert_array_equal(result, sig.astype("float32"))
+
+
+def test_bandpass_filter_design_is_cached():
+    audio._butter_sos.cache_clear()
+    sig = RNG.standard_normal(1000).astype("float32")
+
+    audio.bandpass(sig, SR, 500, 8000)
+    audio.bandpass(sig, SR, 500, 8000)
+
+    info = audio._butter_sos.cache_info()
+    assert info.misses == 1
+    assert info.hits == 1
+
+
+# ---------------------------------------------------------------------------
+# Resampling
+# ---------------------------------------------------------------------------
+
+
+def _two_tone(rate, seconds=3.0):
+    t = np.arange(int(seconds * rate)) / rate
+    return 0.5 * np.sin(2 * np.pi * 1000 * t) + 0.3 * np.sin(2 * np.pi * 9000 * t)
+
+
+# Worst absolute error against the analytic signal, away from the edges.
+RESAMPLER_TOLERANCE = {
+    "soxr_vhq": 1e-6,
+    "soxr_hq": 1e-5,
+    "soxr_mq": 1e-4,
+    "soxr_lq": 1e-4,
+    "soxr_qq": 5e-2,
+    "polyphase": 1e-3,
+}
+
+
+@pytest.mark.parametrize("resampler", audio.RESAMPLERS)
+@pytest.mark.parametrize("orig_sr", [44100, 32000, 96000])
+def test_resample_accuracy(resampler, orig_sr):
+    sig = _two_tone(orig_sr).astype("float32")
+
+    result = audio.resample(sig, orig_sr, SR, resampler)
+
+    expected = _two_tone(SR)
+    assert result.dtype == np.float32
+    assert result.size == expected.size
+    err = np.abs(result - expected)[1000:-1000].max()
+    assert err < RESAMPLER_TOLERANCE[resampler]
+
+
+def test_resample_polyphase_matches_scipy():
+    sig = RNG.standard_normal(44100).astype("float32")
+
+    result = audio.resample(sig, 44100, SR, "polyphase")
+
+    np.testing.assert_allclose(result, resample_poly(sig, 160, 147), atol=1e-5)
+
+
+def test_resample_rejects_unknown_resampler():
+    with pytest.raises(ValueError, match="Unknown resampler"):
+        audio.resample(np.zeros(10), 44100, SR, "kaiser_fast")
+
+
+def test_open_audio_file_resamples_speed_in_one_step(tmp_path):
+    path = tmp_path / "44k.wav"
+    sig = _two_tone(44100).astype("float32")
+    sf.write(path, sig, 44100)
+    native, _ = sf.read(path, dtype="float32")
+
+    result, rate = audio.open_audio_file(str(path), SR, speed=2.0)
+
+    assert rate == SR
+    np.testing.assert_array_equal(result, audio.resample(native, 88200, SR))
+
+
+def _split_signal_ref(sig, rate, seconds=3.0, overlap=0.0, minlen=1.0):
+    """The original list-based split_signal, padding with zeros."""
+    chunksize = int(rate * seconds)
+    stepsize = int(rate * (seconds - overlap))
+    minsize = int(rate * minlen)
+
+    lastchunkpos = int((sig.size - chunksize + stepsize - 1) / stepsize) * stepsize
+    if lastchunkpos < 0:
+        lastchunkpos = 0
+    elif sig.size - lastchunkpos < minsize:
+        lastchunkpos = lastchunkpos - stepsize
+
+    data = np.concatenate((sig, np.zeros(shape=chunksize, dtype=sig.dtype)))
+
+    return [data[i : i + chunksize] for i in range(0, lastchunkpos + 1, stepsize)]
+
+
+@pytest.mark.parametrize("duration", [0.4, 1.0, 2.5, 3.0, 5.0, 9.0, 10.7])
+@pytest.mark.parametrize("overlap", [0.0, 0.5, 1.5, 2.9])
+@pytest.mark.parametrize("minlen", [1.0, 3.0])
+def test_split_signal_matches_reference(duration, overlap, minlen):
+    rate = 1000
+    sig = RNG.standard_normal(int(duration * rate)).astype("float32")
+
+    result = audio.split_signal(sig, rate, 3.0, overlap, minlen)
+    expected = _split_signal_ref(sig, rate, 3.0, overlap, minlen)
+
+    assert result.shape == (len(expected), 3 * rate)
+    assert result.dtype == np.float32
+    for split, ref in zip(result, expected, strict=True):
+        np.testing.assert_array_equal(split, ref)
+
+
+def test_split_signal_does_not_copy_when_no_padding_is_needed():
+    sig = RNG.standard_normal(9 * SR).astype("float32")
+
+    splits = audio.split_signal(sig, SR, 3.0, 1.0)
+
+    assert np.shares_memory(splits, sig)
+
+
+def test_split_signal_pads_tail_with_noise():
+    sig = np.ones(4 * SR, dtype="float32")
+
+    splits = audio.split_signal(sig, SR, 3.0, 0.0, use_noise_for_padding=True)
+
+    assert splits.shape == (2, 3 * SR)
+    np.testing.assert_array_equal(splits[1, :SR], 1.0)
+    assert np.any(splits[1, SR:] != 0)
+
+
+# ---------------------------------------------------------------------------
+# Smart crop
+# ---------------------------------------------------------------------------
+
+
+def _smart_crop_signal_ref(sig, rate, sig_length, sig_overlap, sig_minlen):
+    """The original loop-based smart_crop_signal."""
+    if len(sig) / rate <= sig_length:
+        return [sig]
+
+    splits = list(audio.split_signal(sig, rate, sig_length, sig_overlap, sig_minlen))
+
+    if len(splits) <= 1:
+        return splits
+
+    energies = []
+    for split in splits:
+        energy = np.sqrt(np.mean(split**2))
+        peak = np.max(np.abs(split))
+        energies.append(energy * 0.7 + peak * 0.3)
+
+    smoothed_energies = np.convolve(energies, np.ones(3) / 3, mode="same")
+    peaks, _ = find_peaks(
+        smoothed_energies, height=np.mean(smoothed_energies), distance=2
+    )
+
+    if len(peaks) < 2:
+        num_segments = max(3, len(splits) // 3)
+        indices = np.argsort(energies)[-num_segments:]
+        return [splits[i] for i in sorted(indices)]
+
+    peak_splits = [splits[i] for i in peaks]
+
+    if len(peak_splits) > 5:
+        peak_energies = [energies[i] for i in peaks]
+        sorted_indices = np.argsort(peak_energies)[::-1]
+        peak_splits = [peak_splits[i] for i in sorted_indices[:5]]
+
+    return peak_splits
+
+
+def _bursty_signal(duration, rate, n_bursts, seed=0):
+    """Low-level noise with loud sine bursts, like calls in a field recording."""
+    rng = np.random.default_rng(seed)
+    sig = 0.01 * rng.standard_normal(int(duration * rate))
+    for start in rng.uniform(0, duration - 1, n_bursts):
+        t = np.arange(int(0.5 * rate)) / rate
+        i = int(start * rate)
+        sig[i : i + t.size] += rng.uniform(0.2, 0.8) * np.sin(2 * np.pi * 3000 * t)
+    return sig.astype("float32")
+
+
+@pytest.mark.parametrize(
+    ("duration", "n_bursts", "overlap"),
+    [
+        (2.0, 0, 0.0),
+        (10.0, 0, 0.0),
+        (30.0, 3, 0.0),
+        (60.0, 12, 1.5),
+        (60.0, 12, 0.37),
+        (90.0, 30, 2.0),
+    ],
+)
+def test_smart_crop_signal_matches_reference(duration, n_bursts, overlap):
+    sig = _bursty_signal(duration, SR, n_bursts)
+
+    result = audio.smart_crop_signal(sig, SR, 3.0, overlap, 1.0)
+    expected = _smart_crop_signal_ref(sig, SR, 3.0, overlap, 1.0)
+
+    assert len(result) == len(expected)
+    for split, ref in zip(result, expected, strict=True):
+        np.testing.assert_array_equal(split, ref)
+
+
+def test_smart_crop_signal_weights_select_loudest_window():
+    rate = 1000
+    sig = np.zeros(30 * rate, dtype="float32")
+    # One window has a single loud click, another a long but quiet tone
+    sig[4500] = 1.0
+    sig[21000:24000] = 0.3
+
+    by_rms = audio.smart_crop_signal(sig, rate, 3.0, 0.0, 1.0, 1.0, 0.0, 1)
+    by_peak = audio.smart_crop_signal(sig, rate, 3.0, 0.0, 1.0, 0.0, 1.0, 1)
+
+    assert any(np.all(split == 0.3) for split in by_rms)
+    assert any(split.max() == 1.0 for split in by_peak)
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+BENCH_DURATION = 600.0
+BENCH_OVERLAP = 1.5
+BENCH_REPEATS = 3
+BENCH_NUMBER = 3
+BENCH_QUERY_S = 3.0
+
+
+def _time(fn, *args, number=BENCH_NUMBER, repeat=BENCH_REPEATS) -> float:
+    """Return best-of-repeat wall time in seconds for `number` calls."""
+    return min(timeit.repeat(lambda: fn(*args), number=number, repeat=repeat)) / number
+
+
+def test_benchmark_resamplers(capsys):
+    sig = _two_tone(44100, BENCH_QUERY_S).astype("float32")
+    expected = _two_tone(SR, BENCH_QUERY_S)
+
+    with capsys.disabled():
+        print(f"\nresample ({BENCH_QUERY_S:.0f}s, 44100 -> {SR} Hz):")
+
+        for resampler in audio.RESAMPLERS:
+            t = _time(audio.resample, sig, 44100, SR, resampler)
+            err = np.abs(audio.resample(sig, 44100, SR, resampler) - expected)
+            print(
+                f"  {resampler:<10} {t * 1000:7.2f}ms  "
+                f"max error={err[1000:-1000].max():.1e}"
+            )
+
+    t_cached = _time(audio.resample, sig, 44100, SR, "polyphase")
+    t_ref = _time(resample_poly, sig, 160, 147)
+
+    with capsys.disabled():
+        print(
+            f"  polyphase cached={t_cached * 1000:.2f}ms  "
+            f"scipy={t_ref * 1000:.2f}ms  speedup={t_ref / t_cached:.1f}x"
+        )
+
+    assert t_cached < t_ref, (
+        f"Polyphase with cached filter ({t_cached * 1000:.2f}ms) should be faster "
+        f"than designing the filter on every call ({t_ref * 1000:.2f}ms)"
+    )
+
+
+def test_benchmark_smart_crop_signal(capsys):
+    args = (_bursty_signal(BENCH_DURATION, SR, 60), SR, 3.0, BENCH_OVERLAP, 1.0)
+    t_new = _time(audio.smart_crop_signal, *args)
+    t_ref = _time(_smart_crop_signal_ref, *args)
+
+    with capsys.disabled():
+        print(
+            f"\nsmart_crop_signal ({BENCH_DURATION:.0f}s at {SR} Hz): "
+            f"new={t_new * 1000:.2f}ms  ref={t_ref * 1000:.2f}ms  "
+            f"speedup={t_ref / t_new:.1f}x"
+        )
+
+    assert t_new < t_ref, (
+        f"Vectorized smart_crop_signal ({t_new * 1000:.2f}ms) should be faster than "
+        f"loop-based reference ({t_ref * 1000:.2f}ms)"
+    )
+
+
+# ---------------------------------------------------------------------------
+# Streaming
+# ---------------------------------------------------------------------------
+
+
+@pytest.fixture
+def long_wav(tmp_path):
+    """A 100 s noisy wav at 48 kHz with a few loud bursts."""
+    path = tmp_path / "long.wav"
+    sf.write(path, _bursty_signal(100.0, SR, 8, seed=1), SR)
+    return str(path)
+
+
+@pytest.mark.parametrize(("fmin", "fmax"), [(None, None), (500, 8000)])
+def test_iter_chunks_is_continuous(long_wav, fmin, fmax):
+    sig, _ = audio.open_audio_file(long_wav, SR, fmin=fmin, fmax=fmax)
+
+    chunks = list(audio.iter_chunks(long_wav, 30.0, 0.0, SR, fmin=fmin, fmax=fmax))
+
+    assert [len(c) for c in chunks] == [30 * SR, 30 * SR, 30 * SR, 10 * SR]
+    np.testing.assert_allclose(np.concatenate(chunks), sig, atol=1e-6)
+
+
+def test_iter_chunks_overlap(long_wav):
+    sig, _ = audio.open_audio_file(long_wav, SR)
+
+    chunks = list(audio.iter_chunks(long_wav, 30.0, 5.0, SR))
+
+    for i, chunk in enumerate(chunks):
+        start = i * 25 * SR
+        np.testing.assert_array_equal(chunk, sig[start : start + 30 * SR])
+    assert len(chunks) == 4
+
+
+def test_iter_chunks_resamples_continuously(tmp_path):
+    import soxr
+
+    path = tmp_path / "44k.wav"
+    sig = _bursty_signal(20.0, 44100, 4)
+    sf.write(path, sig, 44100)
+
+    chunks = list(audio.iter_chunks(str(path), 7.0, 0.0, SR))
+
+    expected = soxr.resample(sig, 44100, SR)
+    streamed = np.concatenate(chunks)
+    assert abs(streamed.size - expected.size) <= 1
+    n = min(streamed.size, expected.size)
+    np.testing.assert_allclose(streamed[:n], expected[:n], atol=1e-3)
+
+
+def test_iter_chunks_rejects_overlap_of_whole_chunk(long_wav):
+    with pytest.raises(ValueError, match="Overlap"):
+        next(audio.iter_chunks(long_wav, 3.0, 3.0))
+
+
+@pytest.mark.parametrize("overlap", [0.0, 1.5, 0.37])
+def test_smart_crop_file_streams_like_smart_crop_signal(long_wav, overlap):
+    sig, _ = audio.open_audio_file(long_wav, SR, fmin=500, fmax=8000)
+    expected = audio.smart_crop_signal(sig, SR, 3.0, overlap, 1.0)
+
+    result, rate = audio.smart_crop_file(
+        long_wav, SR, 3.0, overlap, 1.0, fmin=500, fmax=8000, max_buffer_s=20.0
+    )
+
+    assert rate == SR
+    assert len(result) == len(expected)
+    for split, ref in zip(result, expected, strict=True):
+        np.testing.assert_allclose(split, ref, atol=1e-6)
+
+
+@pytest.mark.parametrize("channels", [1, 2])
+@pytest.mark.parametrize("speed", [1.0, 1.5])
+def test_read_windows_matches_open_audio_file(tmp_path, channels, speed):
+    path = str(tmp_path / "stereo.wav")
+    sig = _bursty_signal(30.0, 44100, 4)
+    sf.write(path, np.stack([sig, sig[::-1]], axis=1)[:, :channels], 44100)
+    windows = [(12.0, 4.5), (0.0, 3.0), (3.3, 3.0), (28.5, 3.0)]
+
+    signals, rate = audio.read_windows(path, windows, speed=speed)
+
+    assert len(signals) == len(windows)
+    for sig_window, (offset, duration) in zip(signals, windows, strict=True):
+        expected, expected_rate = audio.open_audio_file(
+            path, sample_rate=None, offset=offset, duration=duration, speed=speed
+        )
+        assert rate == expected_rate
+        np.testing.assert_array_equal(sig_window, expected)
+
+
+def test_read_windows_decodes_other_formats_once(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+
+    path = str(tmp_path / "a.wav")
+    sf.write(path, _bursty_signal(10.0, SR, 2), SR)
+    windows = [(5.0, 3.0), (1.0, 3.0)]
+    expected, _ = audio.read_windows(path, windows)
+
+    def unreadable(*args, **kwargs):
+        raise sf.SoundFileRuntimeError("unsupported")
+
+    # Only for read_windows, librosa still reads the file with soundfile
+    monkeypatch.setattr(
+        audio,
+        "sf",
+        SimpleNamespace(
+            SoundFile=unreadable, SoundFileRuntimeError=sf.SoundFileRuntimeError
+        ),
+    )
+    signals, rate = audio.read_windows(path, windows)
+
+    assert rate == SR
+    for sig_window, ref in zip(signals, expected, strict=True):
+        np.testing.assert_array_equal(sig_window, ref)
@@ -0,0 +1,114 @@
+"""Tests for the persistent audio metadata index."""
+
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from birdnet_analyzer import audio, audio_index
+from birdnet_analyzer.audio_index import AudioIndex
+
+
+@pytest.fixture
+def wavs(tmp_path):
+    paths = []
+    for i, (rate, seconds) in enumerate([(48000, 2.0), (44100, 1.5), (22050, 3.0)]):
+        path = tmp_path / f"{i}.wav"
+        sf.write(path, np.zeros(int(rate * seconds), dtype="float32"), rate)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def count_probes(monkeypatch):
+    calls = []
+    probe = audio_index.probe_audio_info
+
+    def counting_probe(path):
+        calls.append(path)
+        return probe(path)
+
+    monkeypatch.setattr(audio_index, "probe_audio_info", counting_probe)
+    return calls
+
+
+def test_get_many_reads_headers(tmp_path, wavs):
+    index = AudioIndex(str(tmp_path / "index.sqlite"))
+
+    infos = index.get_many(wavs)
+
+    assert list(infos) == wavs
+    assert [info["samplerate"] for info in infos.values()] == [48000, 44100, 22050]
+    assert [info["duration"] for info in infos.values()] == [2.0, 1.5, 3.0]
+    assert all(info["channels"] == 1 for info in infos.values())
+    assert all(info["codec"] == "WAV/PCM_16" for info in infos.values())
+
+
+def test_index_persists_between_instances(tmp_path, wavs, count_probes):
+    db_path = str(tmp_path / "index.sqlite")
+    expected = AudioIndex(db_path).get_many(wavs)
+
+    infos = AudioIndex(db_path).get_many(wavs)
+
+    assert infos == expected
+    assert len(count_probes) == len(wavs)
+
+
+def test_index_of_an_earlier_schema_is_replaced(tmp_path, wavs, count_probes):
+    db_path = str(tmp_path / "index.sqlite")
+
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE audio_info (path TEXT PRIMARY KEY, size INTEGER, "
+            "mtime_ns INTEGER, samplerate INTEGER, channels INTEGER, duration REAL)"
+        )
+        conn.execute("PRAGMA user_version = 1")
+    conn.close()
+
+    assert AudioIndex(db_path).get(wavs[0])["codec"] == "WAV/PCM_16"
+    assert AudioIndex(db_path).get(wavs[0])["codec"] == "WAV/PCM_16"
+    assert count_probes == [wavs[0]]
+
+
+def test_changed_file_is_probed_again(tmp_path, wavs, count_probes):
+    index = AudioIndex(str(tmp_path / "index.sqlite"))
+    index.get_many(wavs)
+
+    sf.write(wavs[0], np.zeros(48000, dtype="float32"), 48000)
+    os.utime(wavs[0], ns=(0, 10**9))
+
+    assert index.get(wavs[0])["duration"] == 1.0
+    assert count_probes[len(wavs) :] == [wavs[0]]
+
+
+def test_unreadable_files(tmp_path, wavs):
+    broken = tmp_path / "broken.wav"
+    broken.write_bytes(b"not audio")
+    index = AudioIndex(None)
+    paths = [*wavs, str(broken), str(tmp_path / "missing.wav")]
+
+    infos = index.get_many(paths, ignore_errors=True)
+
+    assert list(infos) == wavs
+    with pytest.raises(Exception):  # noqa: B017, PT011
+        index.get(str(broken))
+
+
+def test_unwritable_location_falls_back_to_memory(tmp_path, wavs):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+
+    index = AudioIndex(str(blocker / "index.sqlite"))
+
+    assert index.get(wavs[0])["samplerate"] == 48000
+
+
+def test_shared_index_is_kept_in_the_temporary_directory(tmp_path, wavs):
+    index = audio_index.get_index()
+
+    assert index is audio_index.get_index()
+    assert index.db_path == str(tmp_path / "audio-index.sqlite")
+    assert audio.get_audio_info(wavs[0])["samplerate"] == 48000
+    assert os.path.exists(index.db_path)
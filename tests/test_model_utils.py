@@ -98,3 +98,254 @@ def test_run_inference_drops_sensitivity_for_3_0(monkeypatch, tmp_path):
 
     assert result == "result"
     assert seen["sigmoid_sensitivity"] == 1.0
+
+
+def test_plan_encoding_runs_bounds_padded_run_size():
+    durations = {f"{i}.wav": d for i, d in enumerate([30, 3, 300, 9, 3000, 6, 60])}
+    files = [*durations, "unknown.wav"]
+
+    runs = model_utils._plan_encoding_runs(files, durations, 3.0, max_segments=100)
+
+    assert runs[0] == ["unknown.wav"]
+    assert sorted(f for run in runs for f in run) == sorted(files)
+    for run in runs[1:]:
+        longest = max(durations[f] for f in run)
+        assert len(run) == 1 or len(run) * longest / 3.0 <= 100
+    # Short files of similar length share a run
+    assert ["1.wav", "5.wav", "3.wav", "0.wav", "6.wav"] in runs
+    assert ["4.wav"] in runs
+
+
+def test_encode_files_without_files_loads_no_model(monkeypatch):
+    def fail(version):
+        raise AssertionError("model loaded")
+
+    monkeypatch.setattr(model_utils, "_load_acoustic_for_embeddings", fail)
+
+    model_utils.encode_files([], lambda result: None)
+
+
+class FakeEncodingSession:
+    """Stands in for an AcousticEncodingSession, with a slow start like the real one."""
+
+    opened = 0
+    startup_s = 0.0
+
+    def __init__(self):
+        self.closed = False
+        self.cancelled = False
+        self.running = False
+        self.fail = False
+
+    def __enter__(self):
+        import time
+
+        time.sleep(self.startup_s)
+        FakeEncodingSession.opened += 1
+        return self
+
+    def __exit__(self, *args):
+        self.closed = True
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run_arrays(self, inputs):
+        from types import SimpleNamespace
+
+        import numpy as np
+
+        assert not self.running, "the session ran two queries at once"
+        assert not self.closed
+        assert not self.cancelled
+        if self.fail:
+            raise RuntimeError("Analysis was cancelled.")
+        self.running = True
+        embeddings = np.array([[[sig.sum()]] for sig, _ in inputs])
+        self.running = False
+        return SimpleNamespace(embeddings=embeddings)
+
+
+class FakeModel:
+    def __init__(self):
+        self.sessions = []
+
+    def encode_session(self, **kwargs):
+        self.sessions.append(FakeEncodingSession())
+        return self.sessions[-1]
+
+    def get_sample_rate(self):
+        return 48000
+
+
+def _fake_query_session(monkeypatch):
+    models = {}
+
+    def load(version):
+        return models.setdefault(version, FakeModel())
+
+    monkeypatch.setattr(model_utils, "_load_acoustic_for_embeddings", load)
+    monkeypatch.setattr(model_utils, "_QUERY_SESSION", model_utils._QuerySession())
+    return models
+
+
+def test_query_session_is_reused_until_the_version_changes(monkeypatch):
+    import numpy as np
+
+    models = _fake_query_session(monkeypatch)
+
+    embeddings = model_utils.get_query_embeddings_array([np.ones(3), np.ones(2)])
+    model_utils.get_query_embeddings_array([np.ones(1)])
+
+    assert embeddings.tolist() == [[3.0], [2.0]]
+    assert len(models["2.4"].sessions) == 1
+
+    model_utils.get_query_embeddings_array([np.ones(1)], version="3.0")
+
+    assert models["2.4"].sessions[0].closed
+    assert len(models["3.0"].sessions) == 1
+
+    model_utils.close_query_session()
+    assert models["3.0"].sessions[0].closed
+
+
+def test_query_session_closes_when_idle(monkeypatch):
+    import time
+
+    import numpy as np
+
+    models = _fake_query_session(monkeypatch)
+    monkeypatch.setattr(model_utils, "QUERY_SESSION_IDLE_TIMEOUT_S", 0.05)
+
+    model_utils.get_query_embeddings_array([np.ones(1)])
+    session = models["2.4"].sessions[0]
+    time.sleep(0.2)
+
+    assert session.closed
+    model_utils.get_query_embeddings_array([np.ones(1)])
+    assert len(models["2.4"].sessions) == 2
+    model_utils.close_query_session()
+
+
+def test_stale_idle_timer_keeps_the_session_open(monkeypatch):
+    import numpy as np
+
+    models = _fake_query_session(monkeypatch)
+    query_session = model_utils._QUERY_SESSION
+
+    model_utils.get_query_embeddings_array([np.ones(1)])
+    stale = query_session._idle_timer
+    # The timer fires while the next query holds the lock and runs after it
+    model_utils.get_query_embeddings_array([np.ones(1)])
+    stale.function()
+
+    assert not models["2.4"].sessions[0].closed
+    model_utils.close_query_session()
+    assert models["2.4"].sessions[0].closed
+
+
+def test_failed_query_closes_the_session(monkeypatch):
+    import numpy as np
+    import pytest
+
+    models = _fake_query_session(monkeypatch)
+    model_utils.get_query_embeddings_array([np.ones(1)])
+    models["2.4"].sessions[0].fail = True
+
+    with pytest.raises(RuntimeError, match="cancelled"):
+        model_utils.get_query_embeddings_array([np.ones(1)])
+
+    assert models["2.4"].sessions[0].closed
+    model_utils.get_query_embeddings_array([np.ones(1)])
+    assert len(models["2.4"].sessions) == 2
+    model_utils.close_query_session()
+
+
+def test_query_session_is_shared_between_threads(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    import numpy as np
+
+    models = _fake_query_session(monkeypatch)
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(
+            pool.map(
+                lambda i: model_utils.get_query_embeddings_array([np.ones(i)]),
+                range(1, 33),
+            )
+        )
+
+    assert [r.tolist() for r in results] == [[[float(i)]] for i in range(1, 33)]
+    assert len(models["2.4"].sessions) == 1
+    model_utils.close_query_session()
+
+
+def test_cancel_active_analyses_closes_the_query_session(monkeypatch):
+    import numpy as np
+    import pytest
+
+    models = _fake_query_session(monkeypatch)
+    model_utils.get_query_embeddings_array([np.ones(1)])
+
+    try:
+        model_utils.cancel_active_analyses()
+
+        session = models["2.4"].sessions[0]
+        assert session.cancelled
+        assert session.closed
+
+        with pytest.raises(RuntimeError, match="Shutting down"):
+            model_utils.get_query_embeddings_array([np.ones(1)])
+    finally:
+        model_utils._SHUTDOWN.clear()
+
+
+def test_pause_keeps_the_query_session(monkeypatch):
+    import numpy as np
+
+    models = _fake_query_session(monkeypatch)
+    model_utils.get_query_embeddings_array([np.ones(1)])
+
+    model_utils.pause_active_analyses()
+
+    assert not models["2.4"].sessions[0].closed
+    model_utils.close_query_session()
+
+
+def test_benchmark_query_session(monkeypatch, capsys):
+    import timeit
+
+    import numpy as np
+
+    _fake_query_session(monkeypatch)
+    monkeypatch.setattr(FakeEncodingSession, "startup_s", 0.02)
+    signals = [np.ones(10)]
+
+    t_new = min(
+        timeit.repeat(
+            lambda: model_utils.get_query_embeddings_array(signals),
+            number=10,
+            repeat=3,
+        )
+    )
+    t_ref = min(
+        timeit.repeat(
+            lambda: model_utils.get_embeddings_array(signals, n_workers=1),
+            number=10,
+            repeat=3,
+        )
+    )
+    model_utils.close_query_session()
+
+    with capsys.disabled():
+        print(
+            f"\nquery encoding (20ms session start): "
+            f"new={t_new / 10 * 1000:.2f}ms  ref={t_ref / 10 * 1000:.2f}ms  "
+            f"speedup={t_ref / t_new:.1f}x"
+        )
+
+    assert t_new < t_ref, (
+        f"Encoding with the shared session ({t_new / 10 * 1000:.2f}ms) should be "
+        f"faster than opening a session per query ({t_ref / 10 * 1000:.2f}ms)"
+    )
@@ -74,6 +74,19 @@ def test_read_and_crop_segments_returns_multiple_aligned(sine_wav):
     assert all(s.shape[0] == int(SIG_LENGTH * SR) for s in segs)
 
 
+def test_read_and_crop_smart_streams_file(sine_wav):
+    with patch("birdnet_analyzer.audio.open_audio_file") as mock_open_audio_file:
+        segs, labels = _read_and_crop_file(
+            sine_wav, _label(), sample_rate=SR, crop_mode="smart", sig_length=SIG_LENGTH
+        )
+
+    mock_open_audio_file.assert_not_called()
+    assert len(segs) >= 1
+    assert len(segs) == len(labels)
+    assert all(s.dtype == np.float32 for s in segs)
+    assert all(s.shape[0] == int(SIG_LENGTH * SR) for s in segs)
+
+
 def test_read_and_crop_bad_file_returns_empty():
     segs, labels = _read_and_crop_file(
         "does_not_exist.wav", _label(), sample_rate=SR, crop_mode="center"